@@ -0,0 +1,200 @@
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+from logger import logger
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+
+load_dotenv()
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a chat request is shed. 429 means the bot is over its own share, 503 that the
+    whole service is saturated; `retry_after` is the estimated wait in seconds.
+    """
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"Request rejected by admission control: {reason}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionTicket:
+    """
+    A granted slot. `release` is idempotent so both a streaming body and its background task
+    can call it.
+    """
+    def __init__(self, controller: Optional["AdmissionController"], bot_token: Optional[str]):
+        self.controller = controller
+        self.bot_token = bot_token
+        self.granted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        if self.controller is not None:
+            self.controller._release(self.bot_token, time.monotonic() - self.granted_at)
+
+
+class _Waiter:
+    def __init__(self, bot_token: str, future: asyncio.Future):
+        self.bot_token = bot_token
+        self.future = future
+
+
+class AdmissionController:
+    """
+    Limits concurrent chat requests per bot and in total, so one busy tenant cannot take the whole
+    LLM quota and Mongo pool.
+
+    A request runs at once when its bot has fewer than ADMISSION_PER_BOT_LIMIT requests in
+    flight and the service fewer than ADMISSION_GLOBAL_LIMIT. Otherwise it waits in a FIFO queue
+    of at most ADMISSION_QUEUE_SIZE requests (ADMISSION_PER_BOT_QUEUE_SIZE per bot); released
+    slots go to the oldest waiter whose bot has room.
+
+    Each request must finish within ADMISSION_DEADLINE seconds of arriving. From the running
+    average time a request holds its slot, a request that would not start early enough to finish
+    is shed on arrival instead of queueing, and a queued request is shed once its latest useful
+    start time passes. Shed requests get 429 when their bot is at its limit and 503 otherwise,
+    with a Retry-After estimate.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+        self.global_limit = int(os.getenv("ADMISSION_GLOBAL_LIMIT", "64"))
+        self.per_bot_limit = int(os.getenv("ADMISSION_PER_BOT_LIMIT", "8"))
+        self.queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+        self.per_bot_queue_size = int(os.getenv("ADMISSION_PER_BOT_QUEUE_SIZE", "32"))
+        self.deadline = float(os.getenv("ADMISSION_DEADLINE", "30"))
+        # Starting estimate of how long a request holds its slot, refined as requests complete
+        self._service_time = float(os.getenv("ADMISSION_INITIAL_SERVICE_TIME", "2"))
+        self._active: Dict[str, int] = defaultdict(int)
+        self._active_total = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._queued: Dict[str, int] = defaultdict(int)
+        self._counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_deadline": 0, "rejected_expired": 0}
+
+    def _has_room(self, bot_token: str) -> bool:
+        return self._active_total < self.global_limit and self._active.get(bot_token, 0) < self.per_bot_limit
+
+    def _expected_wait(self, bot_token: str) -> float:
+        # Each slot frees up about once per service time; wait for the requests queued ahead
+        waits = []
+        if self._active_total >= self.global_limit:
+            waits.append((len(self._waiters) + 1) / self.global_limit)
+        if self._active.get(bot_token, 0) >= self.per_bot_limit:
+            waits.append((self._queued.get(bot_token, 0) + 1) / self.per_bot_limit)
+        return max(waits, default=0.0) * self._service_time
+
+    def _grant(self, bot_token: str) -> AdmissionTicket:
+        self._active[bot_token] += 1
+        self._active_total += 1
+        self._counters["admitted"] += 1
+        return AdmissionTicket(self, bot_token)
+
+    def _dequeue(self, waiter: _Waiter):
+        self._waiters.remove(waiter)
+        self._queued[waiter.bot_token] -= 1
+        if not self._queued[waiter.bot_token]:
+            del self._queued[waiter.bot_token]
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    def _release(self, bot_token: str, held: float):
+        self._active[bot_token] -= 1
+        if not self._active[bot_token]:
+            del self._active[bot_token]
+        self._active_total -= 1
+        self._service_time = 0.9 * self._service_time + 0.1 * held
+        for waiter in list(self._waiters):
+            if self._active_total >= self.global_limit:
+                break
+            if not waiter.future.done() and self._active.get(waiter.bot_token, 0) < self.per_bot_limit:
+                self._dequeue(waiter)
+                waiter.future.set_result(self._grant(waiter.bot_token))
+
+    def _reject(self, bot_token: str, reason: str) -> AdmissionRejected:
+        status_code = 429 if self._active.get(bot_token, 0) >= self.per_bot_limit else 503
+        self._counters[f"rejected_{reason}"] += 1
+        ADMISSION_REJECTED.labels(reason, str(status_code)).inc()
+        retry_after = max(1, math.ceil(self._expected_wait(bot_token) or self._service_time))
+        return AdmissionRejected(status_code, retry_after, reason)
+
+    async def acquire(self, bot_token: str, deadline: Optional[float] = None) -> AdmissionTicket:
+        """
+        Waits for a slot for the bot.
+
+        Args:
+            bot_token (str): The bot the request is for.
+            deadline (float, optional): Seconds the request has to finish; defaults to ADMISSION_DEADLINE.
+
+        Returns:
+            AdmissionTicket: The slot, to be released when the request is done.
+
+        Raises:
+            AdmissionRejected: When the request cannot be served in time.
+        """
+        if not self.enabled:
+            return AdmissionTicket(None, bot_token)
+        if self._has_room(bot_token):
+            ADMISSION_WAIT.labels("admitted").observe(0)
+            return self._grant(bot_token)
+
+        if len(self._waiters) >= self.queue_size or self._queued.get(bot_token, 0) >= self.per_bot_queue_size:
+            raise self._reject(bot_token, "queue_full")
+        # Shed now rather than after a wait that cannot end in time
+        budget = self.deadline if deadline is None else deadline
+        if self._expected_wait(bot_token) + self._service_time > budget:
+            raise self._reject(bot_token, "deadline")
+
+        start = time.monotonic()
+        waiter = _Waiter(bot_token, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._queued[bot_token] += 1
+        self._counters["queued"] += 1
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        try:
+            # asyncio.wait leaves the future alone on timeout, so a grant racing the timeout is not lost
+            await asyncio.wait({waiter.future}, timeout=max(0.0, budget - self._service_time))
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                waiter.future.result().release()
+            else:
+                self._dequeue(waiter)
+            raise
+        waited = time.monotonic() - start
+        if waiter.future.done():
+            ADMISSION_WAIT.labels("admitted").observe(waited)
+            return waiter.future.result()
+
+        self._dequeue(waiter)
+        ADMISSION_WAIT.labels("expired").observe(waited)
+        logger.warning(f"Admission wait for bot {bot_token} expired after {waited:.2f} seconds.")
+        raise self._reject(bot_token, "expired")
+
+    @asynccontextmanager
+    async def slot(self, bot_token: str, deadline: Optional[float] = None):
+        ticket = await self.acquire(bot_token, deadline)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "active": self._active_total,
+            "active_bots": len(self._active),
+            "queue_depth": len(self._waiters),
+            "service_time_s": round(self._service_time, 3),
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,284 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from constants import async_client, ASSISTANT_INVALIDATIONS_COLLECTION_NAME, DB_NAME
+from logger import logger
+
+load_dotenv()
+
+
+class _CacheEntry:
+    """
+    A cached assistant lookup together with the time it was fetched.
+    """
+    __slots__ = ("value", "fetched_at", "negative")
+
+    def __init__(self, value: dict, negative: bool):
+        self.value = value
+        self.fetched_at = time.monotonic()
+        self.negative = negative
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class AssistantCache:
+    """
+    Async per-bot_token cache of the admin backend's assistant details.
+
+    Fresh entries are served directly. Entries older than the TTL but still inside the
+    stale window are served immediately while a single background refresh runs. Unknown
+    (404) and inactive assistants are cached for a shorter negative TTL. Concurrent misses
+    for the same bot_token share one backend request. At most ASSISTANT_CACHE_SIZE bots are
+    kept, evicting the least recently used, and expired entries are dropped as they reach the
+    cold end of the LRU.
+
+    Each worker has its own cache. `broadcast_invalidation` drops entries here and records the
+    invalidation in the assistant invalidations collection; every worker started with `start`
+    polls that collection every ASSISTANT_CACHE_SYNC_INTERVAL seconds and drops the same
+    entries, so an explicit invalidation reaches all workers within that interval. Listeners
+    added with `on_invalidate` run for every invalidation, local or synced.
+    """
+    def __init__(self, invalidations_collection=None):
+        self.ttl = float(os.getenv("ASSISTANT_CACHE_TTL", "300"))
+        self.stale_ttl = float(os.getenv("ASSISTANT_CACHE_STALE_TTL", "3600"))
+        self.negative_ttl = float(os.getenv("ASSISTANT_CACHE_NEGATIVE_TTL", "30"))
+        self.request_timeout = float(os.getenv("ASSISTANT_REQUEST_TIMEOUT", "5"))
+        self.max_connections = int(os.getenv("ASSISTANT_MAX_CONNECTIONS", "20"))
+        self.max_size = int(os.getenv("ASSISTANT_CACHE_SIZE", "10000"))
+        self.sync_interval = float(os.getenv("ASSISTANT_CACHE_SYNC_INTERVAL", "5"))
+        self.invalidations = invalidations_collection
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refresh_tasks = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._listeners: List[Callable[[Optional[str], Optional[dict]], None]] = []
+        self._worker_id = uuid.uuid4().hex
+        self._synced_at: Optional[datetime] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "invalidations": 0,
+            "synced_invalidations": 0,
+            "evictions": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.request_timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    def start(self):
+        """
+        Starts applying invalidations recorded by other workers.
+        """
+        if self.invalidations is None or self.sync_interval <= 0:
+            return
+        if self._sync_task is not None and not self._sync_task.done():
+            return
+        self._synced_at = datetime.utcnow()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def close(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch(self, bot_token: str) -> dict:
+        url = os.getenv("BACKEND_ENDPOINT") + f"/assistants/get-assistant-details/{bot_token}/"
+        response = await self._get_client().get(url)
+        return {"status": response.status_code, "data": response.json()}
+
+    def _expired(self, entry: _CacheEntry) -> bool:
+        return entry.age() >= (self.negative_ttl if entry.negative else self.ttl + self.stale_ttl)
+
+    def _store(self, bot_token: str, entry: _CacheEntry):
+        self._entries[bot_token] = entry
+        self._entries.move_to_end(bot_token)
+        # Expired entries at the cold end go even under the cap; then the least recently used
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_size and not self._expired(oldest):
+                break
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    @staticmethod
+    def _is_negative(details: dict) -> bool:
+        if details["status"] == 404:
+            return True
+        return details["status"] == 200 and details["data"].get("status") != "ACTIVE"
+
+    async def _load(self, bot_token: str) -> dict:
+        """
+        Fetches the assistant from the backend and stores the result. Requests for the same
+        bot_token that arrive while a fetch is running await that fetch instead of starting their own.
+        """
+        inflight = self._inflight.get(bot_token)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[bot_token] = future
+        try:
+            details = await self._fetch(bot_token)
+            if details["status"] == 200 or self._is_negative(details):
+                self._store(bot_token, _CacheEntry(details, self._is_negative(details)))
+            future.set_result(details)
+            return details
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.error(f"Failed to Fetch Assistant Details Bot Token: {bot_token} - Error : {str(e)}")
+            stale = self._entries.get(bot_token)
+            details = stale.value if stale else {"status": 503, "data": {"message": "Failed to fetch assistant details"}}
+            future.set_result(details)
+            return details
+        finally:
+            if not future.done():
+                future.cancel()
+            self._inflight.pop(bot_token, None)
+
+    async def _refresh(self, bot_token: str):
+        self._counters["refreshes"] += 1
+        await self._load(bot_token)
+
+    async def get(self, bot_token: str) -> dict:
+        """
+        Returns the assistant details for a bot in the same shape as `utils.get_assistant_details`.
+
+        Args:
+            bot_token (str): The bot whose assistant configuration is requested.
+
+        Returns:
+            dict: {"status": <backend status code>, "data": <backend response body>}
+        """
+        entry = self._entries.get(bot_token)
+        if entry is not None:
+            self._entries.move_to_end(bot_token)
+            age = entry.age()
+            if entry.negative:
+                if age < self.negative_ttl:
+                    self._counters["negative_hits"] += 1
+                    return entry.value
+            elif age < self.ttl:
+                self._counters["hits"] += 1
+                return entry.value
+            elif age < self.ttl + self.stale_ttl:
+                self._counters["stale_hits"] += 1
+                if bot_token not in self._inflight:
+                    task = asyncio.create_task(self._refresh(bot_token))
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._refresh_tasks.discard)
+                return entry.value
+
+        self._counters["misses"] += 1
+        return await self._load(bot_token)
+
+    def peek(self, bot_token: str) -> Optional[dict]:
+        """
+        Returns the cached assistant response for a bot, if any, without fetching or refreshing it.
+        """
+        entry = self._entries.get(bot_token)
+        return entry.value if entry is not None else None
+
+    def on_invalidate(self, listener: Callable[[Optional[str], Optional[dict]], None]):
+        """
+        Registers `listener(bot_token, cached)` to run whenever a bot, or every bot when
+        `bot_token` is None, is invalidated in this worker. `cached` is the dropped response.
+        """
+        self._listeners.append(listener)
+
+    def invalidate(self, bot_token: Optional[str] = None) -> int:
+        """
+        Drops one bot's cached assistant in this worker, or every cached assistant when no
+        bot_token is given.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        self._counters["invalidations"] += 1
+        cached = self.peek(bot_token) if bot_token is not None else None
+        for listener in self._listeners:
+            try:
+                listener(bot_token, cached)
+            except Exception as e:
+                logger.error(f"Assistant invalidation listener failed for Bot token: {bot_token} - {e}")
+        if bot_token is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        return 1 if self._entries.pop(bot_token, None) is not None else 0
+
+    async def broadcast_invalidation(self, bot_token: Optional[str] = None) -> int:
+        """
+        Invalidates a bot, or every bot, here and records it for the other workers to apply.
+
+        Returns:
+            int: The number of entries removed in this worker.
+        """
+        removed = self.invalidate(bot_token)
+        if self.invalidations is not None:
+            await self.invalidations.update_one(
+                {"bot_token": bot_token or "*"},
+                {"$set": {"invalidated_at": datetime.utcnow(), "worker": self._worker_id}},
+                upsert=True,
+            )
+        return removed
+
+    async def sync(self):
+        """
+        Applies the invalidations other workers recorded since the last sync. Timestamps come
+        from the recording workers' clocks, which are assumed to be kept in sync.
+        """
+        latest = self._synced_at
+        async for doc in self.invalidations.find({"invalidated_at": {"$gt": self._synced_at}}):
+            latest = max(latest, doc["invalidated_at"])
+            if doc.get("worker") == self._worker_id:
+                continue
+            self._counters["synced_invalidations"] += 1
+            self.invalidate(None if doc["bot_token"] == "*" else doc["bot_token"])
+        self._synced_at = latest
+
+    async def _sync_loop(self):
+        try:
+            await self.invalidations.create_index("invalidated_at")
+        except Exception as e:
+            logger.warning(f"Failed to index assistant cache invalidations - {e}")
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Failed to sync assistant cache invalidations - {e}")
+
+    def stats(self) -> dict:
+        lookups = self._counters["hits"] + self._counters["stale_hits"] + self._counters["negative_hits"] + self._counters["misses"]
+        hits = lookups - self._counters["misses"]
+        return {
+            **self._counters,
+            "size": len(self._entries),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+assistant_cache = AssistantCache(async_client[DB_NAME][ASSISTANT_INVALIDATIONS_COLLECTION_NAME])
@@ -0,0 +1,51 @@
+"""
+Measures the per-request Python overhead of building LangChain chains.
+
+Times building the V1 answer, follow-up and V2 chains from scratch on every call (the
+previous behaviour) against fetching them from `chain_cache`, and creating a Gemini client
+per request against reusing the shared one from `constants.llm_model`. Nothing external is
+contacted.
+
+    python -m benchmarks.chain_build --iterations 2000
+"""
+import argparse
+import os
+import time
+
+from benchmarks.fakes import FAKE_PROMPTS, FakeChatModel
+from bot_response import _build_follow_up_chain, _build_v1_chains, _build_v2_chains
+from chain_cache import ChainCache
+
+BUILDERS = {"v1_answer": _build_v1_chains, "follow_up": _build_follow_up_chain, "v2": _build_v2_chains}
+
+
+def per_call_us(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    llm = FakeChatModel()
+    cache = ChainCache()
+    for kind, builder in BUILDERS.items():
+        built = per_call_us(lambda: builder(llm, FAKE_PROMPTS), args.iterations)
+        cached = per_call_us(lambda: cache.get(kind, llm, FAKE_PROMPTS, builder), args.iterations)
+        print(f"{kind:>10}: build {built:8.1f} us/request  cached {cached:6.1f} us/request")
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-key")
+    os.environ.setdefault("MODEL_NAME", "gemini-1.5-flash")
+    from constants import _chat_model, llm_model
+    iterations = max(1, args.iterations // 10)
+    fresh = per_call_us(lambda: _chat_model.__wrapped__(os.getenv("MODEL_NAME"), os.getenv("GOOGLE_API_KEY")), iterations)
+    shared = per_call_us(llm_model, iterations)
+    print(f"{'llm client':>10}: build {fresh:8.1f} us/request  cached {shared:6.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
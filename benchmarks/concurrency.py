@@ -0,0 +1,43 @@
+"""
+Measures how many chats one event loop can keep in flight.
+
+Runs `bot_response.generate_answer` concurrently against a fake LLM, once with a model whose
+async path blocks the loop (the behaviour of the old sync `invoke` calls) and once with a
+truly async model. Nothing external is contacted.
+
+    python -m benchmarks.concurrency --concurrency 100 --latency 0.2
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.documents.base import Document
+
+from benchmarks.fakes import FAKE_PROMPTS, FakeChatModel, FakeRetriever
+from bot_response import generate_answer
+
+
+async def run(concurrency: int, latency: float, blocking: bool) -> float:
+    llm = FakeChatModel(latency=latency, blocking=blocking)
+    retriever = FakeRetriever(documents=[Document(page_content="Our plans start at $10 per month.")])
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        generate_answer("What are your prices?", retriever, [], llm, prompts=FAKE_PROMPTS)
+        for _ in range(concurrency)
+    ])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    args = parser.parse_args()
+
+    for label, blocking in (("blocking", True), ("async", False)):
+        elapsed = asyncio.run(run(args.concurrency, args.latency, blocking))
+        print(f"{label:>8}: {args.concurrency} chats in {elapsed:.2f}s -> {args.concurrency / elapsed:.1f} chats/s")
+
+
+if __name__ == "__main__":
+    main()
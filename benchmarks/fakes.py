@@ -0,0 +1,273 @@
+"""
+Offline stand-ins for the external services the chat pipeline talks to.
+"""
+import asyncio
+import copy
+import hashlib
+import random
+import re
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+from pymongo import DeleteMany
+from pymongo.errors import DuplicateKeyError
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model that answers after a fixed latency.
+
+    With `blocking=True` the async path sleeps synchronously, which reproduces a client that
+    blocks the event loop the way the old `invoke` calls inside async handlers did. With
+    `tokens_per_second` set, each word of the answer additionally takes 1 / tokens_per_second
+    seconds, and streaming yields the words at that rate after `latency`. With `slow_rate` set,
+    that fraction of calls takes `slow_latency` instead of `latency`, giving the heavy tail that
+    hedging targets.
+    """
+    latency: float = 0.2
+    blocking: bool = False
+    answer: str = "This is a canned answer from the fake model."
+    tokens_per_second: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\S+\s*", self.answer)
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _latency(self) -> float:
+        return self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        input_tokens = sum(len(str(message.content).split()) for message in messages)
+        output_tokens = len(self._tokens())
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        message = AIMessage(content=self.answer, usage_metadata=usage, response_metadata={"model_name": self._llm_type})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency() + self._token_delay() * len(self._tokens()))
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        delay = self._latency() + self._token_delay() * len(self._tokens())
+        if self.blocking:
+            time.sleep(delay)
+        else:
+            await asyncio.sleep(delay)
+        return self._result(messages)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._latency())
+        for token in self._tokens():
+            if self.tokens_per_second:
+                await asyncio.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeRetriever(BaseRetriever):
+    """
+    Returns the same small set of documents for every query.
+    """
+    documents: List[Document] = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.documents
+
+
+class FakeEmbeddingModel:
+    """
+    Stand-in for ListConvertedText2vecEmbeddings: a hashed bag-of-words vector, so texts that
+    share words are similar and nothing has to be downloaded.
+    """
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+            vector[digest % self.dim] += 1.0 if digest & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode_batch(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text).tolist()
+
+
+def _matches_condition(value: Any, condition: Any) -> bool:
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == "$in" and value not in operand:
+            return False
+        if operator == "$nin" and value in operand:
+            return False
+        if operator == "$exists" and (value is not None) != operand:
+            return False
+        if operator == "$lt" and (value is None or not value < operand):
+            return False
+        if operator == "$gt" and (value is None or not value > operand):
+            return False
+    return True
+
+
+def _matches(document: dict, query: dict) -> bool:
+    return all(_matches_condition(document.get(field), condition) for field, condition in query.items())
+
+
+class _Cursor(list):
+    """
+    Query results that can be iterated like a pymongo cursor or `async for`-ed like a motor one.
+    """
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self:
+            yield document
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    document = copy.deepcopy(document)
+    for field, spec in (projection or {}).items():
+        if spec == 0:
+            document.pop(field, None)
+        elif isinstance(spec, dict) and "$slice" in spec and isinstance(document.get(field), list):
+            document[field] = document[field][spec["$slice"]:]
+    return document
+
+
+class InMemoryCollection:
+    """
+    The subset of a Mongo collection the chat and ingestion paths use, kept in a list. Queries
+    support equality, `$in`, `$nin`, `$exists`, `$lt` and `$gt` filters and exclusion or
+    `$slice` projections; updates support `$set`, `$setOnInsert`, `$inc`, `$push` with
+    `$each`/`$slice` and `$pull` of `$in` matches. Unique indexes raise DuplicateKeyError.
+    `find` returns a cursor usable both synchronously like pymongo's and with `async for` like
+    motor's; the other operations are coroutines like motor's.
+    """
+    def __init__(self, documents: Optional[List[dict]] = None):
+        self.documents: List[dict] = []
+        self.latency = 0.0
+        self.unique_keys: List[tuple] = []
+        self._next_id = 0
+        for document in documents or []:
+            self._insert(document)
+
+    def _insert(self, document: dict):
+        # Like pymongo, the generated _id is also set on the caller's document
+        self._next_id += 1
+        document.setdefault("_id", hashlib.sha1(repr((self._next_id, sorted(document.items(), key=str))).encode()).hexdigest()[:24])
+        document = copy.deepcopy(document)
+        for keys in self.unique_keys:
+            key = tuple(document.get(field) for field in keys)
+            if any(tuple(existing.get(field) for field in keys) == key for existing in self.documents):
+                raise DuplicateKeyError(f"E11000 duplicate key error: {dict(zip(keys, key))}")
+        self.documents.append(document)
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        return _Cursor(_project(document, projection) for document in self.documents if _matches(document, query or {}))
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None):
+        await asyncio.sleep(self.latency)
+        for document in self.documents:
+            if _matches(document, query):
+                return _project(document, projection)
+        return None
+
+    async def insert_one(self, document: dict):
+        await asyncio.sleep(self.latency)
+        self._insert(document)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True):
+        await asyncio.sleep(self.latency)
+        for document in documents:
+            self._insert(document)
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        if unique:
+            self.unique_keys.append((keys,) if isinstance(keys, str) else tuple(field for field, _ in keys))
+        return None
+
+    async def bulk_write(self, operations: List[Any], ordered: bool = True):
+        await asyncio.sleep(self.latency)
+        deleted = 0
+        for operation in operations:
+            if isinstance(operation, DeleteMany):
+                deleted += self._delete(operation._filter)
+            else:
+                self._update(operation._filter, operation._doc, operation._upsert)
+        return SimpleNamespace(deleted_count=deleted)
+
+    async def delete_many(self, query: dict):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(deleted_count=self._delete(query))
+
+    async def delete_one(self, query: dict):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(deleted_count=self._delete(query, limit=1))
+
+    def _delete(self, query: dict, limit: Optional[int] = None) -> int:
+        matched = {id(document) for document in [document for document in self.documents if _matches(document, query)][:limit]}
+        self.documents = [document for document in self.documents if id(document) not in matched]
+        return len(matched)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(matched_count=self._update(query, update, upsert))
+
+    def _update(self, query: dict, update: dict, upsert: bool) -> int:
+        document = next((document for document in self.documents if _matches(document, query)), None)
+        matched = int(document is not None)
+        if document is None:
+            if not upsert:
+                return 0
+            # Like Mongo, only the equality conditions of the filter seed the new document
+            seed = {field: value for field, value in query.items() if not (isinstance(value, dict) and any(key.startswith("$") for key in value))}
+            self._insert({**seed, **update.get("$setOnInsert", {})})
+            document = self.documents[-1]
+        document.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            document[field] = (document.get(field) or 0) + amount
+        for field, condition in update.get("$pull", {}).items():
+            document[field] = [
+                value for value in document.get(field, [])
+                if not all(value.get(key) in spec["$in"] for key, spec in condition.items())
+            ]
+        for field, push in update.get("$push", {}).items():
+            values = document.setdefault(field, [])
+            values.extend(push["$each"] if isinstance(push, dict) else [push])
+            if isinstance(push, dict) and "$slice" in push:
+                document[field] = values[push["$slice"]:]
+        return matched
+
+
+FAKE_PROMPTS = {
+    "STANDALONE_QUESTION_PROMPT": "Rephrase the follow up question as a standalone question.",
+    "QUESTION_ANSWER_PROMPT": "Answer the question using only this context:\n{context}",
+    "GENERATE_FOLLOWUP_QUESTIONS_PROMPT": "History: {chat_history}\nQuestion: {current_question}\nContext: {context}\nSuggest three follow up questions.\n{format_instructions}",
+}
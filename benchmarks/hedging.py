@@ -0,0 +1,98 @@
+"""
+Measures what hedged LLM calls do to tail latency and request volume.
+
+Runs the same prompt | model | parser chain through `LLMExecutor` against a fake chat model
+whose calls occasionally take much longer (--slow-rate, --slow-latency), once without hedging,
+once hedged at the configured percentile, and once with a deadline below the slow latency and
+a fast fallback model. Reports p50/p95/p99, the extra model requests hedging cost, and the
+outcome counters. Nothing external is contacted.
+
+    python -m benchmarks.hedging --calls 400 --slow-rate 0.05 --slow-latency 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from benchmarks.fakes import FakeChatModel
+
+PROMPT = PromptTemplate.from_template("Rewrite as a standalone question: {question}")
+
+
+class CountingChatModel(FakeChatModel):
+    requests: int = 0
+
+    async def _agenerate(self, *args, **kwargs):
+        self.requests += 1
+        return await super()._agenerate(*args, **kwargs)
+
+
+async def run(label: str, executor, model: CountingChatModel, calls: int, concurrency: int, fallback: CountingChatModel = None) -> dict:
+    chain = PROMPT | model | StrOutputParser()
+    fallback_chain = PROMPT | fallback | StrOutputParser() if fallback is not None else None
+    latencies: List[float] = []
+    failures = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def call(index: int):
+        nonlocal failures
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await executor.run("rewrite", chain, {"question": f"question {index}"}, fallback=fallback_chain)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*[call(i) for i in range(calls)])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+    stats = executor.stats().get("rewrite", {})
+    # Requests to the fallback model cost quota too
+    requests = model.requests + (fallback.requests if fallback is not None else 0)
+    print(f"{label:>22}: p50 {p50:7.1f}ms  p95 {p95:7.1f}ms  p99 {p99:7.1f}ms  "
+          f"model requests {requests / calls:5.2f}/call  failures {failures}")
+    print(f"{'':>22}  {stats}")
+
+
+def executor_with(**env):
+    # The executor reads its settings when constructed
+    os.environ.update({key: str(value) for key, value in env.items()})
+    from llm_executor import LLMExecutor
+    return LLMExecutor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="usual fake model latency, seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of calls that are slow")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="latency of a slow call, seconds")
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def model():
+        return CountingChatModel(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+
+    common = {"LLM_HEDGE_CALLS": "rewrite", "LLM_HEDGE_MIN_SAMPLES": 20, "LLM_HEDGE_INITIAL_DELAY": args.latency * 2,
+              "LLM_HEDGE_MIN_DELAY": args.latency / 2, "LLM_HEDGE_PERCENTILE": args.percentile}
+    scenarios = [
+        ("no hedging", executor_with(**common, LLM_HEDGE_ENABLED="false", LLM_DEADLINE_REWRITE=60), None),
+        (f"hedged at p{args.percentile:g}", executor_with(**common, LLM_HEDGE_ENABLED="true", LLM_DEADLINE_REWRITE=60), None),
+        ("deadline + fallback", executor_with(**common, LLM_HEDGE_ENABLED="false", LLM_DEADLINE_REWRITE=args.slow_latency / 2,
+                                               LLM_FALLBACK_DEADLINE=args.latency * 5), CountingChatModel(latency=args.latency / 2)),
+    ]
+    for label, executor, fallback in scenarios:
+        random.seed(args.seed)
+        asyncio.run(run(label, executor, model(), args.calls, args.concurrency, fallback))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Offline load test of the chat endpoints.
+
+Drives `main.app` in-process through httpx's ASGI transport with concurrent simulated
+sessions. Gemini is replaced by a deterministic fake with configurable latency and token
+rate, Mongo by in-memory collections, the admin backend by a canned assistant, and Atlas by
+the local vector index over a synthetic corpus, so runs are free and repeatable.
+
+Reports p50/p95/p99 latency, requests per second and a per-stage breakdown taken from the
+Server-Timing header for each endpoint, and writes them as JSON. With --baseline the run is
+compared against an earlier result and exits with status 1 when the p95 of the request or of
+any stage regresses by more than --tolerance.
+
+    python -m benchmarks.load --sessions 50 --turns 4 --output load.json
+    python -m benchmarks.load --llm-latency 0.5 --tokens-per-second 60 --baseline load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+TOPICS = ["pricing", "billing", "refunds", "shipping", "returns", "warranty", "support", "accounts", "security", "integrations"]
+QUESTIONS = [
+    "What are your pricing plans?",
+    "How does billing work for annual plans?",
+    "Can I get a refund after 30 days?",
+    "How long does shipping take?",
+    "What is your return policy?",
+    "What does the warranty cover?",
+    "How do I contact support?",
+    "How do I delete my account?",
+    "How is my data secured?",
+    "Which integrations do you offer?",
+]
+FOLLOW_UPS = ["Tell me more about that.", "How much does it cost?", "And what about enterprise customers?"]
+BOT_TOKEN = "benchmark-bot"
+
+
+def configure_environment(args):
+    # Read at import time by the modules below, so it has to happen before main is imported
+    os.environ.setdefault("MONGO_DB_URI", "mongodb://localhost:27017")
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["LOCAL_VECTOR_DIR"] = tempfile.mkdtemp(prefix="sara-bench-")
+    os.environ["SERVER_TIMING_ENABLED"] = "true"
+    os.environ["FOLLOW_UPS_ENABLED"] = "true" if args.follow_ups else "false"
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "true" if args.semantic_cache else "false"
+    os.environ["SINGLEFLIGHT_ENABLED"] = "true" if args.singleflight else "false"
+
+
+def synthetic_corpus(chunks: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    words = "plan price month year customer order team account data policy service request".split()
+    corpus = []
+    for i in range(chunks):
+        topic = TOPICS[i % len(TOPICS)]
+        body = " ".join(rng.choice(words) for _ in range(120))
+        corpus.append({
+            "bot_token": BOT_TOKEN,
+            "content": f"{topic} {topic} details: {body}",
+            "title": f"{topic.title()} page {i}",
+            "summary": f"How {topic} works.",
+            "source": f"https://example.com/{topic}/{i}",
+        })
+    return corpus
+
+
+def install_fakes(args):
+    """
+    Points the app's external dependencies at the offline fakes.
+    """
+    import constants
+    import main
+    import utils
+    from assistant_cache import assistant_cache
+    from benchmarks.fakes import FAKE_PROMPTS, FakeChatModel, FakeEmbeddingModel, InMemoryCollection
+    from history_store import history_store
+    from vector_store import EmbeddingModelManager
+
+    embedder = FakeEmbeddingModel()
+    EmbeddingModelManager().embedding_model = embedder
+    corpus = synthetic_corpus(args.chunks, args.seed)
+    vectors = embedder.encode_batch([chunk["content"] for chunk in corpus])
+    chunks = InMemoryCollection([{**chunk, "embedding": vector.tolist()} for chunk, vector in zip(corpus, vectors)])
+    constants.collection = chunks
+    constants.corpus_versions_collection = InMemoryCollection()
+    utils.collection = chunks
+
+    history = InMemoryCollection()
+    history.latency = args.mongo_latency
+    history_store.collection = history
+    if history_store.writer is not None:
+        history_store.writer.collection = history
+
+    llm = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second, answer=" ".join(["word"] * args.answer_tokens))
+    main.llm_model = lambda: llm
+
+    async def fetch_assistant(bot_token):
+        await asyncio.sleep(args.backend_latency)
+        return {"status": 200, "data": {"status": "ACTIVE", "prompts": FAKE_PROMPTS}}
+    assistant_cache._fetch = fetch_assistant
+    assistant_cache.invalidations = InMemoryCollection()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2), "mean": round(float(np.mean(values)), 2)}
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, duration = entry.partition(";dur=")
+        stages[name] = float(duration or 0)
+    return stages
+
+
+async def run_endpoint(client, endpoint: str, args) -> dict:
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    errors = 0
+
+    async def session(session_index: int):
+        nonlocal errors
+        session_id = f"{endpoint}-{session_index}"
+        for turn in range(args.turns):
+            question = rng.choice(QUESTIONS) if turn == 0 else rng.choice(FOLLOW_UPS + QUESTIONS)
+            start = time.perf_counter()
+            response = await client.post(endpoint, json={"question": question, "session_id": session_id, "bot_token": BOT_TOKEN})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+                continue
+            for name, duration in parse_server_timing(response.headers.get("server-timing")).items():
+                stages.setdefault(name, []).append(duration)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[session(i) for i in range(args.sessions)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "stages_ms": {name: percentiles(values) for name, values in sorted(stages.items())},
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    import main
+    from embedding_service import embedding_service
+    from history_store import history_store
+
+    embedding_service.start()
+    history_store.start()
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark", timeout=None) as client:
+            # Build the local vector and BM25 indexes before timing anything
+            await client.post("/chat/", json={"question": QUESTIONS[0], "session_id": "warm-up", "bot_token": BOT_TOKEN})
+            for endpoint in args.endpoints:
+                results[endpoint] = await run_endpoint(client, endpoint, args)
+    finally:
+        await embedding_service.stop()
+        await history_store.stop()
+    return results
+
+
+def regressions(current: dict, baseline: dict, tolerance: float, floor_ms: float = 1.0) -> List[str]:
+    found = []
+    for endpoint, result in current["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        pairs = [("request", result["latency_ms"], previous["latency_ms"])]
+        pairs += [(f"stage {name}", stats, previous["stages_ms"][name]) for name, stats in result["stages_ms"].items() if name in previous["stages_ms"]]
+        for label, now, before in pairs:
+            if now["p95"] > before["p95"] * (1 + tolerance) and now["p95"] - before["p95"] > floor_ms:
+                found.append(f"{endpoint} {label}: p95 {before['p95']}ms -> {now['p95']}ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=["/chat/", "/chat_v1/"])
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent simulated sessions per endpoint")
+    parser.add_argument("--turns", type=int, default=4, help="sequential questions per session")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake LLM time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="fake LLM generation rate; 0 returns instantly")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--mongo-latency", type=float, default=0.002, help="latency of each in-memory Mongo call, seconds")
+    parser.add_argument("--backend-latency", type=float, default=0.02, help="latency of the assistant details call, seconds")
+    parser.add_argument("--chunks", type=int, default=500, help="size of the synthetic corpus")
+    parser.add_argument("--semantic-cache", action="store_true")
+    parser.add_argument("--follow-ups", action="store_true")
+    parser.add_argument("--singleflight", action="store_true", help="coalesce identical concurrent first questions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative p95 increase before failing")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    install_fakes(args)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    report = {"config": config, "endpoints": asyncio.run(run(args))}
+
+    for endpoint, result in report["endpoints"].items():
+        latency = result["latency_ms"]
+        print(f"{endpoint}: {result['requests']} requests, {result['errors']} errors, {result['rps']} req/s, "
+              f"p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms")
+        for name, stats in result["stages_ms"].items():
+            print(f"    {name:>22}: p50 {stats['p50']:8.2f}ms  p95 {stats['p95']:8.2f}ms")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = regressions(report, json.load(baseline_file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
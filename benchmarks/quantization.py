@@ -0,0 +1,79 @@
+"""
+Compares quantized embedding storage against float32 on recall@k, memory and query time.
+
+Scores synthetic clustered embeddings (or a .npy matrix of real ones) stored as float32,
+float16 and int8, with and without float32 rescoring of the top candidates, and reports
+recall@k against exact float32 search. Nothing external is contacted.
+
+    python -m benchmarks.quantization --rows 50000 --dim 768 --k 5
+    python -m benchmarks.quantization --embeddings corpus.npy
+"""
+import argparse
+import time
+
+import numpy as np
+
+from quantization import QuantizedMatrix, SUPPORTED_DTYPES
+
+
+def synthetic_embeddings(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    # Clustered vectors resemble sentence embeddings more than uniform noise does
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    matrix = centers[rng.integers(clusters, size=rows)] + 0.5 * rng.normal(size=(rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    rows = np.argpartition(-scores, k - 1)[:k]
+    return rows[np.argsort(-scores[rows])]
+
+
+def run(matrix: np.ndarray, queries: np.ndarray, k: int, dtype: str, rescore_factor: int):
+    vectors = QuantizedMatrix.quantize(matrix, dtype)
+    hits = 0
+    elapsed = 0.0
+    for query in queries:
+        expected = set(top_k(matrix @ query, k))
+        start = time.perf_counter()
+        rows = top_k(vectors.scores(query), k * rescore_factor if rescore_factor else k)
+        if rescore_factor:
+            rows = rows[top_k(matrix[rows] @ query, k)]
+        elapsed += time.perf_counter() - start
+        hits += len(expected.intersection(rows.tolist()))
+    return hits / (k * len(queries)), vectors.nbytes, 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--embeddings", help="a .npy matrix of real embeddings to use instead of synthetic ones")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        matrix = np.load(args.embeddings).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    else:
+        matrix = synthetic_embeddings(args.rows, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    # Perturbed corpus rows stand in for queries that are close to, but not exactly, a chunk
+    queries = matrix[rng.integers(len(matrix), size=args.queries)] + 0.05 * rng.normal(size=(args.queries, matrix.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    baseline = matrix.nbytes
+    print(f"{len(matrix)} vectors x {matrix.shape[1]} dims, {args.queries} queries, recall@{args.k}")
+    for dtype in SUPPORTED_DTYPES:
+        for rescore_factor in ((0, args.rescore_factor) if dtype != "float32" else (0,)):
+            recall, nbytes, query_ms = run(matrix, queries, args.k, dtype, rescore_factor)
+            label = f"{dtype}{' + rescore' if rescore_factor else ''}"
+            print(f"{label:>17}: recall {recall:.4f}  memory {nbytes / 2**20:8.1f} MiB ({nbytes / baseline:.0%})  {query_ms:6.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
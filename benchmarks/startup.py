@@ -0,0 +1,142 @@
+"""
+Measures cold-start time and per-worker memory.
+
+Cold start: in fresh interpreters, the time to import `main` and the time until the shared
+resources are warmed (embedding model loaded and one query embedded), as the median of --runs.
+
+Workers: starts gunicorn with gunicorn.conf.py once with PRELOAD_APP=true and once with
+PRELOAD_APP=false, waits until every worker reports its warm up done on /ready, and reads each
+process's RSS and PSS from /proc. RSS counts shared pages in full for every process, so the
+proportional set size (PSS) is what shows the model weights being shared copy-on-write. Needs
+Linux, gunicorn and the embedding model; Mongo does not have to be reachable.
+
+    python -m benchmarks.startup --runs 3 --workers 4 --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_COLD_START = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from vector_store import resources
+resources.warm_up()
+print(json.dumps({"import_s": imported - start, "warm_s": time.perf_counter() - start, "error": resources.error}))
+"""
+
+
+def cold_start(runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _COLD_START], cwd=ROOT, capture_output=True, text=True, check=True)
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {
+        "import_s": round(statistics.median(sample["import_s"] for sample in samples), 3),
+        "ready_s": round(statistics.median(sample["warm_s"] for sample in samples), 3),
+        "warm_up_error": samples[-1]["error"],
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as children_file:
+        return [int(child) for child in children_file.read().split()]
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    usage = {}
+    with open(f"/proc/{pid}/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    with open(f"/proc/{pid}/smaps_rollup") as smaps_file:
+        for line in smaps_file:
+            if line.startswith("Pss:"):
+                usage["pss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    return usage
+
+
+def serve(preload: bool, workers: int, timeout: float) -> dict:
+    port = _free_port()
+    env = {**os.environ, "PRELOAD_APP": str(preload).lower(), "WEB_CONCURRENCY": str(workers), "BIND": f"127.0.0.1:{port}"}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"preload": preload, "workers": workers}
+    try:
+        warmed, serving_s = set(), None
+        deadline = time.monotonic() + timeout
+        while len(warmed) < workers and time.monotonic() < deadline:
+            try:
+                status = httpx.get(f"http://127.0.0.1:{port}/ready", timeout=5).json()
+            except httpx.HTTPError:
+                time.sleep(0.1)
+                continue
+            serving_s = serving_s or time.perf_counter() - start
+            # Each response comes from whichever worker accepted it; a new connection per poll
+            # spreads them, and the worker's pid tells them apart
+            if status.get("warmup_seconds") is not None or status.get("error"):
+                warmed.add(status.get("pid"))
+            time.sleep(0.05)
+        result["first_request_s"] = round(serving_s, 3) if serving_s else None
+        result["all_warm_s"] = round(time.perf_counter() - start, 3) if len(warmed) >= workers else None
+        worker_memory = [memory_mb(pid) for pid in _children(server.pid)]
+        result["master"] = memory_mb(server.pid)
+        result["per_worker"] = worker_memory
+        for key in ("rss_mb", "pss_mb"):
+            values = [usage.get(key, 0.0) for usage in worker_memory]
+            result[f"worker_{key}_mean"] = round(statistics.mean(values), 1) if values else 0.0
+        result["total_pss_mb"] = round(result["master"].get("pss_mb", 0.0) + sum(usage.get("pss_mb", 0.0) for usage in worker_memory), 1)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to take the cold start median over")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for all workers to warm up")
+    parser.add_argument("--skip-workers", action="store_true", help="only measure cold start")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    report = {"cold_start": cold_start(args.runs)}
+    cold = report["cold_start"]
+    print(f"cold start: import {cold['import_s']}s, warm {cold['ready_s']}s" + (f" (warm up error: {cold['warm_up_error']})" if cold["warm_up_error"] else ""))
+
+    if not args.skip_workers:
+        report["servers"] = [serve(preload, args.workers, args.timeout) for preload in (False, True)]
+        for result in report["servers"]:
+            print(f"preload={str(result['preload']).lower():5} workers={result['workers']}: "
+                  f"first request {result['first_request_s']}s, all warm {result['all_warm_s']}s, "
+                  f"worker RSS {result['worker_rss_mb_mean']}MB PSS {result['worker_pss_mb_mean']}MB, "
+                  f"total PSS {result['total_pss_mb']}MB")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.retrievers import BaseRetriever
+
+from corpus_versions import VersionReader, load_corpus_version
+from logger import logger
+
+load_dotenv()
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    An Okapi BM25 index over one bot's chunks that can grow incrementally.
+
+    Postings are appended as documents arrive and compiled into NumPy arrays lazily, so a
+    query only touches the postings of its own terms instead of re-scoring the whole corpus.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75, corpus_version: Optional[str] = None):
+        self.k1 = k1
+        self.b = b
+        self.corpus_version = corpus_version
+        self.validated_at = time.monotonic()
+        self.documents: List[Document] = []
+        self._doc_lens: List[int] = []
+        self._postings: Dict[str, List[List[int]]] = defaultdict(lambda: [[], []])
+        self._compiled: Dict[str, tuple] = {}
+        self._doc_lens_array = np.zeros(0, dtype=np.float32)
+        self._total_len = 0
+        self._text_bytes = 0
+        self._postings_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_documents(self, documents: Iterable[Document]):
+        """
+        Appends documents to the index and updates the postings of every term they contain.
+        """
+        with self._lock:
+            self._add_documents(documents)
+
+    def _add_documents(self, documents: Iterable[Document]):
+        for doc in documents:
+            doc_id = len(self.documents)
+            tokens = tokenize(doc.page_content)
+            term_freqs: Dict[str, int] = defaultdict(int)
+            for token in tokens:
+                term_freqs[token] += 1
+            for term, freq in term_freqs.items():
+                posting = self._postings[term]
+                posting[0].append(doc_id)
+                posting[1].append(freq)
+                self._compiled.pop(term, None)
+            self.documents.append(doc)
+            self._doc_lens.append(len(tokens))
+            self._total_len += len(tokens)
+            self._text_bytes += len(doc.page_content)
+            self._postings_count += len(term_freqs)
+        if len(self._doc_lens_array) != len(self._doc_lens):
+            self._doc_lens_array = np.asarray(self._doc_lens, dtype=np.float32)
+
+    def _compiled_posting(self, term: str) -> Optional[tuple]:
+        compiled = self._compiled.get(term)
+        if compiled is None:
+            posting = self._postings.get(term)
+            if posting is None:
+                return None
+            compiled = (np.asarray(posting[0], dtype=np.int32), np.asarray(posting[1], dtype=np.float32))
+            self._compiled[term] = compiled
+        return compiled
+
+    def search(self, query: str, k: int = 3) -> List[Document]:
+        """
+        Returns the k highest scoring documents for the query. Documents that share no term
+        with the query are never returned.
+        """
+        with self._lock:
+            return self._search(query, k)
+
+    def _search(self, query: str, k: int) -> List[Document]:
+        n_docs = len(self.documents)
+        if n_docs == 0:
+            return []
+        avgdl = self._total_len / n_docs or 1.0
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            compiled = self._compiled_posting(term)
+            if compiled is None:
+                continue
+            doc_ids, freqs = compiled
+            idf = math.log(1 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._doc_lens_array[doc_ids] / avgdl)
+            scores[doc_ids] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.documents[i] for i in ranked]
+
+    def memory_bytes(self) -> int:
+        """
+        Approximate resident size: raw chunk text plus two 4-byte ints per posting entry.
+        """
+        return self._text_bytes + self._postings_count * 8 + len(self._doc_lens) * 8
+
+
+class BM25IndexRegistry:
+    """
+    Keeps one BM25Index per bot in memory, evicting the least recently used bots once the
+    combined index size passes BM25_INDEX_MEMORY_BUDGET_MB.
+
+    Ingestion usually runs in another process, so each index records the bot's corpus version
+    it was built from. Every BM25_INDEX_TTL seconds an index is revalidated by reading that
+    version alone, and only a mismatch rebuilds it from Mongo, as LocalVectorIndexRegistry does.
+    """
+    def __init__(self):
+        self.memory_budget = int(float(os.getenv("BM25_INDEX_MEMORY_BUDGET_MB", "256")) * 1024 * 1024)
+        self.ttl = float(os.getenv("BM25_INDEX_TTL", "60"))
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._counters = {"hits": 0, "builds": 0, "evictions": 0, "incremental_adds": 0, "revalidations": 0}
+
+    def _fresh(self, index: Optional[BM25Index]) -> bool:
+        return index is not None and time.monotonic() - index.validated_at < self.ttl
+
+    def get(self, bot_token: str, loader: Callable[[str], List[Document]], version_reader: Optional[VersionReader] = None) -> BM25Index:
+        """
+        Returns the bot's index, building it from `loader` if it is not in memory or the bot's
+        corpus version changed since it was built.
+
+        Args:
+            bot_token (str): The bot.
+            loader (Callable): Returns the bot's chunks for a build.
+            version_reader (VersionReader, optional): Returns the bot's current corpus version;
+                without one, indexes are only replaced through `invalidate`.
+        """
+        with self._lock:
+            index = self._indexes.get(bot_token)
+            if self._fresh(index):
+                self._indexes.move_to_end(bot_token)
+                self._counters["hits"] += 1
+                return index
+
+        with self._build_locks[bot_token]:
+            with self._lock:
+                index = self._indexes.get(bot_token)
+                if self._fresh(index):
+                    self._counters["hits"] += 1
+                    return index
+            version = self._read_version(bot_token, version_reader, index)
+            if index is not None and index.corpus_version == version:
+                with self._lock:
+                    self._counters["revalidations"] += 1
+                index.validated_at = time.monotonic()
+                return index
+            documents = loader(bot_token)
+            if documents is None:
+                raise RuntimeError(f"Could not load documents for Bot token: {bot_token}")
+            index = BM25Index(corpus_version=version)
+            index.add_documents(documents)
+            with self._lock:
+                self._indexes[bot_token] = index
+                self._counters["builds"] += 1
+                self._evict()
+            logger.info(f"Built BM25 index for Bot token: {bot_token} with {len(index)} chunks.")
+            return index
+
+    @staticmethod
+    def _read_version(bot_token: str, version_reader: Optional[VersionReader], index: Optional[BM25Index]) -> Optional[str]:
+        if version_reader is None:
+            return index.corpus_version if index is not None else None
+        try:
+            return version_reader(bot_token)
+        except Exception as e:
+            # Keep serving what is loaded rather than rebuilding while the version is unknown
+            logger.warning(f"Could not read the corpus version for Bot token: {bot_token} - {e}")
+            return index.corpus_version if index is not None else None
+
+    def add_documents(self, bot_token: str, documents: List[Document]):
+        """
+        Adds newly stored chunks to a bot's index if it is loaded in this process. Unloaded bots,
+        and other processes, pick the chunks up from Mongo when their index is next built.
+        """
+        with self._lock:
+            index = self._indexes.get(bot_token)
+            if index is None:
+                return
+            index.add_documents(documents)
+            self._counters["incremental_adds"] += len(documents)
+            self._evict()
+
+    def invalidate(self, bot_token: str):
+        with self._lock:
+            self._indexes.pop(bot_token, None)
+
+    def _evict(self):
+        total = sum(index.memory_bytes() for index in self._indexes.values())
+        while total > self.memory_budget and len(self._indexes) > 1:
+            bot_token, index = self._indexes.popitem(last=False)
+            total -= index.memory_bytes()
+            self._counters["evictions"] += 1
+            logger.info(f"Evicted BM25 index for Bot token: {bot_token}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "bots": len(self._indexes),
+                "memory_bytes": sum(index.memory_bytes() for index in self._indexes.values()),
+            }
+
+
+bm25_indexes = BM25IndexRegistry()
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """
+    Retriever over a bot's shared BM25Index, a drop-in replacement for
+    `BM25Retriever.from_documents` that does not rebuild anything per request.
+    """
+    bot_token: str
+    loader: Callable[[str], List[Document]]
+    version_reader: Optional[VersionReader] = load_corpus_version
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return bm25_indexes.get(self.bot_token, self.loader, self.version_reader).search(query, self.k)
@@ -1,20 +1,57 @@
+import asyncio
 import os
 import re
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, MessagesPlaceholder,format_document
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, MessagesPlaceholder
 from typing import List, Tuple
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from pydantic import BaseModel, Field
-from langchain_core.runnables import Runnable, RunnableBranch, RunnableLambda, RunnableParallel, RunnablePassthrough
+from langchain_core.runnables import Runnable, RunnableBranch, RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 # from prompt_templates import QUESTION_ANSWER_PROMPT, STANDALONE_QUESTION_PROMPT, GENERATE_FOLLOWUP_QUESTIONS_PROMPT #, TEST_QUESTION_ANSWER_PROMPT
 from operator import itemgetter
-from constants import clear_orphaned_history_messages, remove_oldest_conversation_if_needed, DB_NAME, HISTORY_COLLECTION_NAME
-from utils import format_context
-from langchain_mongodb.chat_message_histories import MongoDBChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from utils import format_context, get_chat_history
+from embedding_service import embedding_service
+from semantic_cache import semantic_cache
+from query_rewrite import query_rewriter
+from timings import request_timings, stage
+from chain_cache import chain_cache
+from context_packing import context_packer
+from constants import fallback_llm_model
+from llm_executor import LLMTimeoutError, llm_executor
+from logger import logger
 from dotenv import load_dotenv
 load_dotenv()
-async def generate_answer(question, ensemble_retriever, chat_history,llm_model, prompts):   
+
+
+class GenerateQuestionsOutput(BaseModel):
+    questions: List[str] = Field(description="List of suggested questions")
+
+
+def _combine_documents(docs, budget=None):
+    # The V1 prompt takes bare chunk contents, packed like format_context without the headers
+    return context_packer.pack(docs, budget, headers=False)
+
+
+def _fallback_chains(kind, prompts, builder):
+    """
+    The chains of `kind` built on the fallback model, or None when FALLBACK_MODEL_NAME is not set.
+    """
+    fallback = fallback_llm_model()
+    return chain_cache.get(kind, fallback, prompts, builder) if fallback is not None else None
+
+
+def _format_chat_history(chat_history: List[Tuple[str, str]]) -> List:
+    buffer = []
+    summary = getattr(chat_history, "summary", "")
+    if summary:
+        buffer.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+    for human, ai in chat_history:
+        buffer.append(HumanMessage(content=human))
+        buffer.append(AIMessage(content=ai))
+    return buffer
+
+
+def _build_v1_chains(llm_model, prompts):
     CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(prompts['STANDALONE_QUESTION_PROMPT'])
     ANSWER_PROMPT = ChatPromptTemplate.from_messages(
         [
@@ -24,23 +61,6 @@ async def generate_answer(question, ensemble_retriever, chat_history,llm_model,
         ]
     )
 
-    DEFAULT_DOCUMENT_PROMPT = PromptTemplate.from_template(template="{page_content}")
-
-    def _combine_documents(docs, document_prompt=DEFAULT_DOCUMENT_PROMPT, document_separator="\n\n"):
-        formatted_docs = [format_document(doc, document_prompt) for doc in docs]
-        return document_separator.join(formatted_docs)
-
-    def _format_chat_history(chat_history: List[Tuple[str, str]]) -> List:
-        buffer = []
-        for human, ai in chat_history:
-            buffer.append(HumanMessage(content=human))
-            buffer.append(AIMessage(content=ai))
-        return buffer
-
-    class ChatHistory(BaseModel):
-        chat_history: List[Tuple[str, str]] = Field(..., description="The chat history as a list of tuples")
-        question: str
-
     _search_query = RunnableBranch(
         (
             RunnableLambda(lambda x: bool(x.get("chat_history"))).with_config(
@@ -57,51 +77,69 @@ async def generate_answer(question, ensemble_retriever, chat_history,llm_model,
         RunnableLambda(itemgetter("question")),
     )
 
-    _inputs = RunnableParallel(
-        {
-            "question": lambda x: x["question"],
-            "chat_history": lambda x: _format_chat_history(x["chat_history"]),
-            "context": _search_query | ensemble_retriever | _combine_documents,
-        }
-    ).with_types(input_type=ChatHistory)
+    answer_chain = ANSWER_PROMPT | llm_model | StrOutputParser()
+    return _search_query, answer_chain
+
+
+def _build_follow_up_chain(llm_model, prompts):
+    parser = JsonOutputParser(pydantic_object=GenerateQuestionsOutput)
+    prompt_template = PromptTemplate(
+        template=prompts['GENERATE_FOLLOWUP_QUESTIONS_PROMPT'],
+        input_variables=["chat_history", "current_question", "context",],
+        partial_variables={"format_instructions": parser.get_format_instructions()}
+    )
+    return prompt_template | llm_model | parser
+
 
-    chain = _inputs | ANSWER_PROMPT | llm_model | StrOutputParser()
+async def generate_answer(question, ensemble_retriever, chat_history,llm_model, prompts, return_docs=False, context_budget=None):   
+    _search_query, answer_chain = chain_cache.get("v1_answer", llm_model, prompts, _build_v1_chains)
 
-    response = chain.invoke({
-                "question": question,
-                "chat_history": chat_history
-            })
+    # Retrieve first so the documents can be reused for follow-up questions
+    with stage("rewrite"):
+        if chat_history:
+            fallback_chains = _fallback_chains("v1_answer", prompts, _build_v1_chains)
+            try:
+                search_query = await llm_executor.run("rewrite", _search_query, {
+                            "question": question,
+                            "chat_history": chat_history
+                        }, fallback=fallback_chains[0] if fallback_chains else None)
+            except LLMTimeoutError:
+                logger.warning("Question rewrite timed out, retrieving with the original question.")
+                search_query = question
+        else:
+            # Without history the branch passes the question through, there is no model call to guard
+            search_query = await _search_query.ainvoke({
+                        "question": question,
+                        "chat_history": chat_history
+                    })
+    with stage("retrieve"):
+        docs = await ensemble_retriever.ainvoke(search_query)
+
+    with stage("generate"):
+        response = await llm_executor.run("generate", answer_chain, {
+                    "question": question,
+                    "chat_history": _format_chat_history(chat_history),
+                    "context": _combine_documents(docs, context_budget),
+                })
+    if return_docs:
+        return response, docs
     return response
 
 
-async def generate_follow_up_questions(chat_history: List[Tuple], current_question: str,ensemble_retreiver,llm_model, prompts) -> any:
-    class GenerateQuestionsOutput(BaseModel):
-        questions: List[str] = Field(description="List of suggested questions")
-    
-    try:
-
-        parser = JsonOutputParser(pydantic_object=GenerateQuestionsOutput)
-        response_parser = parser.get_format_instructions()
-        prompt_template = PromptTemplate(
-            template=prompts['GENERATE_FOLLOWUP_QUESTIONS_PROMPT'],
-            input_variables=["chat_history", "current_question", "context",],
-            partial_variables={"format_instructions":response_parser}
-
-        )
-        
-        context=ensemble_retreiver.invoke(current_question)
-        template_chain: Runnable = prompt_template | llm_model | parser
-        formatted_chat_history = ''.join([f'<Question>{question} <Answer>{answer}\n ' for question, answer in chat_history])
-        
-
-        response = template_chain.invoke({
-            "chat_history": formatted_chat_history,
-            "current_question": current_question,
-            "context": context
-        })
-        return response
-    except Exception as e:
-        print("ERRROR :  ", e)
+async def generate_follow_up_questions(chat_history: List[Tuple], current_question: str, context_docs, llm_model, prompts) -> any:
+    # Errors reach the caller so FollowUpManager can record the job as failed
+    template_chain: Runnable = chain_cache.get("follow_up", llm_model, prompts, _build_follow_up_chain)
+    formatted_chat_history = ''.join([f'<Question>{question} <Answer>{answer}\n ' for question, answer in chat_history])
+    summary = getattr(chat_history, "summary", "")
+    if summary:
+        formatted_chat_history = f'<Summary>{summary}\n ' + formatted_chat_history
+
+    response = await llm_executor.run("follow_up", template_chain, {
+        "chat_history": formatted_chat_history,
+        "current_question": current_question,
+        "context": format_context(context_docs)
+    })
+    return response
 
 
 
@@ -111,7 +149,68 @@ def remove_think_step(text):
     clean_text=re.sub(thinking_pattern,"",text,flags=re.DOTALL)
     return clean_text
 
-async def generate_answer_v2(question: str, session_id:str, retriever, llm_model, prompts):
+class ThinkStreamFilter:
+    """
+    Incremental counterpart of `remove_think_step` for streamed output. Text inside
+    <think>...</think> is dropped as chunks arrive, and a tag split across two chunks is held
+    back until it can be recognised. A trailing newline is held back too, since the batch regex
+    drops it when a <think> tag follows.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.inside = False
+        self.strip_newline = False
+
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        output = []
+        while self.buffer:
+            if self.strip_newline and not self.inside:
+                if self.buffer.startswith("\n"):
+                    self.buffer = self.buffer[1:]
+                self.strip_newline = False
+                continue
+            if not self.inside:
+                index = self.buffer.find(self.OPEN_TAG)
+                if index == -1:
+                    keep = self._partial_tag_length(self.buffer, self.OPEN_TAG)
+                    if self.buffer[:len(self.buffer) - keep].endswith("\n"):
+                        keep += 1
+                    output.append(self.buffer[:len(self.buffer) - keep])
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                text = self.buffer[:index]
+                output.append(text[:-1] if text.endswith("\n") else text)
+                self.buffer = self.buffer[index + len(self.OPEN_TAG):]
+                self.inside = True
+            else:
+                index = self.buffer.find(self.CLOSE_TAG)
+                if index == -1:
+                    keep = self._partial_tag_length(self.buffer, self.CLOSE_TAG)
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                self.buffer = self.buffer[index + len(self.CLOSE_TAG):]
+                self.inside = False
+                self.strip_newline = True
+        return "".join(output)
+
+    def flush(self):
+        remaining = "" if self.inside else self.buffer
+        self.buffer = ""
+        return remaining
+
+
+def _build_v2_chains(llm_model, prompts):
     standalone_question_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", prompts['STANDALONE_QUESTION_PROMPT']),
@@ -122,7 +221,6 @@ async def generate_answer_v2(question: str, session_id:str, retriever, llm_model
 
     parse_output = StrOutputParser()
     question_chain = standalone_question_prompt | llm_model | parse_output
-    retriever_chain = RunnablePassthrough.assign(context=question_chain | retriever | format_context)
 
     rag_prompt = ChatPromptTemplate.from_messages(
         [
@@ -132,27 +230,109 @@ async def generate_answer_v2(question: str, session_id:str, retriever, llm_model
         ]
     )
 
-    rag_chain = (
-        retriever_chain
-        | rag_prompt
-        | llm_model
-        | parse_output
-    )
+    rag_chain = rag_prompt | llm_model | parse_output
+    return question_chain, rag_chain
+
+async def _lookup_first_turn_answer(chat_history, question: str, bot_token: str):
+    """
+    Looks a first-turn question up in the bot's semantic cache.
 
-    def get_session_history(session_id: str) -> MongoDBChatMessageHistory:
-        return MongoDBChatMessageHistory(os.getenv("MONGO_DB_URI"), session_id, database_name=DB_NAME, collection_name=HISTORY_COLLECTION_NAME)
+    Returns:
+        tuple: (cached entry or None, question embedding). The embedding is None when the
+        session already has history, since only first turns are cacheable.
+    """
+    if chat_history:
+        return None, None
+    question_embedding = await embedding_service.aembed_query(question)
+    # The lookup may read the bot's corpus version from Mongo
+    return await asyncio.to_thread(semantic_cache.lookup, bot_token, question_embedding), question_embedding
 
+def _document_ids(docs):
+    return [str(doc.metadata['_id']) for doc in docs if '_id' in doc.metadata]
 
-    with_message_history = RunnableWithMessageHistory(
-        rag_chain,
-        get_session_history,
-        input_messages_key="question",
-        history_messages_key="history",
+async def _prepare_v2(question, session_id, retriever, question_chain, bot_token, semantic_caching, chat_history, timings, fallback_question_chain=None):
+    """
+    Loads the session history, checks the semantic cache and otherwise retrieves context,
+    rewriting the question into a standalone one only when the query rewriter asks for it.
+
+    Returns:
+        dict: history messages, retrieved docs, the question embedding used for caching and
+        the cached entry when the semantic cache answered the question.
+    """
+    if chat_history is None:
+        with timings.stage("history"):
+            chat_history = await get_chat_history(session_id)
+    history = _format_chat_history(chat_history)
+
+    question_embedding = None
+    if semantic_caching and bot_token:
+        with timings.stage("semantic_cache"):
+            cached, question_embedding = await _lookup_first_turn_answer(chat_history, question, bot_token)
+        if cached is not None:
+            return {"history": history, "docs": [], "question_embedding": None, "cached": cached}
+
+    _, docs = await query_rewriter.retrieve(question, chat_history, history, question_chain, retriever, timings, fallback_question_chain)
+    return {"history": history, "docs": docs, "question_embedding": question_embedding, "cached": None}
+
+async def generate_answer_v2(question: str, session_id:str, retriever, llm_model, prompts, bot_token: str = None, semantic_caching: bool = False, chat_history=None, context_budget=None):
+    timings = request_timings()
+    question_chain, rag_chain = chain_cache.get("v2", llm_model, prompts, _build_v2_chains)
+    fallback_chains = _fallback_chains("v2", prompts, _build_v2_chains)
+    prepared = await _prepare_v2(
+        question, session_id, retriever, question_chain, bot_token, semantic_caching, chat_history, timings,
+        fallback_chains[0] if fallback_chains else None,
     )
+    if prepared["cached"] is not None:
+        return {'status': 'success', 'answer': prepared["cached"]['answer'], 'cached': True, 'docs': [], 'timings': timings.as_dict()}
+
+    with timings.stage("generate"):
+        response = await llm_executor.run("generate", rag_chain, {
+            "question": question,
+            "history": prepared["history"],
+            "context": format_context(prepared["docs"], context_budget),
+        })
+    if prepared["question_embedding"] is not None and response.strip():
+        semantic_cache.store(bot_token, prepared["question_embedding"], response, _document_ids(prepared["docs"]))
+    return {'status': 'success', 'answer': response, 'docs': prepared["docs"], 'timings': timings.as_dict()}
+
+async def stream_answer_v2(question: str, session_id: str, retriever, llm_model, prompts, bot_token: str = None, semantic_caching: bool = False, chat_history=None, on_retrieved=None, context_budget=None):
+    """
+    Streams the V2 answer token by token with <think> blocks filtered out. A semantic cache
+    hit is sent as a single chunk. The caller persists the turn once the stream completes.
+    `on_retrieved`, when given, is called with the retrieved documents before generation starts.
+    """
+    timings = request_timings()
+    question_chain, rag_chain = chain_cache.get("v2", llm_model, prompts, _build_v2_chains)
+    fallback_chains = _fallback_chains("v2", prompts, _build_v2_chains)
+    prepared = await _prepare_v2(
+        question, session_id, retriever, question_chain, bot_token, semantic_caching, chat_history, timings,
+        fallback_chains[0] if fallback_chains else None,
+    )
+    if on_retrieved is not None:
+        on_retrieved(prepared["docs"])
+    if prepared["cached"] is not None:
+        yield prepared["cached"]['answer']
+        return
+
+    think_filter = ThinkStreamFilter()
+    # What the client was sent, so a cache hit later never replays a <think> block
+    answer = []
+    with timings.stage("generate"):
+        async for chunk in rag_chain.astream({
+            "question": question,
+            "history": prepared["history"],
+            "context": format_context(prepared["docs"], context_budget),
+        }):
+            text = think_filter.feed(chunk)
+            if text:
+                answer.append(text)
+                yield text
+    tail = think_filter.flush()
+    if tail:
+        answer.append(tail)
+        yield tail
+    logger.info(f"Stream stage timings: {timings}")
 
-    # async def main_chatbot(user_input: str, session_id: str) -> dict:
-    # await clear_orphaned_history_messages()
-    await remove_oldest_conversation_if_needed(session_id)
-    response = with_message_history.invoke({"question": question}, {"configurable": {"session_id": session_id}})
-    return {'status': 'success', 'answer': response}
-    # return await main_chatbot(question, session_id)
\ No newline at end of file
+    answer = "".join(answer)
+    if prepared["question_embedding"] is not None and answer.strip():
+        semantic_cache.store(bot_token, prepared["question_embedding"], answer, _document_ids(prepared["docs"]))
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def model_config_key(llm_model) -> str:
+    """
+    Identifies a chat model by its type and configuration. Models that expose no identifying
+    parameters are keyed by identity; a cached chain keeps its model alive, so ids stay unique.
+    """
+    params = getattr(llm_model, "_identifying_params", None)
+    if params:
+        return f"{type(llm_model).__name__}:{json.dumps(params, sort_keys=True, default=str)}"
+    return f"{type(llm_model).__name__}@{id(llm_model)}"
+
+
+def prompts_key(prompts: Optional[dict]) -> str:
+    return hashlib.sha256(json.dumps(prompts or {}, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ChainCache:
+    """
+    LRU of compiled LangChain runnables keyed by chain kind, a hash of the assistant's prompts
+    and the model configuration.
+
+    Keys are content-addressed, so an assistant whose prompts change simply misses and builds
+    new chains; `invalidate` frees the old entries early. At most CHAIN_CACHE_SIZE entries are
+    kept. Cached runnables are immutable and safe to share between concurrent requests.
+    """
+    def __init__(self):
+        self.size = int(os.getenv("CHAIN_CACHE_SIZE", "256"))
+        self._chains: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, kind: str, llm_model, prompts: dict, builder: Callable[[Any, dict], Any]):
+        """
+        Returns the cached chain, building it with `builder(llm_model, prompts)` on a miss.
+
+        Args:
+            kind (str): Which chain this is, so one prompt set can back several chains.
+            llm_model: The chat model the chain runs on.
+            prompts (dict): The assistant's prompts.
+            builder (Callable): Builds the chain from the model and prompts.
+
+        Returns:
+            The chain, or whatever `builder` returns, such as a tuple of chains.
+        """
+        key = (kind, prompts_key(prompts), model_config_key(llm_model))
+        with self._lock:
+            chain = self._chains.get(key)
+            if chain is not None:
+                self._chains.move_to_end(key)
+                self._counters["hits"] += 1
+                return chain
+            self._counters["misses"] += 1
+
+        # Built outside the lock; a concurrent miss may build the same chain twice, which is harmless
+        chain = builder(llm_model, prompts)
+        with self._lock:
+            self._chains[key] = chain
+            self._chains.move_to_end(key)
+            while len(self._chains) > self.size:
+                self._chains.popitem(last=False)
+                self._counters["evictions"] += 1
+        return chain
+
+    def invalidate(self, prompts: Optional[dict] = None) -> int:
+        """
+        Drops the chains built from `prompts`, or every chain when none are given.
+        """
+        digest = prompts_key(prompts) if prompts is not None else None
+        with self._lock:
+            keys = [key for key in self._chains if digest is None or key[1] == digest]
+            for key in keys:
+                del self._chains[key]
+            self._counters["invalidations"] += 1
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "chains": len(self._chains),
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+chain_cache = ChainCache()
@@ -0,0 +1,59 @@
+"""
+HTML parsing and chunking for the ingestion pipeline.
+
+Kept free of the app's heavy imports so the functions can run in a spawned process pool.
+"""
+import hashlib
+from typing import List
+
+from bs4 import BeautifulSoup
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents.base import Document
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+SUMMARY_LENGTH = 300
+
+_text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def html_to_document(url: str, html: str) -> Document:
+    """
+    Extracts the visible text of a web page together with its title and a short summary.
+
+    Args:
+        url (str): The page URL, stored as the document source.
+        html (str): The raw page HTML.
+
+    Returns:
+        Document: The page text with `source`, `title` and `summary` metadata.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "template"]):
+        tag.decompose()
+    text = soup.get_text(separator="\n", strip=True)
+    title = soup.title.get_text(strip=True) if soup.title else url
+    description = soup.find("meta", attrs={"name": "description"})
+    summary = description.get("content", "").strip() if description else ""
+    return Document(
+        page_content=text,
+        metadata={"source": url, "title": title, "summary": summary or text[:SUMMARY_LENGTH]},
+    )
+
+
+def content_fingerprint(bot_token: str, text: str) -> str:
+    """
+    Identifies a chunk by its content within one bot's corpus.
+    """
+    return hashlib.sha256(f"{bot_token}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def parse_and_chunk(url: str, html: str, bot_token: str) -> List[Document]:
+    """
+    Parses a fetched page and splits it into chunks tagged with the bot token and a content hash.
+    """
+    chunks = _text_splitter.split_documents([html_to_document(url, html)])
+    for chunk in chunks:
+        chunk.metadata["bot_token"] = bot_token
+        chunk.metadata["content_hash"] = content_fingerprint(bot_token, chunk.page_content)
+    return chunks
@@ -1,18 +1,18 @@
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pymongo import MongoClient
-from passlib.context import CryptContext
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 import os
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings, OpenAIEmbeddings
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from langchain_google_genai import GoogleGenerativeAI,ChatGoogleGenerativeAI
+from functools import lru_cache
+import numpy as np
 # from langchain_huggigface import HuggingFaceEmbeddings
 # from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.embeddings.text2vec import Text2vecEmbeddings
+
+# Google GenAI, text2vec and passlib/bcrypt are imported on first use, see _chat_model,
+# embedding_model_class and __getattr__, so workers, scripts and benchmarks that never need
+# them do not pay for importing them
 
 load_dotenv()
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Security settings
 SECRET_KEY = os.getenv("SECRET_KEY", "mysecret")
@@ -23,7 +23,11 @@ REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-client = MongoClient(os.getenv("MONGO_DB_URI"))
+# connect=False defers connecting and the monitor threads to the first operation, so importing
+# this module opens no sockets and the clients are safe to create before a pre-fork server forks
+client = MongoClient(os.getenv("MONGO_DB_URI"), connect=False)
+# Async client for everything on the request path; the sync client is kept for LangChain's vector store
+async_client = AsyncIOMotorClient(os.getenv("MONGO_DB_URI"), connect=False)
 # users_db = client["chatbot"]
 # users_collection = users_db["users"]
 # bots_collection = users_db["bots"]
@@ -40,80 +44,112 @@ client = MongoClient(os.getenv("MONGO_DB_URI"))
 DB_NAME = "langchain_chatbot"
 COLLECTION_NAME = "data"
 HISTORY_COLLECTION_NAME = "history"
+CHAT_HISTORY_COLLECTION_NAME = "chat_history"
+INGESTION_SOURCES_COLLECTION_NAME = "ingestion_sources"
+CORPUS_VERSIONS_COLLECTION_NAME = "corpus_versions"
+INGESTION_LEASES_COLLECTION_NAME = "ingestion_leases"
+ASSISTANT_INVALIDATIONS_COLLECTION_NAME = "assistant_invalidations"
+FOLLOW_UP_RESULTS_COLLECTION_NAME = "follow_up_results"
 USERS_COLLECTION_NAME = "users"
 ATLAS_VECTOR_SEARCH_INDEX_NAME = "vector_index"
 collection = client[DB_NAME][COLLECTION_NAME]
+corpus_versions_collection = client[DB_NAME][CORPUS_VERSIONS_COLLECTION_NAME]
+chat_history_collection = async_client[DB_NAME][CHAT_HISTORY_COLLECTION_NAME]
+
+
+@lru_cache(maxsize=1)
+def embedding_model_class():
+    """
+    Returns ListConvertedText2vecEmbeddings, defining it on first use.
+    """
+    from langchain_community.embeddings.text2vec import Text2vecEmbeddings
+
+    class ListConvertedText2vecEmbeddings(Text2vecEmbeddings):
+        def __init__(self, **kwargs):
+            # Optionally specify a local model path if you have it downloaded
+            # kwargs["model_name_or_path"] = "path/to/local/model"
+            super().__init__(**kwargs)
+
+        def embed_documents(self, texts):
+            return self.encode_batch(texts).tolist()
+
+        def embed_query(self, text):
+            return super().embed_query(text).tolist()
+
+        def encode_batch(self, texts):
+            # One model call for the whole batch; rows stay as a float32 NumPy matrix
+            return np.asarray(self.model.encode(list(texts)), dtype=np.float32)
+
+    return ListConvertedText2vecEmbeddings
 
 
-class ListConvertedText2vecEmbeddings(Text2vecEmbeddings):
-    def __init__(self, **kwargs):
-        # Optionally specify a local model path if you have it downloaded
-        # kwargs["model_name_or_path"] = "path/to/local/model"
-        super().__init__(**kwargs)
-        
-    def embed_documents(self, texts):
-        return [super().embed_documents(text).tolist() for text in texts]
-    
-    def embed_query(self, text):
-        return super().embed_query(text).tolist()
+@lru_cache(maxsize=1)
+def password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+def __getattr__(name):
+    # Keeps `constants.pwd_context` and `constants.ListConvertedText2vecEmbeddings` working while
+    # passlib and text2vec are only imported when they are used
+    if name == "pwd_context":
+        return password_context()
+    if name == "ListConvertedText2vecEmbeddings":
+        return embedding_model_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@lru_cache(maxsize=8)
+def _chat_model(model_name, api_key):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from metrics import llm_token_counter
+    return ChatGoogleGenerativeAI(model=model_name, google_api_key=api_key, temperature=0.7, verbose =True, callbacks=[llm_token_counter])
+
 def llm_model():
     # return GoogleGenerativeAI(model=os.getenv("MODEL_NAME"), google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0, verbose=True, timeout=600)
-    return  ChatGoogleGenerativeAI(model=os.getenv("MODEL_NAME"), google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0.7, verbose =True)
+    # One client per model configuration, shared across requests along with its connection pool
+    return _chat_model(os.getenv("MODEL_NAME"), os.getenv("GOOGLE_API_KEY"))
+
+def fallback_llm_model():
+    # Faster model used when the primary times out on latency-critical steps; None when not configured
+    model_name = os.getenv("FALLBACK_MODEL_NAME")
+    if not model_name:
+        return None
+    return _chat_model(model_name, os.getenv("GOOGLE_API_KEY"))
 
 def embedding_model():
-    return  ListConvertedText2vecEmbeddings()
+    # Shared per process; see vector_store.EmbeddingModelManager
+    from vector_store import EmbeddingModelManager
+    return EmbeddingModelManager().get_embedding_model()
 
     #old
     # return HuggingFaceBgeEmbeddings( model_name="BAAI/bge-base-en-v1.5", model_kwargs= {"device": "cpu"}, encode_kwargs= {"normalize_embeddings": True})
 
 def vector_search():
-    return MongoDBAtlasVectorSearch.from_connection_string(os.getenv("MONGO_DB_URI"),f"{vector_db_name}.{vector_collection_name}", embedding_model(), index_name=vector_index)
+    # The ensemble retriever searches the same chunk collection as vector_store()
+    return vector_store()
 
 def vector_store():
-    return MongoDBAtlasVectorSearch.from_connection_string(
-        connection_string=os.getenv("MONGO_DB_URI"),
-        namespace=DB_NAME + "." + COLLECTION_NAME,
-        embedding=embedding_model(),
-        index_name=ATLAS_VECTOR_SEARCH_INDEX_NAME,
-        text_key="content"
-    )
+    from vector_store import VectorStoreManager
+    return VectorStoreManager().get_vector_store(DB_NAME, COLLECTION_NAME)
 
     #old
     # return MongoDBAtlasVectorSearch(embedding=embedding_model(),collection=vector_collection)
 
 async def clear_orphaned_history_messages():
     try:
-        history_collection = client[DB_NAME][HISTORY_COLLECTION_NAME]
-        users_collection = client[DB_NAME][USERS_COLLECTION_NAME]
-        user_session_ids = users_collection.distinct("session_id")
+        history_collection = async_client[DB_NAME][HISTORY_COLLECTION_NAME]
+        users_collection = async_client[DB_NAME][USERS_COLLECTION_NAME]
+        user_session_ids = await users_collection.distinct("session_id")
         print(f"User session IDs to keep: {user_session_ids}")
-        history_session_ids = history_collection.distinct("SessionId")
+        history_session_ids = await history_collection.distinct("SessionId")
         print(f"History session IDs found: {history_session_ids}")
         orphaned_session_ids = set(history_session_ids) - set(user_session_ids)
         print(f"Orphaned session IDs to remove: {orphaned_session_ids}")
         if orphaned_session_ids:
-            result = history_collection.delete_many({
+            result = await history_collection.delete_many({
                 "SessionId": {"$in": list(orphaned_session_ids)}
             })
             print(f"Removed {result.deleted_count} orphaned messages from history.")
     except Exception as e:
         print(f"Error in clearing orphaned history messages: {e}")
-
-async def remove_oldest_conversation_if_needed(session_id: str):
-    try:
-        history_collection = client[DB_NAME][HISTORY_COLLECTION_NAME]
-        message_count = history_collection.count_documents({"SessionId": session_id})
-        print(f"Total messages for session {session_id}: {message_count}")
-        if message_count >= 8:
-            oldest_messages = list(history_collection.find({"SessionId": session_id}).sort("_id", ASCENDING).limit(2))
-            oldest_ids = [msg["_id"] for msg in oldest_messages]
-            print(f"Messages to remove: {oldest_ids}")
-            if oldest_ids:
-                result = history_collection.delete_many({"_id": {"$in": oldest_ids}})
-                print(f"Removed {result.deleted_count} oldest messages for session {session_id}.")
-            else:
-                print("No messages found to remove.")
-    except Exception as e:
-        print(f"Error in clearing history for session {session_id}: {e}")
\ No newline at end of file
@@ -0,0 +1,198 @@
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents.base import Document
+
+from embedding_service import normalize_text
+from metrics import CONTEXT_TOKENS_SAVED
+
+load_dotenv()
+
+
+class _Piece:
+    def __init__(self, text: str, rank: int, chunks: int = 1):
+        self.text = text
+        self.rank = rank
+        self.chunks = chunks
+
+
+def _overlap(left: str, right: str, min_overlap: int, max_overlap: int) -> int:
+    """
+    Length of the longest suffix of `left` that is also a prefix of `right`, or 0 when it is
+    shorter than `min_overlap`.
+    """
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    start = left.find(probe, max(0, len(left) - max_overlap))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+class ContextPacker:
+    """
+    Assembles the retrieved documents into the context section of a prompt.
+
+    Chunks with the same content are kept once, and chunks of the same source that contain one
+    another or overlap (the splitter repeats up to CHUNK_OVERLAP characters between neighbours)
+    are merged into one passage. Passages are then added in retrieval order, the most relevant
+    first, until the bot's token budget is spent: a passage that does not fit is skipped in
+    favour of smaller ones after it, and only a lone first passage is truncated. With headers,
+    each source's title and summary are written once above its passages.
+
+    The budget is the assistant's `context_token_budget` or CONTEXT_TOKEN_BUDGET (0 disables it).
+    Tokens are estimated at CONTEXT_CHARS_PER_TOKEN characters each; the estimate of what the
+    documents would have cost formatted one by one, minus the packed size, is reported as the
+    tokens saved.
+    """
+    def __init__(self):
+        self.budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+        self.chars_per_token = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+        self.min_overlap = int(os.getenv("CONTEXT_MIN_OVERLAP", "20"))
+        self.max_overlap = int(os.getenv("CONTEXT_MAX_OVERLAP", "400"))
+        self._counters = {
+            "requests": 0,
+            "chunks_in": 0,
+            "duplicates": 0,
+            "merged": 0,
+            "dropped": 0,
+            "truncated": 0,
+            "tokens_before": 0,
+            "tokens_after": 0,
+        }
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def budget_for(self, assistant_data: Optional[dict]) -> int:
+        return int((assistant_data or {}).get("context_token_budget") or self.budget)
+
+    def _merge(self, left: str, right: str) -> Optional[str]:
+        if right in left:
+            return left
+        if left in right:
+            return right
+        overlap = _overlap(left, right, self.min_overlap, self.max_overlap)
+        if overlap:
+            return left + right[overlap:]
+        overlap = _overlap(right, left, self.min_overlap, self.max_overlap)
+        if overlap:
+            return right + left[overlap:]
+        return None
+
+    def _pieces(self, docs: List[Document]) -> Tuple[Dict[str, List[_Piece]], Dict[str, Document]]:
+        sources: Dict[str, List[_Piece]] = {}
+        first_docs: Dict[str, Document] = {}
+        seen = set()
+        for rank, doc in enumerate(docs):
+            key = normalize_text(doc.page_content)
+            if not key or key in seen:
+                self._counters["duplicates"] += 1
+                continue
+            seen.add(key)
+            source = doc.metadata.get("source") or doc.metadata.get("title") or f"#{rank}"
+            first_docs.setdefault(source, doc)
+            pieces = sources.setdefault(source, [])
+            piece = _Piece(doc.page_content, rank)
+            # Folding one chunk in can bridge two passages, so keep merging until nothing changes
+            merged = True
+            while merged:
+                merged = False
+                for other in pieces:
+                    text = self._merge(other.text, piece.text)
+                    if text is not None:
+                        pieces.remove(other)
+                        piece = _Piece(text, min(other.rank, piece.rank), other.chunks + piece.chunks)
+                        self._counters["merged"] += 1
+                        merged = True
+                        break
+            pieces.append(piece)
+        return sources, first_docs
+
+    @staticmethod
+    def _header(doc: Document) -> str:
+        lines = []
+        if doc.metadata.get("title"):
+            lines.append(f"Title: {doc.metadata['title']}")
+        if doc.metadata.get("summary"):
+            lines.append(f"Summary: {doc.metadata['summary']}")
+        return "\n".join(lines + ["Content: "])
+
+    @staticmethod
+    def _unpacked(docs: List[Document], headers: bool) -> str:
+        if headers:
+            return "\n\n".join(
+                f"Title: {doc.metadata.get('title', '')}\nSummary: {doc.metadata.get('summary', '')}\nContent: {doc.page_content}"
+                for doc in docs
+            )
+        return "\n\n".join(doc.page_content for doc in docs)
+
+    def pack(self, docs: List[Document], budget: Optional[int] = None, headers: bool = True) -> str:
+        """
+        Returns the packed context for the documents, ordered by relevance.
+
+        Args:
+            docs (List[Document]): Retrieved documents, most relevant first.
+            budget (int, optional): Token budget; defaults to CONTEXT_TOKEN_BUDGET, 0 or less is unlimited.
+            headers (bool): Whether to write each source's title and summary above its passages.
+
+        Returns:
+            str: The context text.
+        """
+        if not docs:
+            return ""
+        budget = self.budget if budget is None else budget
+        sources, first_docs = self._pieces(docs)
+
+        ranked = sorted(((piece, source) for source, pieces in sources.items() for piece in pieces), key=lambda item: item[0].rank)
+        included: Dict[str, List[str]] = {}
+        used = 0
+        for piece, source in ranked:
+            header = self._header(first_docs[source]) if headers and source not in included else ""
+            cost = self.estimate_tokens(header + piece.text) + 1
+            if budget > 0 and used + cost > budget:
+                if included:
+                    self._counters["dropped"] += piece.chunks
+                    continue
+                # Nothing fits yet; truncate the most relevant passage rather than send no context
+                room = max(0, int((budget - self.estimate_tokens(header) - 1) * self.chars_per_token))
+                piece.text = piece.text[:room]
+                cost = budget
+                self._counters["truncated"] += 1
+            included.setdefault(source, []).append(piece.text)
+            used += cost
+
+        separator = "\n\n"
+        if headers:
+            text = separator.join(
+                self._header(first_docs[source]) + separator.join(passages)
+                for source, passages in included.items()
+            )
+        else:
+            text = separator.join(passage for passages in included.values() for passage in passages)
+
+        before, after = self.estimate_tokens(self._unpacked(docs, headers)), self.estimate_tokens(text)
+        self._counters["requests"] += 1
+        self._counters["chunks_in"] += len(docs)
+        self._counters["tokens_before"] += before
+        self._counters["tokens_after"] += after
+        CONTEXT_TOKENS_SAVED.observe(max(0, before - after))
+        return text
+
+    def stats(self) -> dict:
+        requests = self._counters["requests"]
+        saved = self._counters["tokens_before"] - self._counters["tokens_after"]
+        return {
+            **self._counters,
+            "tokens_saved": saved,
+            "avg_tokens_saved": round(saved / requests, 1) if requests else 0.0,
+            "budget": self.budget,
+        }
+
+
+context_packer = ContextPacker()
@@ -0,0 +1,18 @@
+from typing import Callable, Optional
+
+VersionReader = Callable[[str], Optional[str]]
+
+
+def load_corpus_version(bot_token: str) -> Optional[str]:
+    """
+    Reads the corpus version ingestion stored for a bot, or None when it never stored one.
+
+    Ingestion bumps the version whenever it writes or removes a bot's chunks, so per-worker
+    indexes and caches compare it with the version they were built from to notice changes made
+    by other processes.
+    """
+    from constants import corpus_versions_collection
+    # One document per bot, kept unique by ingestion's index
+    for doc in corpus_versions_collection.find({"bot_token": bot_token}, {"_id": 0, "version": 1}):
+        return doc.get("version")
+    return None
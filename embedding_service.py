@@ -0,0 +1,226 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from logger import logger
+from timings import stage
+from vector_store import EmbeddingModelManager
+
+load_dotenv()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace so trivially different spellings of a question share one embedding.
+    """
+    return " ".join(text.split())
+
+
+class EmbeddingService:
+    """
+    Coalesces concurrent query embeddings into small batches and runs them on a dedicated
+    thread pool, off the event loop.
+
+    Requests wait at most EMBEDDING_MAX_WAIT_MS for a batch of up to EMBEDDING_BATCH_SIZE
+    texts to fill. Results are kept in an LRU of EMBEDDING_CACHE_SIZE entries keyed by the
+    normalized, case-folded text, so repeated questions never reach the model. The thread pool
+    is created by `start` and shut down by `stop`, so the service can be restarted.
+    """
+    def __init__(self):
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+        self.max_wait = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")) / 1000
+        self.cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+        self.workers = int(os.getenv("EMBEDDING_WORKERS", "1"))
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batches: set = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._counters = {
+            "requests": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "batches": 0,
+            "batched_texts": 0,
+        }
+
+    def start(self):
+        """
+        Starts the batching worker on the running event loop.
+        """
+        if self._worker_task is not None and not self._worker_task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding")
+        self._worker_task = self._loop.create_task(self._worker())
+
+    async def stop(self):
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        # Let in-flight batches settle so their callers get a result or the error
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+            return vector
+
+    def _cache_put(self, key: str, vector: np.ndarray):
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _encode(texts: List[str]) -> np.ndarray:
+        return EmbeddingModelManager().get_embedding_model().encode_batch(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embeds a single query, batching it with other queries that arrive in the same window.
+        """
+        self._counters["requests"] += 1
+        text = normalize_text(text)
+        key = text.casefold()
+        vector = self._cache_get(key)
+        if vector is not None:
+            self._counters["cache_hits"] += 1
+            return vector.tolist()
+
+        future = self._pending.get(key)
+        if future is not None:
+            self._counters["coalesced"] += 1
+        else:
+            self.start()
+            future = self._loop.create_future()
+            self._pending[key] = future
+            self._queue.put_nowait((key, text, future))
+        with stage("embed"):
+            vector = await asyncio.shield(future)
+        return vector.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Synchronous entry point for LangChain's sync retrievers. Calls from worker threads are
+        routed through the batching loop and calls with no event loop encode directly.
+
+        Raises:
+            RuntimeError: When called on a thread running an event loop, where encoding would
+                block every other request. Use `aembed_query` there instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("embed_query would block the event loop, await aembed_query instead")
+        loop = self._loop
+        if loop is not None and loop.is_running() and threading.get_ident() != self._loop_thread:
+            return asyncio.run_coroutine_threadsafe(self.aembed_query(text), loop).result()
+
+        self._counters["requests"] += 1
+        text = normalize_text(text)
+        key = text.casefold()
+        vector = self._cache_get(key)
+        if vector is None:
+            vector = self._encode([text])[0]
+            self._cache_put(key, vector)
+            self._counters["batches"] += 1
+            self._counters["batched_texts"] += 1
+        else:
+            self._counters["cache_hits"] += 1
+        return vector.tolist()
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            task = self._loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list):
+        try:
+            vectors = await self._loop.run_in_executor(self._executor, self._encode, [text for _, text, _ in batch])
+            self._counters["batches"] += 1
+            self._counters["batched_texts"] += len(batch)
+            for (key, _, future), vector in zip(batch, vectors):
+                self._cache_put(key, vector)
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch)} failed: {e}", exc_info=True)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for key, _, _ in batch:
+                self._pending.pop(key, None)
+            self._slots.release()
+
+    def stats(self) -> dict:
+        misses = self._counters["requests"] - self._counters["cache_hits"]
+        batches = self._counters["batches"]
+        avg_batch = self._counters["batched_texts"] / batches if batches else 0.0
+        return {
+            **self._counters,
+            "cache_misses": misses,
+            "cache_size": len(self._cache),
+            "cache_hit_rate": round(self._counters["cache_hits"] / self._counters["requests"], 4) if self._counters["requests"] else 0.0,
+            "avg_batch_size": round(avg_batch, 2),
+            "batch_fill": round(avg_batch / self.batch_size, 4),
+        }
+
+
+embedding_service = EmbeddingService()
+
+
+class ServiceEmbeddings(Embeddings):
+    """
+    LangChain Embeddings that send queries through the shared EmbeddingService. Document
+    embedding goes straight to the model since ingestion already batches its own work.
+    """
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return EmbeddingModelManager().get_embedding_model().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embedding_service.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await embedding_service.aembed_query(text)
@@ -0,0 +1,231 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents.base import Document
+
+from bot_response import generate_follow_up_questions
+from constants import async_client, DB_NAME, FOLLOW_UP_RESULTS_COLLECTION_NAME
+from embedding_service import normalize_text
+from logger import logger
+
+load_dotenv()
+
+
+class FollowUpManager:
+    """
+    Generates follow-up question suggestions after the answer has been sent.
+
+    `schedule` starts generation in a background task from the documents already retrieved for
+    the answer and returns an id the client polls through GET /chat/follow-ups/{id}, or that
+    the stream endpoint awaits itself. Results are kept in memory for FOLLOW_UP_RESULT_TTL
+    seconds and written to Mongo, with a pending marker as soon as the job is scheduled, so a
+    poll that lands on any worker sees the job's status. At most FOLLOW_UP_MAX_IN_FLIGHT
+    generations run at once; beyond that suggestions are skipped.
+
+    Suggestions for a session's first turn depend only on the bot and the question, so they are
+    kept in an LRU of FOLLOW_UP_CACHE_SIZE (bot, question) pairs for FOLLOW_UP_CACHE_TTL seconds
+    and concurrent requests for the same pair share one generation. A generation that fails or
+    returns malformed output is reported as failed and never cached.
+    """
+    def __init__(self, results_collection=None):
+        self.results_collection = results_collection
+        self.enabled = os.getenv("FOLLOW_UPS_ENABLED", "true").lower() == "true"
+        self.result_ttl = float(os.getenv("FOLLOW_UP_RESULT_TTL", "300"))
+        self.max_in_flight = int(os.getenv("FOLLOW_UP_MAX_IN_FLIGHT", "100"))
+        self.cache_size = int(os.getenv("FOLLOW_UP_CACHE_SIZE", "1024"))
+        self.cache_ttl = float(os.getenv("FOLLOW_UP_CACHE_TTL", "3600"))
+        self.poll_interval = float(os.getenv("FOLLOW_UP_POLL_INTERVAL", "0.25"))
+        self._results: "OrderedDict[str, Tuple[float, asyncio.Task]]" = OrderedDict()
+        self._shared: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, List[str]]]" = OrderedDict()
+        self._indexes_created = False
+        self._running = 0
+        self._counters = {"scheduled": 0, "cache_hits": 0, "shared": 0, "skipped": 0, "failed": 0}
+
+    @staticmethod
+    def _cache_key(bot_token: str, question: str) -> Tuple[str, str]:
+        return bot_token, normalize_text(question).casefold()
+
+    def cached(self, bot_token: str, question: str, chat_history) -> Optional[List[str]]:
+        """
+        Returns cached first-turn suggestions for the question, or None.
+        """
+        if chat_history:
+            return None
+        key = self._cache_key(bot_token, question)
+        entry = self._cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.cache_ttl:
+            return None
+        self._cache.move_to_end(key)
+        self._counters["cache_hits"] += 1
+        return list(entry[1])
+
+    def _cache_put(self, key: Tuple[str, str], questions: List[str]):
+        self._cache[key] = (time.monotonic(), questions)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _sweep(self):
+        now = time.monotonic()
+        while self._results:
+            follow_up_id, (created_at, task) = next(iter(self._results.items()))
+            if now - created_at <= self.result_ttl:
+                break
+            task.cancel()
+            del self._results[follow_up_id]
+
+    def _in_flight(self) -> int:
+        return self._running
+
+    def _generation_done(self, _):
+        self._running -= 1
+
+    def schedule(self, bot_token: str, question: str, chat_history, docs: List[Document], llm_model, prompts) -> Optional[str]:
+        """
+        Starts generating suggestions in the background.
+
+        Args:
+            bot_token (str): The bot the question was asked to.
+            question (str): The question that was just answered.
+            chat_history (list): The session's (question, answer) turns before this question.
+            docs (List[Document]): The documents retrieved for the answer.
+            llm_model: The chat model to generate with.
+            prompts (dict): The assistant's prompts.
+
+        Returns:
+            Optional[str]: The follow-up id, or None when suggestions are disabled or skipped.
+        """
+        if not self.enabled:
+            return None
+        self._sweep()
+        key = None if chat_history else self._cache_key(bot_token, question)
+        shared = self._shared.get(key) if key is not None else None
+        if shared is not None:
+            self._counters["shared"] += 1
+            task = asyncio.ensure_future(asyncio.shield(shared))
+        elif self._in_flight() >= self.max_in_flight:
+            self._counters["skipped"] += 1
+            logger.warning("Too many follow-up generations in flight, skipping suggestions.")
+            return None
+        else:
+            task = asyncio.create_task(self._generate(key, question, chat_history, docs, llm_model, prompts))
+            self._running += 1
+            task.add_done_callback(self._generation_done)
+            if key is not None:
+                self._shared[key] = task
+                task.add_done_callback(lambda _: self._shared.pop(key, None))
+        self._counters["scheduled"] += 1
+
+        follow_up_id = uuid.uuid4().hex
+        self._results[follow_up_id] = (time.monotonic(), task)
+        if self.results_collection is not None:
+            asyncio.ensure_future(self._store(follow_up_id, "pending"))
+        task.add_done_callback(lambda done: self._persist(follow_up_id, done))
+        return follow_up_id
+
+    async def _generate(self, key, question, chat_history, docs, llm_model, prompts) -> List[str]:
+        try:
+            response = await generate_follow_up_questions(chat_history, question, docs, llm_model, prompts=prompts)
+            if not isinstance(response, dict) or not isinstance(response.get("questions"), list):
+                raise ValueError(f"Malformed follow-up questions: {response!r}")
+        except Exception as e:
+            self._counters["failed"] += 1
+            logger.error(f"Error generating follow-up questions: {e}", exc_info=True)
+            raise
+        questions = response["questions"]
+        if key is not None and questions:
+            self._cache_put(key, questions)
+        return questions
+
+    def _persist(self, follow_up_id: str, task: asyncio.Task):
+        # A cancelled job keeps its pending marker until the TTL index removes it
+        if task.cancelled():
+            return
+        error = task.exception()
+        if self.results_collection is None:
+            return
+        if error is not None:
+            asyncio.ensure_future(self._store(follow_up_id, "failed"))
+        else:
+            asyncio.ensure_future(self._store(follow_up_id, "ready", task.result()))
+
+    async def _store(self, follow_up_id: str, status: str, questions: Optional[List[str]] = None):
+        try:
+            if not self._indexes_created:
+                await self.results_collection.create_index("created_at", expireAfterSeconds=int(self.result_ttl))
+                self._indexes_created = True
+            if status == "pending":
+                # Never overwrites a result that was stored first
+                update = {"$setOnInsert": {"status": status, "questions": [], "created_at": datetime.utcnow()}}
+            else:
+                update = {"$set": {"status": status, "questions": questions or []}, "$setOnInsert": {"created_at": datetime.utcnow()}}
+            await self.results_collection.update_one({"_id": follow_up_id}, update, upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to store follow-up questions {follow_up_id}: {e}")
+
+    async def get(self, follow_up_id: str, wait: float = 0) -> dict:
+        """
+        Returns the suggestions for a follow-up id, waiting up to `wait` seconds for them.
+
+        Returns:
+            dict: `status` is ready, pending, failed or unknown; `questions` is the suggestions.
+        """
+        entry = self._results.get(follow_up_id)
+        if entry is None:
+            return await self._get_stored(follow_up_id, wait)
+
+        task = entry[1]
+        if not task.done() and wait > 0:
+            await asyncio.wait([task], timeout=wait)
+        if not task.done():
+            return {"status": "pending", "questions": []}
+        if task.cancelled() or task.exception() is not None:
+            return {"status": "failed", "questions": []}
+        return {"status": "ready", "questions": task.result()}
+
+    async def _get_stored(self, follow_up_id: str, wait: float) -> dict:
+        # The job runs on another worker; poll its stored status until it settles or `wait` runs out
+        deadline = time.monotonic() + wait
+        while True:
+            stored = None
+            if self.results_collection is not None:
+                stored = await self.results_collection.find_one({"_id": follow_up_id})
+            if stored is None:
+                return {"status": "unknown", "questions": []}
+            status = stored.get("status", "ready")
+            remaining = deadline - time.monotonic()
+            if status != "pending" or remaining <= 0:
+                return {"status": status, "questions": stored.get("questions", [])}
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+    def invalidate(self, bot_token: Optional[str] = None):
+        """
+        Drops cached suggestions for a bot, or for every bot when no token is given.
+        """
+        for key in [key for key in self._cache if bot_token is None or key[0] == bot_token]:
+            del self._cache[key]
+
+    async def stop(self):
+        tasks = [task for _, task in self._results.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._results.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "in_flight": self._in_flight(),
+            "results": len(self._results),
+            "cached_questions": len(self._cache),
+        }
+
+
+follow_up_manager = FollowUpManager(async_client[DB_NAME][FOLLOW_UP_RESULTS_COLLECTION_NAME])
@@ -0,0 +1,50 @@
+"""
+Gunicorn settings for serving the API with several uvicorn workers.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+With PRELOAD_APP=true (the default) the app is imported and the embedding model loaded once in
+the master before it forks, so every worker shares the model weights copy-on-write and memory no
+longer grows by a full model per worker. Each worker then runs the FastAPI lifespan, which starts
+its own background tasks and Mongo connections after the fork.
+
+Prometheus metrics live in each worker's memory, so PROMETHEUS_MULTIPROC_DIR (a fresh temporary
+directory unless it is set) is exported before the app is imported. The workers write their
+values there and `/metrics` aggregates every live worker.
+"""
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+# Loading the model without preload can take longer than gunicorn's default 30 second timeout
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Must exist before prometheus_client is imported, which preload_app does in the master
+prometheus_multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "sara-prometheus")
+)
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Values left by a previous run would otherwise be added to this one's. Files the master
+    # wrote while preloading go too, workers open their own after the fork.
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+    if not preload_app:
+        return
+    from vector_store import resources
+    resources.preload()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
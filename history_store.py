@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from constants import async_client, chat_history_collection, DB_NAME
+from logger import logger
+from write_behind import WriteBehindQueue
+
+load_dotenv()
+
+
+def _to_millis(timestamp: datetime) -> datetime:
+    # BSON dates keep millisecond precision
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000, tzinfo=None)
+
+
+class ChatHistory(list):
+    """
+    A session's recent (question, answer) turns, oldest first, with `summary`, the running
+    summary of the older turns that were folded out of the session.
+    """
+    def __init__(self, turns=(), summary: str = ""):
+        super().__init__(turns)
+        self.summary = summary
+
+
+class SessionHistoryStore:
+    """
+    Bounded per-session chat history.
+
+    Each session is one document whose `chat_history` array is capped at HISTORY_MAX_TURNS
+    turns by an atomic `$push` with `$slice`, so a read and a write are one round trip each
+    regardless of how long the session has been running. Recently used sessions are served
+    from an in-process LRU of HISTORY_CACHE_SIZE sessions for up to HISTORY_CACHE_TTL seconds.
+    The cache is per worker, so a session whose requests are spread across workers can miss
+    turns another worker wrote for up to the TTL; the default of a few seconds only absorbs
+    bursts, and longer TTLs need sticky sessions.
+    Turns of long sessions are folded into the document's `summary` by the HistorySummarizer,
+    which `fold`s them out with the same kind of single-document update.
+
+    Unless HISTORY_WRITE_BEHIND is disabled, new turns are handed to a WriteBehindQueue and
+    persisted in batches after the response has been sent. Reads merge in turns that are still
+    queued, so a session always sees its own latest answers.
+    """
+    def __init__(self, collection=chat_history_collection, dead_letter_collection=None):
+        self.collection = collection
+        self.writer = None
+        if os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true":
+            self.writer = WriteBehindQueue(collection, self._to_operation, dead_letter_collection, key_field="session_id")
+        self.max_turns = int(os.getenv("HISTORY_MAX_TURNS", "10"))
+        self.cache_size = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))
+        self.cache_ttl = float(os.getenv("HISTORY_CACHE_TTL", "5"))
+        self._cache: "OrderedDict[str, Tuple[float, List[Tuple[str, str]], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"cache_hits": 0, "cache_misses": 0, "reads": 0, "writes": 0, "folds": 0, "fold_conflicts": 0}
+
+    def _cache_get(self, session_id: str) -> Optional[ChatHistory]:
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is None or time.monotonic() - cached[0] > self.cache_ttl:
+                return None
+            self._cache.move_to_end(session_id)
+            return ChatHistory(cached[1], cached[2])
+
+    def _cache_put(self, session_id: str, turns: ChatHistory):
+        with self._lock:
+            self._cache[session_id] = (time.monotonic(), list(turns[-self.max_turns:]), turns.summary)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def get_turns(self, session_id: str) -> ChatHistory:
+        """
+        Returns the session's most recent turns as (question, answer) tuples, oldest first,
+        along with the summary of the turns folded out before them.
+        """
+        turns = self._cache_get(session_id)
+        if turns is not None:
+            self._counters["cache_hits"] += 1
+            return turns
+
+        self._counters["cache_misses"] += 1
+        session, pending = await self.load(session_id)
+        turns = ChatHistory(
+            [(entry['question'], entry['answer']) for entry in session['chat_history'] + pending],
+            session.get('summary') or "",
+        )
+        self._cache_put(session_id, turns)
+        return ChatHistory(turns, turns.summary)
+
+    async def load(self, session_id: str) -> Tuple[dict, List[dict]]:
+        """
+        Reads the session document, bypassing the cache.
+
+        Returns:
+            Tuple[dict, List[dict]]: The document's `chat_history` (persisted turns with their
+                timestamps), `summary` and `summary_version`, and the turns still queued for
+                writing that are not persisted yet.
+        """
+        self._counters["reads"] += 1
+        # Snapshot queued turns before reading, so a batch flushed during the read is not lost
+        pending = self.writer.pending(session_id) if self.writer is not None else []
+        session = await self.collection.find_one(
+            {'session_id': session_id},
+            {'_id': 0, 'chat_history': {'$slice': -self.max_turns}, 'summary': 1, 'summary_version': 1},
+        )
+        session = session or {}
+        entries = session.get('chat_history', [])
+        persisted = {(entry['question'], entry['answer'], _to_millis(entry['timestamp'])) for entry in entries}
+        pending = [record for record in pending if (record['question'], record['answer'], _to_millis(record['timestamp'])) not in persisted]
+        return {**session, 'chat_history': entries}, pending
+
+    async def fold(self, session_id: str, summary: str, folded: List[dict], version: Optional[int]) -> bool:
+        """
+        Replaces the session's summary and removes the turns it now covers in one update.
+
+        Args:
+            session_id (str): The session.
+            summary (str): The new running summary.
+            folded (List[dict]): The persisted turns the summary covers, as returned by `load`.
+            version (int, optional): The `summary_version` the summary was built from; the fold
+                is dropped when another worker folded the session since.
+
+        Returns:
+            bool: Whether the fold was applied.
+        """
+        result = await self.collection.update_one(
+            {'session_id': session_id, 'summary_version': version},
+            {
+                '$set': {'summary': summary, 'summary_updated_at': datetime.utcnow()},
+                '$inc': {'summary_version': 1},
+                '$pull': {'chat_history': {'timestamp': {'$in': [entry['timestamp'] for entry in folded]}}},
+            },
+        )
+        self.invalidate(session_id)
+        if not result.matched_count:
+            self._counters["fold_conflicts"] += 1
+            return False
+        self._counters["folds"] += 1
+        return True
+
+    async def append(self, session_id: str, bot_token: str, question: str, answer: str):
+        """
+        Appends a turn and drops the oldest turns beyond HISTORY_MAX_TURNS in the same update.
+        """
+        record = {
+            'session_id': session_id,
+            'bot_token': bot_token,
+            'question': question,
+            'answer': answer,
+            'timestamp': datetime.utcnow(),
+        }
+        self._counters["writes"] += 1
+        cached = self._cache_get(session_id)
+        if cached is not None:
+            cached.append((question, answer))
+            self._cache_put(session_id, cached)
+        try:
+            if self.writer is not None:
+                await self.writer.enqueue(record)
+            else:
+                await self.collection.bulk_write([self._to_operation(record)])
+        except Exception:
+            self.invalidate(session_id)
+            raise
+
+    def _to_operation(self, record: dict) -> UpdateOne:
+        return UpdateOne(
+            {'session_id': record['session_id']},
+            {
+                '$set': {'bot_token': record['bot_token']},
+                '$push': {
+                    'chat_history': {
+                        '$each': [{'timestamp': record['timestamp'], 'question': record['question'], 'answer': record['answer']}],
+                        '$slice': -self.max_turns,
+                    }
+                },
+                '$setOnInsert': {'created_at': record['timestamp']},
+            },
+            upsert=True,
+        )
+
+    def start(self):
+        if self.writer is not None:
+            self.writer.start()
+
+    async def stop(self):
+        if self.writer is not None:
+            await self.writer.stop()
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def stats(self) -> dict:
+        lookups = self._counters["cache_hits"] + self._counters["cache_misses"]
+        return {
+            **self._counters,
+            "write_behind": self.writer.stats() if self.writer is not None else None,
+            "cached_sessions": len(self._cache),
+            "cache_hit_rate": round(self._counters["cache_hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+history_store = SessionHistoryStore(dead_letter_collection=async_client[DB_NAME]["chat_history_dead_letter"])
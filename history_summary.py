@@ -0,0 +1,144 @@
+import asyncio
+import os
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from chain_cache import chain_cache
+from context_packing import context_packer
+from history_store import history_store
+from llm_executor import llm_executor
+from logger import logger
+from metrics import HISTORY_COMPACTIONS
+
+load_dotenv()
+
+HISTORY_SUMMARY_PROMPT = """Progressively summarize the conversation between a user and an assistant.
+Extend the current summary with the new turns and return only the updated summary, in a few
+sentences. Keep the facts the user shared about themselves, what they asked about and the
+assistant's key answers, so later questions that refer back to them can be understood.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def _build_summary_chain(llm_model, prompts):
+    prompt = PromptTemplate.from_template(prompts.get('HISTORY_SUMMARY_PROMPT') or HISTORY_SUMMARY_PROMPT)
+    return prompt | llm_model | StrOutputParser()
+
+
+class HistorySummarizer:
+    """
+    Keeps the history sent with each prompt bounded on long sessions.
+
+    After every turn, `schedule` checks in a background task whether the session's summary and
+    turns are estimated at more than HISTORY_SUMMARY_THRESHOLD tokens, or whether the session is
+    at HISTORY_MAX_TURNS turns, where the next turn would make the store's cap drop its oldest
+    turn before it was summarized. If so, all but the last HISTORY_SUMMARY_KEEP_TURNS turns
+    are folded into the session's running summary by the chat model, and the summary replaces
+    them in the session document. Prompts then carry the summary and only the recent turns
+    verbatim.
+
+    Only turns already written are folded, one summarization runs per session at a time and at
+    most HISTORY_SUMMARY_MAX_IN_FLIGHT in total; a session skipped now is checked again on its
+    next turn.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+        self.threshold = int(os.getenv("HISTORY_SUMMARY_THRESHOLD", "1500"))
+        # At least one turn stays verbatim, and folding must leave room below the store's cap
+        self.keep_turns = min(max(1, int(os.getenv("HISTORY_SUMMARY_KEEP_TURNS", "3"))), max(1, history_store.max_turns - 1))
+        self.max_in_flight = int(os.getenv("HISTORY_SUMMARY_MAX_IN_FLIGHT", "16"))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counters = {"checks": 0, "summarized": 0, "turns_folded": 0, "tokens_folded": 0, "conflicts": 0, "skipped": 0, "failed": 0}
+
+    def estimate_tokens(self, turns, summary: str = "") -> int:
+        return context_packer.estimate_tokens(summary + "".join(question + answer for question, answer in turns))
+
+    def needs_folding(self, turns) -> bool:
+        """
+        Whether the session's history is over the token threshold, or at the turn cap so the next
+        turn would trim an unsummarized one.
+        """
+        if len(turns) >= history_store.max_turns:
+            return True
+        return self.estimate_tokens(turns, getattr(turns, "summary", "")) > self.threshold
+
+    def schedule(self, session_id: str, llm_model, prompts=None):
+        """
+        Starts a background check of the session, unless one is already running for it.
+
+        Args:
+            session_id (str): The session a turn was just added to.
+            llm_model: The chat model to summarize with.
+            prompts (dict, optional): The assistant's prompts; HISTORY_SUMMARY_PROMPT overrides the default.
+        """
+        if not self.enabled or session_id in self._tasks:
+            return
+        if len(self._tasks) >= self.max_in_flight:
+            self._counters["skipped"] += 1
+            return
+        task = asyncio.create_task(self._compact(session_id, llm_model, prompts or {}))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+    async def _compact(self, session_id: str, llm_model, prompts: dict):
+        self._counters["checks"] += 1
+        try:
+            if not self.needs_folding(await history_store.get_turns(session_id)):
+                return
+            session, pending = await history_store.load(session_id)
+            entries = session['chat_history']
+            # Keep the newest turns verbatim, counting those still queued for writing
+            folded = entries[:max(0, len(entries) + len(pending) - self.keep_turns)]
+            if not folded:
+                return
+
+            summary = await self.summarize(session.get('summary') or "", folded, llm_model, prompts)
+            if not summary:
+                return
+            if not await history_store.fold(session_id, summary, folded, session.get('summary_version')):
+                self._counters["conflicts"] += 1
+                HISTORY_COMPACTIONS.labels("conflict").inc()
+                return
+            self._counters["summarized"] += 1
+            self._counters["turns_folded"] += len(folded)
+            self._counters["tokens_folded"] += self.estimate_tokens([(entry['question'], entry['answer']) for entry in folded])
+            HISTORY_COMPACTIONS.labels("summarized").inc()
+        except Exception as e:
+            self._counters["failed"] += 1
+            HISTORY_COMPACTIONS.labels("failed").inc()
+            logger.error(f"Failed to summarize chat history for session_id: {session_id} - {e}")
+
+    async def summarize(self, summary: str, entries: List[dict], llm_model, prompts: dict) -> str:
+        """
+        Returns `summary` extended with the given turns.
+        """
+        chain = chain_cache.get("history_summary", llm_model, prompts, _build_summary_chain)
+        turns = "\n".join(f"User: {entry['question']}\nAssistant: {entry['answer']}" for entry in entries)
+        result = await llm_executor.run("summarize", chain, {"summary": summary or "(none yet)", "turns": turns})
+        return result.strip()
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "in_flight": len(self._tasks),
+            "threshold": self.threshold,
+            "keep_turns": self.keep_turns,
+        }
+
+
+history_summarizer = HistorySummarizer()
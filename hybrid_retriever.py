@@ -0,0 +1,181 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.retrievers.multi_query import DEFAULT_QUERY_PROMPT, LineListOutputParser
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+from chain_cache import chain_cache
+from llm_executor import llm_executor, LLMTimeoutError
+from logger import logger
+
+load_dotenv()
+
+
+def chunk_id(doc: Document) -> str:
+    """
+    Identifies a chunk across retrievers: its Mongo id, else its content hash, else its text.
+    """
+    metadata = doc.metadata
+    if "_id" in metadata:
+        return str(metadata["_id"])
+    return metadata.get("content_hash") or doc.page_content
+
+
+def reciprocal_rank_fusion(doc_lists: List[List[Document]], weights: List[float], c: int = 60) -> List[Document]:
+    """
+    Weighted reciprocal rank fusion over several ranked lists, deduplicated by chunk id.
+
+    A document at 1-based rank r in list i contributes weights[i] / (c + r); the fused list is
+    ordered by the summed score. Ties keep first-seen order.
+
+    Args:
+        doc_lists (List[List[Document]]): Ranked results, one list per search.
+        weights (List[float]): One weight per list.
+        c (int): The RRF smoothing constant.
+
+    Returns:
+        List[Document]: The unique documents, best first.
+    """
+    positions: Dict[str, int] = {}
+    unique: List[Document] = []
+    rows, columns, ranks = [], [], []
+    for row, doc_list in enumerate(doc_lists):
+        for rank, doc in enumerate(doc_list, start=1):
+            key = chunk_id(doc)
+            column = positions.get(key)
+            if column is None:
+                column = positions[key] = len(unique)
+                unique.append(doc)
+            rows.append(row)
+            columns.append(column)
+            ranks.append(rank)
+    if not unique:
+        return []
+
+    contributions = np.asarray(weights, dtype=np.float64)[rows] / (c + np.asarray(ranks, dtype=np.float64))
+    scores = np.bincount(columns, weights=contributions, minlength=len(unique))
+    return [unique[i] for i in np.argsort(-scores, kind="stable")]
+
+
+def _build_variant_chain(llm_model, prompts):
+    return DEFAULT_QUERY_PROMPT | llm_model | LineListOutputParser()
+
+
+class HybridSearch:
+    """
+    The state HybridRetriever instances share, since a retriever is built per request: query
+    variant generation and the counters behind /stats.
+
+    Variants come from a chain cached per model in `chain_cache` and run through the LLM
+    executor as the "variants" call, so LLM_DEADLINE_VARIANTS bounds them.
+    """
+    def __init__(self):
+        self._counters = {
+            "queries": 0,
+            "variants": 0,
+            "variant_timeouts": 0,
+            "variant_errors": 0,
+            "search_timeouts": 0,
+            "search_errors": 0,
+        }
+
+    def count(self, name: str, amount: int = 1):
+        self._counters[name] += amount
+
+    @staticmethod
+    def _clean(query: str, variants: List[str]) -> List[str]:
+        return [variant.strip() for variant in variants if variant.strip() and variant.strip() != query]
+
+    async def variants(self, query: str, llm: Optional[BaseLanguageModel]) -> List[str]:
+        """
+        Returns alternative phrasings of the query, or none when there is no model or it fails.
+        """
+        if llm is None:
+            return []
+        chain = chain_cache.get("variants", llm, {}, _build_variant_chain)
+        try:
+            variants = await llm_executor.run("variants", chain, {"question": query})
+        except LLMTimeoutError:
+            self._counters["variant_timeouts"] += 1
+            logger.warning("Query variant generation timed out, searching the original question only.")
+            return []
+        except Exception as e:
+            self._counters["variant_errors"] += 1
+            logger.error(f"Query variant generation failed: {e}")
+            return []
+        variants = self._clean(query, variants)
+        self._counters["variants"] += len(variants)
+        return variants
+
+    def variants_sync(self, query: str, llm: Optional[BaseLanguageModel]) -> List[str]:
+        if llm is None:
+            return []
+        chain = chain_cache.get("variants", llm, {}, _build_variant_chain)
+        variants = self._clean(query, chain.invoke({"question": query}))
+        self._counters["variants"] += len(variants)
+        return variants
+
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+
+hybrid_search = HybridSearch()
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fans a question out to LLM-generated query variants and keyword search concurrently and
+    fuses the results with weighted reciprocal rank fusion.
+
+    Keyword search and the vector search on the original question start immediately, while the
+    variants are being generated; variant generation is bounded by LLM_DEADLINE_VARIANTS and
+    each search by HYBRID_SEARCH_TIMEOUT seconds, so one slow call only drops its own results.
+    `keyword_weight` goes to the keyword list and `vector_weight` is split evenly across the
+    vector lists, which rewards chunks that several variants agree on.
+    """
+    vector_retriever: BaseRetriever
+    keyword_retriever: BaseRetriever
+    llm: Optional[BaseLanguageModel] = None
+    keyword_weight: float = 0.3
+    vector_weight: float = 0.7
+    c: int = 60
+    # Read per instance, since a retriever is built per request
+    search_timeout: float = Field(default_factory=lambda: float(os.getenv("HYBRID_SEARCH_TIMEOUT", "2")))
+
+    def _weights(self, vector_lists: int) -> List[float]:
+        return [self.keyword_weight] + [self.vector_weight / vector_lists] * vector_lists
+
+    async def _search(self, retriever: BaseRetriever, query: str) -> List[Document]:
+        try:
+            return await asyncio.wait_for(retriever.ainvoke(query), self.search_timeout)
+        except asyncio.TimeoutError:
+            hybrid_search.count("search_timeouts")
+            logger.warning(f"Search timed out after {self.search_timeout}s for query: {query}")
+        except Exception as e:
+            hybrid_search.count("search_errors")
+            logger.error(f"Search failed for query: {query} - Error : {e}")
+        return []
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        hybrid_search.count("queries")
+        keyword_search = asyncio.create_task(self._search(self.keyword_retriever, query))
+        original_search = asyncio.create_task(self._search(self.vector_retriever, query))
+        variants = await hybrid_search.variants(query, self.llm)
+
+        variant_results = await asyncio.gather(*[self._search(self.vector_retriever, variant) for variant in variants])
+        vector_lists = [await original_search, *variant_results]
+        return reciprocal_rank_fusion([await keyword_search, *vector_lists], self._weights(len(vector_lists)), self.c)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Sync callers get the same fusion with the searches run one after another
+        hybrid_search.count("queries")
+        variants = hybrid_search.variants_sync(query, self.llm)
+        vector_lists = [self.vector_retriever.invoke(q) for q in [query, *variants]]
+        return reciprocal_rank_fusion([self.keyword_retriever.invoke(query), *vector_lists], self._weights(len(vector_lists)), self.c)
@@ -0,0 +1,431 @@
+import asyncio
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.documents.base import Document
+from pymongo import DeleteMany
+from pymongo.errors import DuplicateKeyError
+
+from bm25_index import bm25_indexes
+from chunking import parse_and_chunk
+from constants import async_client, DB_NAME, COLLECTION_NAME, CORPUS_VERSIONS_COLLECTION_NAME, INGESTION_LEASES_COLLECTION_NAME, INGESTION_SOURCES_COLLECTION_NAME
+from local_vector_index import local_vector_indexes
+from logger import logger
+from semantic_cache import semantic_cache
+from vector_store import EmbeddingModelManager
+
+load_dotenv()
+
+_DONE = object()
+
+# YouTube sources are not fetched by this pipeline, so their chunks are never treated as stale
+_YOUTUBE_URL = re.compile(r"youtube\.com|youtu\.be")
+
+
+def is_youtube_url(url: str) -> bool:
+    return bool(_YOUTUBE_URL.search(url))
+
+
+class IngestionJob:
+    """
+    Progress and throughput counters for one store_user_data run.
+    """
+    def __init__(self, bot_token: str, urls: List[str]):
+        self.job_id = str(uuid.uuid4())
+        self.bot_token = bot_token
+        self.urls = urls
+        self.status = "running"
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        # Incremental state: pages recorded by earlier runs, (source, hash) pairs already stored,
+        # hashes produced by this run per source, and per-URL outcomes
+        self.recorded_urls: Set[str] = set()
+        self.existing_hashes: Set[Tuple[str, str]] = set()
+        self.seen_hashes: Dict[str, Set[str]] = {}
+        self.validators: Dict[str, dict] = {}
+        self.refetched_urls: Set[str] = set()
+        self.failed_urls: Set[str] = set()
+        self.counters = {
+            "urls_total": len(urls),
+            "urls_fetched": 0,
+            "urls_unchanged": 0,
+            "urls_failed": 0,
+            "chunks": 0,
+            "chunks_skipped": 0,
+            "embedded": 0,
+            "written": 0,
+            "removed": 0,
+        }
+
+    def finish(self, error: Optional[Exception] = None):
+        self.finished_at = time.time()
+        self.status = "failed" if error else "completed"
+        self.error = str(error) if error else None
+
+    def stats(self) -> dict:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.job_id,
+            "bot_token": self.bot_token,
+            "status": self.status,
+            "error": self.error,
+            "elapsed_seconds": round(elapsed, 2),
+            **self.counters,
+            "chunks_per_second": round(self.counters["embedded"] / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+class IngestionPipeline:
+    """
+    Staged, streaming ingestion of web pages into the vector collection.
+
+    Stages run concurrently and hand work to each other through bounded queues, so only a
+    few batches are in memory at any time:
+
+    1. fetch: up to INGEST_FETCH_CONCURRENCY pages are downloaded at once.
+    2. chunk: HTML parsing and splitting run in a process pool of INGEST_CHUNK_WORKERS.
+    3. embed: chunks are encoded INGEST_EMBED_BATCH at a time in one model call each.
+    4. write: chunks are stored with insert_many in batches of at most INGEST_WRITE_BATCH.
+
+    Re-ingestion is incremental. Pages are fetched with If-None-Match/If-Modified-Since using
+    the validators stored from the previous run, and a 304 keeps the page's chunks as they are.
+    Chunks whose content hash is already stored for the same page are never embedded again; a
+    passage repeated on several pages is stored once per page, so removing one page never takes
+    it from the others. Chunks of pages that were dropped from the URL list, or whose text no
+    longer produces them, are deleted. Only pages an earlier run recorded in the ingestion
+    sources collection are cleaned up: chunks from files, YouTube or any other source are left
+    alone.
+
+    Runs of the same bot are serialized through a lease in the ingestion leases collection, so
+    two runs, in this or another process, never interleave their fetch, delete and insert. A
+    run waits up to INGEST_LEASE_WAIT seconds for the lease and renews it while it works; a
+    lease not renewed within INGEST_LEASE_TTL seconds, such as one left by a crashed process,
+    can be taken over.
+    """
+    def __init__(self):
+        self.fetch_concurrency = int(os.getenv("INGEST_FETCH_CONCURRENCY", "8"))
+        self.chunk_workers = int(os.getenv("INGEST_CHUNK_WORKERS", str(os.cpu_count() or 2)))
+        self.embed_batch = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+        self.write_batch = int(os.getenv("INGEST_WRITE_BATCH", "256"))
+        self.queue_size = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+        self.fetch_timeout = float(os.getenv("INGEST_FETCH_TIMEOUT", "30"))
+        self.progress_every = int(os.getenv("INGEST_PROGRESS_EVERY", "500"))
+        self.lease_ttl = float(os.getenv("INGEST_LEASE_TTL", "300"))
+        self.lease_wait = float(os.getenv("INGEST_LEASE_WAIT", "600"))
+        self.lease_poll = float(os.getenv("INGEST_LEASE_POLL", "1"))
+        self.collection = async_client[DB_NAME][COLLECTION_NAME]
+        self.sources_collection = async_client[DB_NAME][INGESTION_SOURCES_COLLECTION_NAME]
+        self.versions_collection = async_client[DB_NAME][CORPUS_VERSIONS_COLLECTION_NAME]
+        self.leases_collection = async_client[DB_NAME][INGESTION_LEASES_COLLECTION_NAME]
+        self._indexes_created = False
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-embed")
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # spawn keeps the Mongo clients and model threads of this process out of the workers
+            self._process_pool = ProcessPoolExecutor(max_workers=self.chunk_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._process_pool
+
+    def _register(self, job: IngestionJob):
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > 50:
+            self.jobs.popitem(last=False)
+
+    async def _ensure_indexes(self):
+        if not self._indexes_created:
+            await self.collection.create_index([("bot_token", 1), ("source", 1), ("content_hash", 1)])
+            await self.sources_collection.create_index([("bot_token", 1), ("url", 1)], unique=True)
+            await self.versions_collection.create_index("bot_token", unique=True)
+            await self.leases_collection.create_index("bot_token", unique=True)
+            self._indexes_created = True
+
+    async def _load_state(self, job: IngestionJob):
+        """
+        Loads the pages earlier runs recorded for the bot, the content hashes already stored for
+        the submitted pages and their HTTP validators.
+        """
+        cursor = self.collection.find(
+            {"bot_token": job.bot_token, "source": {"$in": job.urls}, "content_hash": {"$exists": True}},
+            {"_id": 0, "source": 1, "content_hash": 1},
+        )
+        job.existing_hashes = {(doc["source"], doc["content_hash"]) async for doc in cursor}
+        cursor = self.sources_collection.find({"bot_token": job.bot_token})
+        sources = [doc async for doc in cursor]
+        job.recorded_urls = {doc["url"] for doc in sources}
+        job.validators = {doc["url"]: {"etag": doc.get("etag"), "last_modified": doc.get("last_modified")} for doc in sources if doc["url"] in job.urls}
+
+    async def _remove_stale_chunks(self, job: IngestionJob):
+        """
+        Deletes chunks of recorded pages that are no longer submitted and chunks that re-fetched
+        pages no longer contain. Pages that failed to fetch or answered 304 keep their chunks, and
+        so does every source no run of this pipeline recorded.
+        """
+        dropped = sorted(job.recorded_urls.difference(job.urls))
+        operations = [DeleteMany({"bot_token": job.bot_token, "source": {"$in": dropped}})] if dropped else []
+        operations += [
+            DeleteMany({"bot_token": job.bot_token, "source": url, "content_hash": {"$nin": list(job.seen_hashes.get(url, ()))}})
+            for url in job.refetched_urls
+        ]
+        if operations:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            job.counters["removed"] = result.deleted_count
+        if dropped:
+            await self.sources_collection.delete_many({"bot_token": job.bot_token, "url": {"$in": dropped}})
+
+    async def _acquire_lease(self, job: IngestionJob):
+        """
+        Takes the bot's ingestion lease, waiting up to INGEST_LEASE_WAIT seconds while another run
+        holds it.
+        """
+        await self._ensure_indexes()
+        deadline = time.monotonic() + self.lease_wait
+        while True:
+            now = datetime.utcnow()
+            try:
+                # Matches only an expired lease; with none, the upsert hits the unique index
+                await self.leases_collection.update_one(
+                    {"bot_token": job.bot_token, "expires_at": {"$lt": now}},
+                    {"$set": {"job_id": job.job_id, "expires_at": now + timedelta(seconds=self.lease_ttl)}},
+                    upsert=True,
+                )
+                return
+            except DuplicateKeyError:
+                pass
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Another ingestion of Bot token: {job.bot_token} is still running")
+            await asyncio.sleep(self.lease_poll)
+
+    async def _renew_lease(self, job: IngestionJob):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            result = await self.leases_collection.update_one(
+                {"bot_token": job.bot_token, "job_id": job.job_id},
+                {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=self.lease_ttl)}},
+            )
+            if not result.matched_count:
+                logger.error(f"Ingestion job {job.job_id} lost its lease for Bot token: {job.bot_token}")
+                return
+
+    async def _release_lease(self, job: IngestionJob):
+        try:
+            await self.leases_collection.delete_one({"bot_token": job.bot_token, "job_id": job.job_id})
+        except Exception as e:
+            # The lease expires on its own after INGEST_LEASE_TTL
+            logger.error(f"Failed to release the ingestion lease for Bot token: {job.bot_token} - {e}")
+
+    async def _bump_corpus_version(self, job: IngestionJob):
+        """
+        Records that the bot's chunks changed, so every worker's local vector index rebuilds.
+        """
+        await self.versions_collection.update_one(
+            {"bot_token": job.bot_token},
+            {"$set": {"version": job.job_id, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    async def _save_validators(self, job: IngestionJob):
+        for url in job.refetched_urls:
+            await self.sources_collection.update_one(
+                {"bot_token": job.bot_token, "url": url},
+                {"$set": {**job.validators[url], "fetched_at": datetime.utcnow()}},
+                upsert=True,
+            )
+
+    async def _fetch_stage(self, job: IngestionJob, out_queue: asyncio.Queue):
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async with httpx.AsyncClient(timeout=self.fetch_timeout, follow_redirects=True) as client:
+            async def fetch(url: str):
+                async with semaphore:
+                    headers = {}
+                    previous = job.validators.get(url, {})
+                    if previous.get("etag"):
+                        headers["If-None-Match"] = previous["etag"]
+                    if previous.get("last_modified"):
+                        headers["If-Modified-Since"] = previous["last_modified"]
+                    try:
+                        response = await client.get(url, headers=headers)
+                        if response.status_code == 304:
+                            job.counters["urls_unchanged"] += 1
+                            return
+                        response.raise_for_status()
+                        job.counters["urls_fetched"] += 1
+                        job.refetched_urls.add(url)
+                        job.validators[url] = {
+                            "etag": response.headers.get("etag"),
+                            "last_modified": response.headers.get("last-modified"),
+                        }
+                        await out_queue.put((url, response.text))
+                    except Exception as e:
+                        job.counters["urls_failed"] += 1
+                        job.failed_urls.add(url)
+                        logger.error(f"Failed to fetch {url} for Bot token: {job.bot_token} - {e}")
+
+            await asyncio.gather(*[fetch(url) for url in job.urls])
+        await out_queue.put(_DONE)
+
+    async def _chunk_stage(self, job: IngestionJob, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        pool = self._get_process_pool()
+        in_flight = set()
+
+        async def chunk(url: str, html: str):
+            chunks = await loop.run_in_executor(pool, parse_and_chunk, url, html, job.bot_token)
+            job.counters["chunks"] += len(chunks)
+            new_chunks = []
+            seen = job.seen_hashes.setdefault(url, set())
+            for chunk in chunks:
+                content_hash = chunk.metadata["content_hash"]
+                if (url, content_hash) not in job.existing_hashes and content_hash not in seen:
+                    new_chunks.append(chunk)
+                seen.add(content_hash)
+            job.counters["chunks_skipped"] += len(chunks) - len(new_chunks)
+            chunks = new_chunks
+            for start in range(0, len(chunks), self.embed_batch):
+                await out_queue.put(chunks[start:start + self.embed_batch])
+
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                break
+            task = asyncio.create_task(chunk(*item))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            if len(in_flight) >= self.chunk_workers:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        await out_queue.put(_DONE)
+
+    async def _embed_stage(self, job: IngestionJob, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        model = await loop.run_in_executor(self._embed_executor, EmbeddingModelManager().get_embedding_model)
+        pending: List[Document] = []
+
+        async def embed(chunks: List[Document]):
+            vectors = await loop.run_in_executor(self._embed_executor, model.encode_batch, [chunk.page_content for chunk in chunks])
+            job.counters["embedded"] += len(chunks)
+            await out_queue.put((chunks, vectors))
+
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                break
+            pending.extend(item)
+            while len(pending) >= self.embed_batch:
+                await embed(pending[:self.embed_batch])
+                pending = pending[self.embed_batch:]
+        if pending:
+            await embed(pending)
+        await out_queue.put(_DONE)
+
+    async def _write_stage(self, job: IngestionJob, in_queue: asyncio.Queue):
+        buffer_docs: List[Document] = []
+        buffer_records: List[dict] = []
+        next_report = self.progress_every
+
+        async def write():
+            nonlocal buffer_docs, buffer_records, next_report
+            await self.collection.insert_many(buffer_records, ordered=False)
+            job.counters["written"] += len(buffer_records)
+            for doc, record in zip(buffer_docs, buffer_records):
+                doc.metadata["_id"] = str(record["_id"])
+            bm25_indexes.add_documents(job.bot_token, buffer_docs)
+            buffer_docs, buffer_records = [], []
+            if job.counters["written"] >= next_report:
+                logger.info(f"Ingestion job {job.job_id} progress: {job.stats()}")
+                next_report += self.progress_every
+
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                break
+            chunks, vectors = item
+            for chunk, vector in zip(chunks, vectors):
+                # Same layout as MongoDBAtlasVectorSearch.add_documents; vectors stay NumPy until here
+                buffer_records.append({"content": chunk.page_content, "embedding": vector.tolist(), **chunk.metadata})
+                buffer_docs.append(chunk)
+                if len(buffer_records) >= self.write_batch:
+                    await write()
+        if buffer_records:
+            await write()
+
+    async def run(self, urls: List[str], bot_token: str) -> IngestionJob:
+        """
+        Ingests the given web pages for a bot and returns the finished job.
+        """
+        web_urls = [url for url in urls if not is_youtube_url(url)]
+        if len(web_urls) != len(urls):
+            logger.info(f"Skipping {len(urls) - len(web_urls)} YouTube URLs for Bot token: {bot_token}")
+        job = IngestionJob(bot_token, web_urls)
+        self._register(job)
+        try:
+            await self._acquire_lease(job)
+        except Exception as e:
+            job.finish(e)
+            raise
+        renewal = asyncio.create_task(self._renew_lease(job))
+        try:
+            return await self._run(job)
+        finally:
+            renewal.cancel()
+            await self._release_lease(job)
+
+    async def _run(self, job: IngestionJob) -> IngestionJob:
+        bot_token = job.bot_token
+        logger.info(f"Started ingestion job {job.job_id} for Bot token: {bot_token} with {len(job.urls)} URLs.")
+        stages = []
+        try:
+            await self._load_state(job)
+            fetched = asyncio.Queue(maxsize=self.queue_size)
+            chunked = asyncio.Queue(maxsize=self.queue_size)
+            embedded = asyncio.Queue(maxsize=self.queue_size)
+            stages = [
+                asyncio.create_task(self._fetch_stage(job, fetched)),
+                asyncio.create_task(self._chunk_stage(job, fetched, chunked)),
+                asyncio.create_task(self._embed_stage(job, chunked, embedded)),
+                asyncio.create_task(self._write_stage(job, embedded)),
+            ]
+            await asyncio.gather(*stages)
+            await self._remove_stale_chunks(job)
+            await self._save_validators(job)
+            job.finish()
+        except Exception as e:
+            for stage in stages:
+                stage.cancel()
+            job.finish(e)
+            raise
+        finally:
+            if job.counters["removed"]:
+                bm25_indexes.invalidate(bot_token)
+            if job.counters["written"] or job.counters["removed"]:
+                # Also after a failed run, since the chunks it wrote are already searchable in Mongo
+                try:
+                    await self._bump_corpus_version(job)
+                except Exception as e:
+                    logger.error(f"Failed to record the corpus version for Bot token: {bot_token} - {e}")
+                local_vector_indexes.invalidate(bot_token)
+                semantic_cache.invalidate(bot_token)
+                # Imported here: follow_ups depends on bot_response, which imports this module through utils
+                from follow_ups import follow_up_manager
+                follow_up_manager.invalidate(bot_token)
+            logger.info(f"Ingestion job {job.job_id} {job.status}: {job.stats()}")
+        return job
+
+    def stats(self) -> list:
+        return [job.stats() for job in self.jobs.values()]
+
+
+ingestion_pipeline = IngestionPipeline()
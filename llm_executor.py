@@ -0,0 +1,168 @@
+import asyncio
+import os
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from logger import logger
+from metrics import LLM_CALLS, LLM_HEDGES
+
+load_dotenv()
+
+# Per-call defaults for LLM_DEADLINE_<CALL>. Rewrites and query variants sit in front of
+# retrieval and have a fallback (the original question), follow-ups and summaries are extras
+# that can be skipped, so they all give up early. Answer generation keeps LLM_DEADLINE: a long
+# answer legitimately takes tens of seconds to generate, and giving up means the user gets no
+# answer at all.
+DEFAULT_DEADLINES = {"rewrite": 8.0, "variants": 3.0, "follow_up": 10.0, "summarize": 20.0}
+
+
+class LLMTimeoutError(asyncio.TimeoutError):
+    """
+    Raised when a chat model call, and its fallback if any, missed the deadline.
+    """
+
+
+class LLMExecutor:
+    """
+    Runs chat model chains with a deadline, hedging and a fallback.
+
+    Every call must finish within LLM_DEADLINE seconds, or LLM_DEADLINE_<CALL> for a named
+    call such as LLM_DEADLINE_REWRITE, which defaults to the call's DEFAULT_DEADLINES entry.
+    For the calls listed in LLM_HEDGE_CALLS, a duplicate request is fired when the first has
+    not answered after the LLM_HEDGE_PERCENTILE latency of recent successful calls of that name
+    (LLM_HEDGE_INITIAL_DELAY until LLM_HEDGE_MIN_SAMPLES are seen, never less than
+    LLM_HEDGE_MIN_DELAY). The first answer wins and the other request is cancelled. A first
+    request that fails early is hedged at once, which acts as one retry.
+
+    Only the short rewrite call is hedged by default. Answers take seconds to tens of seconds,
+    so hedging "generate" before its latencies are known would duplicate most answers and
+    double the token spend against the quota admission control protects.
+
+    When a `fallback` runnable is given, typically the same chain on the faster
+    FALLBACK_MODEL_NAME, it runs after a timeout or failure with LLM_FALLBACK_DEADLINE seconds.
+    Outcomes are counted per call so hedging can be tuned against the extra requests it costs.
+    """
+    def __init__(self):
+        self.deadline = float(os.getenv("LLM_DEADLINE", "30"))
+        self.fallback_deadline = float(os.getenv("LLM_FALLBACK_DEADLINE", "5"))
+        self.hedge_enabled = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+        self.hedge_calls = {call.strip() for call in os.getenv("LLM_HEDGE_CALLS", "rewrite").split(",") if call.strip()}
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.hedge_min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.hedge_initial_delay = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "3"))
+        self.hedge_min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+        self.latency_window = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+        self._deadlines: Dict[str, float] = {}
+        self._latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.latency_window))
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "primary": 0, "hedge": 0, "timeout": 0, "error": 0, "fallback": 0, "fallback_failed": 0, "hedges_fired": 0}
+        )
+
+    def deadline_for(self, call: str) -> float:
+        if call not in self._deadlines:
+            self._deadlines[call] = float(os.getenv(f"LLM_DEADLINE_{call.upper()}", DEFAULT_DEADLINES.get(call, self.deadline)))
+        return self._deadlines[call]
+
+    def hedge_delay(self, call: str) -> Optional[float]:
+        """
+        Seconds to wait before hedging a call, or None when the call is not hedged.
+        """
+        if not self.hedge_enabled or call not in self.hedge_calls:
+            return None
+        latencies = self._latencies[call]
+        if len(latencies) < self.hedge_min_samples:
+            return max(self.hedge_min_delay, self.hedge_initial_delay)
+        return max(self.hedge_min_delay, float(np.percentile(latencies, self.hedge_percentile)))
+
+    def _record(self, call: str, outcome: str):
+        self._counters[call][outcome] += 1
+        LLM_CALLS.labels(call, outcome).inc()
+
+    async def _race(self, call: str, runnable, inputs, deadline: float, hedge_delay: Optional[float], record_latency: bool = True) -> Tuple[Any, str]:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks: List[asyncio.Future] = [asyncio.ensure_future(runnable.ainvoke(inputs))]
+        errors: List[BaseException] = []
+        try:
+            while True:
+                can_hedge = hedge_delay is not None and len(tasks) == 1
+                pending = [task for task in tasks if not task.done()]
+                now = loop.time()
+                if can_hedge and (not pending or now - started >= hedge_delay):
+                    tasks.append(asyncio.ensure_future(runnable.ainvoke(inputs)))
+                    self._counters[call]["hedges_fired"] += 1
+                    LLM_HEDGES.labels(call).inc()
+                    continue
+                if not pending:
+                    raise errors[-1]
+                remaining = started + deadline - now
+                if remaining <= 0:
+                    raise LLMTimeoutError(f"LLM call '{call}' exceeded its {deadline:.1f}s deadline")
+                timeout = min(remaining, started + hedge_delay - now) if can_hedge else remaining
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if record_latency:
+                            self._latencies[call].append(loop.time() - started)
+                        return task.result(), "primary" if task is tasks[0] else "hedge"
+                    errors.append(task.exception())
+        finally:
+            # Cancel the loser, or everything still running after a timeout or cancellation
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def run(self, call: str, runnable, inputs, fallback=None):
+        """
+        Invokes `runnable` with `inputs` under the call's deadline, hedging and fallback policy.
+
+        Args:
+            call (str): Name of the call, such as "rewrite" or "generate", used for its
+                deadline, hedging and outcome counters.
+            runnable (Runnable): The chain to run.
+            inputs (dict): The chain's input.
+            fallback (Runnable, optional): Chain to run when the primary times out or fails.
+
+        Returns:
+            The chain's output.
+
+        Raises:
+            LLMTimeoutError: When the call and its fallback missed their deadlines.
+        """
+        self._counters[call]["calls"] += 1
+        try:
+            result, outcome = await self._race(call, runnable, inputs, self.deadline_for(call), self.hedge_delay(call))
+            self._record(call, outcome)
+            return result
+        except LLMTimeoutError:
+            self._record(call, "timeout")
+            if fallback is None:
+                raise
+            logger.warning(f"LLM call '{call}' timed out, falling back to the secondary model.")
+        except Exception as e:
+            self._record(call, "error")
+            if fallback is None:
+                raise
+            logger.warning(f"LLM call '{call}' failed, falling back to the secondary model: {e}")
+
+        try:
+            # The fallback's latencies would distort the primary's hedge delay, so they are not kept
+            result, _ = await self._race(call, fallback, inputs, self.fallback_deadline, None, record_latency=False)
+        except Exception:
+            self._record(call, "fallback_failed")
+            raise
+        self._record(call, "fallback")
+        return result
+
+    def stats(self) -> dict:
+        stats = {}
+        for call, counters in self._counters.items():
+            delay = self.hedge_delay(call)
+            stats[call] = {**counters, "hedge_delay_s": round(delay, 3) if delay is not None else None}
+        return stats
+
+
+llm_executor = LLMExecutor()
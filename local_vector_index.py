@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from corpus_versions import VersionReader, load_corpus_version
+from logger import logger
+from quantization import QuantizedMatrix, SUPPORTED_DTYPES
+
+load_dotenv()
+
+try:
+    import hnswlib
+except ImportError:  # optional: exact search is used when hnswlib is not installed
+    hnswlib = None
+
+Loader = Callable[[str], Iterable[Tuple[Document, list]]]
+
+
+class LocalBotIndex:
+    """
+    One bot's chunk embeddings as a memory-mapped, row-normalized matrix on disk.
+
+    Search is an exact top-k over the (possibly quantized) matrix; above
+    LOCAL_VECTOR_ANN_THRESHOLD rows an hnswlib graph is used instead when the package is
+    installed. When a full-precision copy is kept, the top `k * rescore_factor` candidates are
+    rescored against it, which only pages in those rows. Scores follow Atlas's cosine
+    convention, (1 + cosine) / 2, so existing score thresholds keep their meaning.
+    """
+    def __init__(self, vectors: QuantizedMatrix, documents: List[Document], ann=None, full: Optional[np.ndarray] = None, rescore_factor: int = 0, corpus_version: Optional[str] = None):
+        self.vectors = vectors
+        self.documents = documents
+        self.ann = ann
+        self.full = full
+        self.rescore_factor = rescore_factor
+        self.corpus_version = corpus_version
+        self.validated_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query: List[float], k: int, score_threshold: Optional[float] = None) -> List[Tuple[Document, float]]:
+        if not self.documents:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        k = min(k, len(self.documents))
+        rescore = self.full is not None and self.rescore_factor > 0
+        candidates = min(k * self.rescore_factor, len(self.documents)) if rescore else k
+
+        if self.ann is not None:
+            labels, distances = self.ann.knn_query(query, k=candidates)
+            rows, cosines = labels[0], 1 - distances[0]
+        else:
+            scores = self.vectors.scores(query)
+            rows = np.argpartition(-scores, candidates - 1)[:candidates]
+            rows = rows[np.argsort(-scores[rows])]
+            cosines = scores[rows]
+
+        if rescore:
+            ordered = np.sort(rows)
+            exact = self.full[ordered] @ query
+            best = np.argsort(-exact)[:k]
+            rows, cosines = ordered[best], exact[best]
+
+        results = []
+        for row, cosine in zip(rows[:k], cosines[:k]):
+            score = float((1 + cosine) / 2)
+            if score_threshold is None or score >= score_threshold:
+                results.append((self.documents[int(row)], score))
+        return results
+
+
+class LocalVectorIndexRegistry:
+    """
+    Builds, persists and caches LocalBotIndex instances.
+
+    Each bot's matrix is written to LOCAL_VECTOR_DIR as a .npy file (LOCAL_VECTOR_DTYPE:
+    float32, float16, or int8 with a per-bot scale/offset) with its chunks in a JSON-lines
+    file, then opened with mmap so the OS page cache is shared between workers. With a
+    quantized dtype and LOCAL_VECTOR_RESCORE_FACTOR > 0 a float32 copy is written alongside
+    for rescoring the top candidates. A manifest per bot points at the current version
+    and is swapped atomically; the version before it is kept on disk so workers still reading
+    it are not affected, and older ones are removed.
+
+    Every build records the bot's corpus version, which ingestion bumps whenever it writes or
+    removes chunks. Every LOCAL_VECTOR_TTL seconds an index is revalidated by reading that
+    version alone, and only a mismatch rebuilds it from Mongo, so an unchanged corpus is never
+    reloaded. `invalidate` drops the index in this process at once.
+    """
+    def __init__(self):
+        self.root = os.getenv("LOCAL_VECTOR_DIR", ".vector_index")
+        self.dtype = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+        if self.dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"LOCAL_VECTOR_DTYPE must be one of {SUPPORTED_DTYPES}, got {self.dtype!r}")
+        self.rescore_factor = int(os.getenv("LOCAL_VECTOR_RESCORE_FACTOR", "0"))
+        self.ttl = float(os.getenv("LOCAL_VECTOR_TTL", "60"))
+        self.ann_threshold = int(os.getenv("LOCAL_VECTOR_ANN_THRESHOLD", "50000"))
+        self.ann_ef = int(os.getenv("LOCAL_VECTOR_ANN_EF", "64"))
+        self._indexes: Dict[str, LocalBotIndex] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._counters = {"hits": 0, "loads": 0, "builds": 0, "revalidations": 0, "invalidations": 0}
+
+    def _prefix(self, bot_token: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(bot_token.encode("utf-8")).hexdigest())
+
+    def _build_lock(self, bot_token: str) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(bot_token, threading.Lock())
+
+    def get(self, bot_token: str, loader: Loader, version_reader: Optional[VersionReader] = None) -> LocalBotIndex:
+        """
+        Returns the bot's index: from memory, else from disk, else built from `loader`.
+
+        Args:
+            bot_token (str): The bot.
+            loader (Loader): Streams the bot's (document, embedding) pairs for a build.
+            version_reader (VersionReader, optional): Returns the bot's current corpus version;
+                without one, indexes are only replaced through `invalidate`.
+        """
+        with self._lock:
+            index = self._indexes.get(bot_token)
+            if index is not None and time.monotonic() - index.validated_at < self.ttl:
+                self._counters["hits"] += 1
+                return index
+
+        with self._build_lock(bot_token):
+            with self._lock:
+                index = self._indexes.get(bot_token)
+                if index is not None and time.monotonic() - index.validated_at < self.ttl:
+                    return index
+            version = self._read_version(bot_token, version_reader, index)
+            if index is not None and index.corpus_version == version:
+                self._counters["revalidations"] += 1
+                index.validated_at = time.monotonic()
+                return index
+            index = self._load(bot_token, version)
+            if index is None:
+                self._build(bot_token, loader, version)
+                index = self._load(bot_token, version)
+            with self._lock:
+                self._indexes[bot_token] = index
+            return index
+
+    @staticmethod
+    def _read_version(bot_token: str, version_reader: Optional[VersionReader], index: Optional[LocalBotIndex]) -> Optional[str]:
+        if version_reader is None:
+            return index.corpus_version if index is not None else None
+        try:
+            return version_reader(bot_token)
+        except Exception as e:
+            # Keep serving what is loaded rather than rebuilding while the version is unknown
+            logger.warning(f"Could not read the corpus version for Bot token: {bot_token} - {e}")
+            return index.corpus_version if index is not None else None
+
+    def _load(self, bot_token: str, corpus_version: Optional[str]) -> Optional[LocalBotIndex]:
+        manifest_path = self._prefix(bot_token) + ".json"
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+        if manifest.get("corpus_version") != corpus_version:
+            return None
+
+        version_prefix = os.path.join(self.root, manifest["version"])
+        if manifest["count"]:
+            params = np.load(version_prefix + ".quant.npy") if os.path.exists(version_prefix + ".quant.npy") else None
+            vectors = QuantizedMatrix.from_params(np.load(version_prefix + ".npy", mmap_mode="r"), params)
+        else:
+            vectors = QuantizedMatrix(np.zeros((0, 0), dtype=manifest["dtype"]))
+        full = None
+        if self.rescore_factor > 0 and os.path.exists(version_prefix + ".f32.npy"):
+            full = np.load(version_prefix + ".f32.npy", mmap_mode="r")
+        documents = []
+        with open(version_prefix + ".jsonl") as documents_file:
+            for line in documents_file:
+                record = json.loads(line)
+                documents.append(Document(page_content=record["content"], metadata=record["metadata"]))
+
+        ann = None
+        if hnswlib is not None and len(documents) >= self.ann_threshold:
+            ann = hnswlib.Index(space="ip", dim=vectors.codes.shape[1])
+            if os.path.exists(version_prefix + ".hnsw"):
+                ann.load_index(version_prefix + ".hnsw", max_elements=len(documents))
+            else:
+                ann.init_index(max_elements=len(documents), ef_construction=200, M=16)
+                ann.add_items(vectors.dequantize())
+                ann.save_index(version_prefix + ".hnsw")
+            ann.set_ef(self.ann_ef)
+
+        self._counters["loads"] += 1
+        return LocalBotIndex(vectors, documents, ann, full, self.rescore_factor, corpus_version)
+
+    def _build(self, bot_token: str, loader: Loader, corpus_version: Optional[str] = None):
+        """
+        Streams (document, embedding) pairs from the loader into a new on-disk version.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        start_time = time.time()
+        version = f"{os.path.basename(self._prefix(bot_token))}-{uuid.uuid4().hex[:8]}"
+        version_prefix = os.path.join(self.root, version)
+
+        rows = []
+        count = 0
+        with open(version_prefix + ".jsonl", "w") as documents_file:
+            for document, embedding in loader(bot_token):
+                vector = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                rows.append(vector / norm if norm else vector)
+                documents_file.write(json.dumps({"content": document.page_content, "metadata": document.metadata}, default=str) + "\n")
+                count += 1
+        if rows:
+            full = np.stack(rows)
+            vectors = QuantizedMatrix.quantize(full, self.dtype)
+            self._save(version_prefix + ".npy", vectors.codes)
+            if vectors.scale is not None:
+                np.save(version_prefix + ".quant.npy", vectors.params())
+            if self.dtype != "float32" and self.rescore_factor > 0:
+                self._save(version_prefix + ".f32.npy", full)
+
+        manifest_path = self._prefix(bot_token) + ".json"
+        previous = {}
+        try:
+            with open(manifest_path) as manifest_file:
+                previous = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        manifest = {
+            "version": version,
+            "previous": previous.get("version"),
+            "corpus_version": corpus_version,
+            "count": count,
+            "dtype": self.dtype,
+            "built_at": time.time(),
+        }
+        with open(manifest_path + ".tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        # The replaced version may still be open in other workers until they revalidate; only
+        # the one before it is old enough to remove
+        if previous.get("previous"):
+            self._remove_version(previous["previous"])
+
+        self._counters["builds"] += 1
+        logger.info(f"Built local vector index for Bot token: {bot_token} with {count} chunks in {time.time() - start_time:.2f} seconds.")
+
+    @staticmethod
+    def _save(path: str, array: np.ndarray):
+        matrix = np.lib.format.open_memmap(path, mode="w+", dtype=array.dtype, shape=array.shape)
+        matrix[:] = array
+        matrix.flush()
+        del matrix
+
+    def _remove_version(self, version: str):
+        for suffix in (".npy", ".quant.npy", ".f32.npy", ".jsonl", ".hnsw"):
+            try:
+                os.remove(os.path.join(self.root, version) + suffix)
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, bot_token: str):
+        """
+        Drops the bot's index in this process, so the next query here revalidates it against
+        the corpus version. Other workers pick up a changed corpus on their next revalidation.
+        """
+        with self._lock:
+            self._indexes.pop(bot_token, None)
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "bots": len(self._indexes),
+                "dtype": self.dtype,
+                "vector_bytes": sum(index.vectors.nbytes for index in self._indexes.values()),
+                "ann_available": hnswlib is not None,
+            }
+
+
+local_vector_indexes = LocalVectorIndexRegistry()
+
+
+def load_bot_embeddings(bot_token: str) -> Iterable[Tuple[Document, list]]:
+    """
+    Streams a bot's chunks and their stored embeddings from the Mongo chunk collection.
+    """
+    from constants import collection
+    for doc in collection.find({"bot_token": bot_token}):
+        embedding = doc.pop("embedding")
+        content = doc.pop("content")
+        yield Document(page_content=content, metadata={**doc, "_id": str(doc["_id"])}), embedding
+
+
+class LocalVectorRetriever(BaseRetriever):
+    """
+    Retriever over a bot's LocalBotIndex, interchangeable with the Atlas vector store retriever.
+    `loader` defaults to the Mongo chunk collection and can be any iterable of
+    (Document, embedding) pairs, which keeps the retriever usable without Atlas.
+    """
+    bot_token: str
+    embeddings: Embeddings
+    loader: Loader = load_bot_embeddings
+    version_reader: Optional[VersionReader] = load_corpus_version
+    k: int = 5
+    score_threshold: Optional[float] = None
+
+    def _search(self, query_embedding: List[float]) -> List[Document]:
+        index = local_vector_indexes.get(self.bot_token, self.loader, self.version_reader)
+        return [document for document, _ in index.search(query_embedding, self.k, self.score_threshold)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._search(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        query_embedding = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self._search, query_embedding)
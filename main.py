@@ -1,21 +1,74 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from validators import ChatRequest, ChatResponse
 from constants import llm_model
-from utils import  add_message_to_history, get_chat_history, get_ensemble_retriever, get_assistant_details,get_retriever
+from utils import  add_message_to_history, get_chat_history, get_ensemble_retriever, get_retriever
+from assistant_cache import assistant_cache
+from bm25_index import bm25_indexes
+from vector_store import resources
+from embedding_service import embedding_service
+from semantic_cache import semantic_cache
+from history_store import history_store
+from history_summary import history_summarizer
+from ingestion import ingestion_pipeline
+from local_vector_index import local_vector_indexes
+from query_rewrite import query_rewriter
+from hybrid_retriever import hybrid_search
+from follow_ups import follow_up_manager
+from chain_cache import chain_cache
+from context_packing import context_packer
+from admission import AdmissionRejected, admission
+from llm_executor import llm_executor
+from singleflight import answer_flight, answer_key
+from metrics import MetricsMiddleware, register_stats, render_metrics
+from timings import stage
+from typing import Optional
+import hmac
+import os
 import uuid
 from logger import logger
 import asyncio
-from bot_response import generate_answer, generate_follow_up_questions, remove_think_step, generate_answer_v2
+from bot_response import generate_answer, generate_follow_up_questions, remove_think_step, generate_answer_v2, stream_answer_v2
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import time
+import json
+from contextlib import asynccontextmanager
 
 load_dotenv()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the background workers and warms the shared resources when a worker starts, and
+    flushes and stops them when it shuts down.
+
+    Warm up runs off the event loop and `/ready` answers 503 until it completes; with
+    WARM_UP_BEFORE_SERVING=true the worker waits for it before accepting requests. Under
+    gunicorn with preload_app the embedding model is already loaded in the parent, so warm up
+    only runs the first embedding.
+    """
+    embedding_service.start()
+    history_store.start()
+    assistant_cache.start()
+    app.state.warm_up_task = asyncio.create_task(asyncio.to_thread(resources.warm_up))
+    if os.getenv("WARM_UP_BEFORE_SERVING", "false").lower() == "true":
+        await app.state.warm_up_task
+    yield
+    await assistant_cache.close()
+    await embedding_service.stop()
+    await follow_up_manager.stop()
+    await history_summarizer.stop()
+    # Persist queued chat history before the worker exits
+    await history_store.stop()
+
+
 # Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.add_middleware(
     CORSMiddleware,
@@ -23,7 +76,127 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(MetricsMiddleware)
+
+COMPONENT_STATS = {
+    "assistant_cache": assistant_cache.stats,
+    "bm25_indexes": bm25_indexes.stats,
+    "embedding_service": embedding_service.stats,
+    "semantic_cache": semantic_cache.stats,
+    "history_store": history_store.stats,
+    "history_summarizer": history_summarizer.stats,
+    "local_vector_indexes": local_vector_indexes.stats,
+    "ingestion_jobs": ingestion_pipeline.stats,
+    "query_rewriter": query_rewriter.stats,
+    "hybrid_retriever": hybrid_search.stats,
+    "follow_ups": follow_up_manager.stats,
+    "chain_cache": chain_cache.stats,
+    "answer_flight": answer_flight.stats,
+    "context_packer": context_packer.stats,
+    "admission": admission.stats,
+    "llm_executor": llm_executor.stats,
+}
+for name, source in COMPONENT_STATS.items():
+    register_stats(name, source)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    status = await asyncio.to_thread(resources.health)
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(_request, exc: AdmissionRejected):
+    return JSONResponse(
+        {"detail": "The assistant is busy, please retry shortly.", "reason": exc.reason},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    Guards the cache management, stats and metrics endpoints, which stay closed unless
+    ADMIN_API_TOKEN is configured.
+    """
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def _on_assistant_invalidated(bot_token: Optional[str], cached: Optional[dict]):
+    # Runs in every worker, for local and synced invalidations alike
+    follow_up_manager.invalidate(bot_token)
+    if bot_token is None:
+        chain_cache.invalidate()
+    elif cached is not None and isinstance(cached.get('data'), dict) and cached['data'].get('prompts'):
+        chain_cache.invalidate(cached['data']['prompts'])
+
+
+assistant_cache.on_invalidate(_on_assistant_invalidated)
+
+
+@app.delete("/assistant-cache/{bot_token}", dependencies=[Depends(verify_admin_token)])
+async def invalidate_assistant(bot_token: str):
+    """
+    Drops the cached assistant configuration for a bot. The admin backend calls this after an
+    assistant's prompts or status change so the next chat picks up the new configuration.
+    Other workers drop it within ASSISTANT_CACHE_SYNC_INTERVAL seconds.
+    """
+    return {"invalidated": await assistant_cache.broadcast_invalidation(bot_token)}
+
+
+@app.delete("/assistant-cache/", dependencies=[Depends(verify_admin_token)])
+async def invalidate_all_assistants():
+    return {"invalidated": await assistant_cache.broadcast_invalidation()}
+
+
+@app.get("/stats", dependencies=[Depends(verify_admin_token)])
+async def stats():
+    return {name: source() for name, source in COMPONENT_STATS.items()}
+
+
+@app.get("/metrics", dependencies=[Depends(verify_admin_token)])
+async def metrics():
+    """
+    Prometheus exposition of request and stage latencies, in-flight requests, LLM token
+    counts and the component stats above.
+    """
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+
+def suggest_follow_ups(request: ChatRequest, chat_history, docs, llm, prompts):
+    """
+    Returns cached follow-up questions right away, otherwise schedules their generation.
+
+    Returns:
+        tuple: (questions, follow_up_id); exactly one of them is set unless follow-ups are disabled.
+    """
+    questions = follow_up_manager.cached(request.bot_token, request.question, chat_history)
+    if questions is not None:
+        return questions, None
+    return [], follow_up_manager.schedule(request.bot_token, request.question, chat_history, docs, llm, prompts)
+
+
+@app.get("/chat/follow-ups/{follow_up_id}")
+async def get_follow_ups(follow_up_id: str, wait: float = 0):
+    """
+    Returns the follow-up questions scheduled by a chat response, waiting up to `wait`
+    seconds (at most 30) for them to be generated.
+    """
+    return await follow_up_manager.get(follow_up_id, min(max(wait, 0), 30))
+
 
 @app.post("/chat_v1/", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -36,29 +209,32 @@ async def chat(request: ChatRequest):
     Returns:
         ChatResponse: The chatbot's response.
     """
+    with stage("assistant"):
+        assistant = await assistant_cache.get(request.bot_token)
+
+    if not assistant.get('status') == 200:
+        return JSONResponse({"message": assistant['data']['message']})
+
+    if assistant['data']['status'] != 'ACTIVE':
+        return ChatResponse(answer="Assistant is Not Active Currently. Please contact admin for activation", questions=[])
+
+    # Only known, active bots take an admission slot
+    ticket = await admission.acquire(request.bot_token)
     try:
         # Record the start time
         start_time = time.time()
 
         llm = llm_model()
-        assistant = get_assistant_details(bot_token=request.bot_token)
-        print(assistant)
-
-        if not assistant.get('status') == 200:
-            return JSONResponse({"message": assistant['data']['message']})
-
-        if assistant['data']['status'] != 'ACTIVE':
-            return ChatResponse(answer="Assistant is Not Active Currently. Please contact admin for activation", questions=[])
-
-        chat_history = get_chat_history(request.session_id)
+        with stage("history"):
+            chat_history = await get_chat_history(request.session_id) or []
         retrievers = get_ensemble_retriever(request.bot_token, llm)
 
         prompts = assistant['data']['prompts']
         
-        # Perform asynchronous tasks
-        follow_up_questions, response = await asyncio.gather(
-            generate_follow_up_questions(chat_history, request.question, retrievers[1], llm, prompts=prompts),
-            generate_answer(request.question, retrievers[0], chat_history, llm, prompts=prompts)
+        # Follow-up questions are generated after the answer from the same documents
+        response, docs = await generate_answer(
+            request.question, retrievers[0], chat_history, llm, prompts=prompts, return_docs=True,
+            context_budget=context_packer.budget_for(assistant['data']),
         )
 
         if not response.strip():
@@ -67,36 +243,43 @@ async def chat(request: ChatRequest):
             response = response[len("AI:"):].strip()
 
         response = remove_think_step(response)
-        add_message_to_history(request.question, response, request.bot_token, request.session_id)
+        with stage("persist_history"):
+            await add_message_to_history(request.question, response, request.bot_token, request.session_id, llm, prompts)
+        questions, follow_up_id = suggest_follow_ups(request, chat_history, docs, llm, prompts)
 
         # Calculate the elapsed time
         elapsed_time = time.time() - start_time
-        print(f"Response time: {elapsed_time:.4f} seconds")
+        logger.info(f"Response time: {elapsed_time:.4f} seconds")
 
-        return ChatResponse(answer=response, questions=follow_up_questions["questions"])
+        return ChatResponse(answer=response, questions=questions, follow_up_id=follow_up_id)
 
     except Exception as e:
         logger.error(f"Error handling chat request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        ticket.release()
 
 # from test import main_#?chatbot
 @app.post("/chat/", response_model=ChatResponse)
 async def chat_v2(request: ChatRequest):
+    with stage("assistant"):
+        assistant = await assistant_cache.get(request.bot_token)
+
+    if not assistant.get('status') == 200:
+        return JSONResponse({"message": assistant['data']['message']})
+
+    if assistant['data']['status'] != 'ACTIVE':
+        return ChatResponse(answer="Assistant is Not Active Currently. Please contact admin for activation", questions=[])
+
+    # Only known, active bots take an admission slot
+    ticket = await admission.acquire(request.bot_token)
     try:
         # Record the start time
         start_time = time.time()
 
         llm = llm_model()
-        assistant = get_assistant_details(bot_token=request.bot_token)
-        print(assistant)
-
-        if not assistant.get('status') == 200:
-            return JSONResponse({"message": assistant['data']['message']})
-
-        if assistant['data']['status'] != 'ACTIVE':
-            return ChatResponse(answer="Assistant is Not Active Currently. Please contact admin for activation", questions=[])
-
-        # chat_history = get_chat_history(request.session_id)
+        with stage("history"):
+            chat_history = await get_chat_history(request.session_id) or []
         retrievers = get_retriever(request.bot_token)
 
         prompts = assistant['data']['prompts']
@@ -106,7 +289,15 @@ async def chat_v2(request: ChatRequest):
         #     generate_follow_up_questions(chat_history, request.question, retrievers[1], llm, prompts=prompts),
         #     generate_answer(request.question, retrievers[0], chat_history, llm, prompts=prompts)
         # )
-        response = await generate_answer_v2(request.question, request.session_id, retrievers, llm, prompts)
+        # Identical concurrent questions share one pipeline run; each request still writes its own history
+        response, coalesced = await answer_flight.do(
+            answer_key(request.bot_token, request.question, chat_history),
+            lambda: generate_answer_v2(
+                request.question, request.session_id, retrievers, llm, prompts,
+                bot_token=request.bot_token, semantic_caching=semantic_cache.is_enabled(assistant['data']),
+                chat_history=chat_history, context_budget=context_packer.budget_for(assistant['data']),
+            ),
+        )
 
         # if not response.strip():
         #     response = "Could you Please rephrase the question with more context?"
@@ -114,15 +305,91 @@ async def chat_v2(request: ChatRequest):
         #     response = response[len("AI:"):].strip()
 
         # response = remove_think_step(response)
-        add_message_to_history(request.question, response['answer'], request.bot_token, request.session_id)
+        with stage("persist_history"):
+            await add_message_to_history(request.question, response['answer'], request.bot_token, request.session_id, llm, prompts)
+        questions, follow_up_id = suggest_follow_ups(request, chat_history, response['docs'], llm, prompts)
 
         # Calculate the elapsed time
         elapsed_time = time.time() - start_time
-        print(f"Response time: {elapsed_time:.4f} seconds")
+        logger.info(f"Response time: {elapsed_time:.4f} seconds")
+        logger.info(f"Stage timings: {response['timings']}" + (" (coalesced)" if coalesced else ""))
 
-        return ChatResponse(answer=response['answer'], questions=[])#follow_up_questions["questions"])
+        return ChatResponse(answer=response['answer'], questions=questions, follow_up_id=follow_up_id)
 
     except Exception as e:
-        print("RESPONSE = ", response)
         logger.error(f"Error handling chat request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        ticket.release()
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat/. Answer tokens are sent as Server-Sent Events as they are
+    generated: `token` events carry text fragments and a `done` event carries the full answer.
+    Follow-up questions are pushed afterwards as a `follow_ups` event, once generated or after
+    FOLLOW_UP_STREAM_WAIT seconds.
+    """
+    with stage("assistant"):
+        assistant = await assistant_cache.get(request.bot_token)
+
+    if not assistant.get('status') == 200:
+        return JSONResponse({"message": assistant['data']['message']})
+
+    if assistant['data']['status'] != 'ACTIVE':
+        async def inactive_stream():
+            yield sse_event("done", {"answer": "Assistant is Not Active Currently. Please contact admin for activation", "questions": []})
+        return StreamingResponse(inactive_stream(), media_type="text/event-stream")
+
+    llm = llm_model()
+    retriever = get_retriever(request.bot_token)
+    prompts = assistant['data']['prompts']
+
+    async def event_stream():
+        start_time = time.time()
+        parts = []
+        retrieved = []
+        try:
+            with stage("history"):
+                chat_history = await get_chat_history(request.session_id) or []
+            async for token in stream_answer_v2(
+                request.question, request.session_id, retriever, llm, prompts,
+                bot_token=request.bot_token, semantic_caching=semantic_cache.is_enabled(assistant['data']),
+                chat_history=chat_history, on_retrieved=retrieved.extend,
+                context_budget=context_packer.budget_for(assistant['data']),
+            ):
+                if not parts:
+                    logger.info(f"Time to first token: {time.time() - start_time:.4f} seconds")
+                parts.append(token)
+                yield sse_event("token", {"token": token})
+
+            answer = "".join(parts)
+            with stage("persist_history"):
+                await add_message_to_history(request.question, answer, request.bot_token, request.session_id, llm, prompts)
+            questions, follow_up_id = suggest_follow_ups(request, chat_history, retrieved, llm, prompts)
+            yield sse_event("done", {"answer": answer, "questions": questions, "follow_up_id": follow_up_id})
+            # The answer is complete; waiting for follow-ups must not hold the bot's slot
+            ticket.release()
+            logger.info(f"Stream response time: {time.time() - start_time:.4f} seconds")
+            if follow_up_id is not None:
+                follow_ups = await follow_up_manager.get(follow_up_id, float(os.getenv("FOLLOW_UP_STREAM_WAIT", "10")))
+                yield sse_event("follow_ups", follow_ups)
+        except Exception as e:
+            logger.error(f"Error handling chat stream request: {str(e)}", exc_info=True)
+            yield sse_event("error", {"message": "Sorry, I encountered an error. Please try again later."})
+        finally:
+            ticket.release()
+
+    # The slot is held until the answer is done; the background task releases it if the body never starts
+    ticket = await admission.acquire(request.bot_token)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release),
+    )
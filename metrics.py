@@ -0,0 +1,170 @@
+import os
+import time
+from typing import Callable, Dict, Iterable
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from timings import StageTimings, current_timings
+
+load_dotenv()
+
+INSTRUMENTED_PATHS = frozenset({"/chat/", "/chat_v1/", "/chat/stream"})
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+REQUEST_DURATION = Histogram(
+    "sara_request_duration_seconds", "End-to-end chat request latency, including streamed bodies.",
+    ["endpoint", "status"], buckets=_LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "sara_stage_duration_seconds", "Latency of each stage of the chat pipelines.",
+    ["endpoint", "stage"], buckets=_LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("sara_requests_in_flight", "Chat requests currently being handled.", ["endpoint"], multiprocess_mode="livesum")
+CONTEXT_TOKENS_SAVED = Histogram(
+    "sara_context_tokens_saved", "Estimated prompt tokens removed from each request's context by packing.",
+    buckets=(0, 50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+ADMISSION_QUEUE_DEPTH = Gauge("sara_admission_queue_depth", "Chat requests waiting for an admission slot.", multiprocess_mode="livesum")
+ADMISSION_WAIT = Histogram(
+    "sara_admission_wait_seconds", "Time chat requests waited for an admission slot.",
+    ["outcome"], buckets=_LATENCY_BUCKETS,
+)
+ADMISSION_REJECTED = Counter("sara_admission_rejected_total", "Chat requests shed by admission control.", ["reason", "status"])
+LLM_CALLS = Counter("sara_llm_calls_total", "Outcomes of chat model calls made through the LLM executor.", ["call", "outcome"])
+LLM_HEDGES = Counter("sara_llm_hedges_total", "Hedged duplicate chat model requests fired.", ["call"])
+HISTORY_COMPACTIONS = Counter("sara_history_compactions_total", "Background chat history summarizations by outcome.", ["outcome"])
+LLM_TOKENS = Counter("sara_llm_tokens_total", "Tokens sent to and generated by the chat model.", ["model", "direction"])
+
+_stats_sources: Dict[str, Callable[[], object]] = {}
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Counts prompt and completion tokens from the usage metadata chat models report.
+    """
+    def on_llm_end(self, response: LLMResult, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                model = (getattr(message, "response_metadata", None) or {}).get("model_name", "unknown")
+                LLM_TOKENS.labels(model, "input").inc(usage.get("input_tokens", 0))
+                LLM_TOKENS.labels(model, "output").inc(usage.get("output_tokens", 0))
+
+
+llm_token_counter = TokenUsageCallback()
+
+
+def register_stats(name: str, source: Callable[[], object]):
+    """
+    Exposes a component's `stats()` as `sara_component_stat` gauges at scrape time.
+    """
+    _stats_sources[name] = source
+
+
+def _numeric_stats(stats: dict, prefix: str = "") -> Iterable:
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _numeric_stats(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", float(value)
+
+
+class ComponentStatsCollector:
+    """
+    Reads the registered `stats()` dicts when Prometheus scrapes, so cache hit rates, queue
+    depths and counters cost nothing on the request path.
+    """
+    def collect(self):
+        family = GaugeMetricFamily("sara_component_stat", "Numeric values from component stats().", labels=["component", "stat"])
+        hit_rates = GaugeMetricFamily("sara_cache_hit_rate", "Hit rate of each in-process cache.", labels=["cache"])
+        for component, source in list(_stats_sources.items()):
+            try:
+                stats = source()
+            except Exception:
+                continue
+            if not isinstance(stats, dict):
+                continue
+            for stat, value in _numeric_stats(stats):
+                family.add_metric([component, stat], value)
+                parts = stat.rsplit(".", 1)
+                if parts[-1] in ("hit_rate", "cache_hit_rate"):
+                    hit_rates.add_metric([component if len(parts) == 1 else f"{component}.{parts[0]}"], value)
+        yield family
+        yield hit_rates
+
+
+component_stats_collector = ComponentStatsCollector()
+REGISTRY.register(component_stats_collector)
+
+
+def server_timing(timings: StageTimings) -> str:
+    return ", ".join(f"{name};dur={elapsed_ms:.1f}" for name, elapsed_ms in timings.stages.items())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times the chat endpoints.
+
+    Each request gets a StageTimings in `timings.current_timings` that the pipeline's `stage()`
+    blocks write to. When the request finishes the stages are observed into
+    `sara_stage_duration_seconds`. With SERVER_TIMING_ENABLED the stages completed before
+    the response headers go out are also returned in a `Server-Timing` header.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.server_timing = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in INSTRUMENTED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = scope["path"]
+        timings = StageTimings()
+        token = current_timings.set(timings)
+        status = "500"
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if self.server_timing and timings.stages:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", server_timing(timings).encode("latin-1"))]
+            await send(message)
+
+        IN_FLIGHT.labels(endpoint).inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            IN_FLIGHT.labels(endpoint).dec()
+            current_timings.reset(token)
+            REQUEST_DURATION.labels(endpoint, status).observe(time.perf_counter() - start)
+            for name, elapsed_ms in timings.stages.items():
+                STAGE_DURATION.labels(endpoint, name).observe(elapsed_ms / 1000)
+
+
+def render_metrics():
+    """
+    Renders the metrics for a scrape.
+
+    Under gunicorn each worker keeps its own metric values, so gunicorn.conf.py sets
+    PROMETHEUS_MULTIPROC_DIR and the workers write their values there. When it is set the
+    counters, histograms and gauges of every live worker are aggregated into one response.
+    `sara_component_stat` and `sara_cache_hit_rate` are read from in-process `stats()` and
+    describe only the worker that answered the scrape.
+    """
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(component_stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
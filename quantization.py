@@ -0,0 +1,102 @@
+from typing import Optional
+
+import numpy as np
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Rows are scored in blocks so quantized matrices are upcast a slice at a time
+_SCORE_BLOCK_ROWS = 1024
+_INT8_LEVELS = 255
+_INT8_SHIFT = 128
+
+
+class QuantizedMatrix:
+    """
+    An embedding matrix stored as float32, float16 or int8 codes.
+
+    int8 uses an affine code per dimension, `x ~= (code + 128) * scale + offset`, with `scale`
+    and `offset` fitted to one bot's vectors so the 256 levels cover that corpus's actual range.
+    Dot products are computed on the codes directly:
+
+        x . q = code . (scale * q) + ((128 * scale + offset) . q)
+
+    so a query never needs the matrix to be dequantized.
+    """
+    def __init__(self, codes: np.ndarray, scale: Optional[np.ndarray] = None, offset: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def dtype(self) -> str:
+        return self.codes.dtype.name
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        params = 0 if self.scale is None else self.scale.nbytes + self.offset.nbytes
+        return self.codes.nbytes + params
+
+    @classmethod
+    def quantize(cls, matrix: np.ndarray, dtype: str) -> "QuantizedMatrix":
+        """
+        Quantizes a float matrix.
+
+        Args:
+            matrix (np.ndarray): Row vectors, shape (rows, dim).
+            dtype (str): One of SUPPORTED_DTYPES.
+
+        Returns:
+            QuantizedMatrix: The encoded matrix with its scale and offset for int8.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype != "int8":
+            return cls(matrix.astype(dtype))
+
+        offset = matrix.min(axis=0)
+        scale = (matrix.max(axis=0) - offset) / _INT8_LEVELS
+        scale[scale == 0] = 1.0
+        codes = np.rint((matrix - offset) / scale) - _INT8_SHIFT
+        return cls(np.clip(codes, -_INT8_SHIFT, _INT8_LEVELS - _INT8_SHIFT).astype(np.int8), scale.astype(np.float32), offset.astype(np.float32))
+
+    def params(self) -> Optional[np.ndarray]:
+        """
+        Returns scale and offset stacked as a (2, dim) array for persisting, or None.
+        """
+        return None if self.scale is None else np.stack([self.scale, self.offset])
+
+    @classmethod
+    def from_params(cls, codes: np.ndarray, params: Optional[np.ndarray]) -> "QuantizedMatrix":
+        if params is None:
+            return cls(codes)
+        return cls(codes, params[0], params[1])
+
+    def dequantize(self, rows=slice(None)) -> np.ndarray:
+        """
+        Returns the selected rows as float32.
+        """
+        codes = self.codes[rows].astype(np.float32)
+        if self.scale is None:
+            return codes
+        return (codes + _INT8_SHIFT) * self.scale + self.offset
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Returns the dot product of every row with `query`, computed on the stored codes.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.scale is None:
+            weights, bias = query, 0.0
+        else:
+            weights = self.scale * query
+            bias = float((_INT8_SHIFT * self.scale + self.offset) @ query)
+
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), _SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ weights
+        return scores + bias
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import re
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents.base import Document
+
+from bm25_index import tokenize
+from llm_executor import LLMTimeoutError, llm_executor
+from logger import logger
+from timings import StageTimings
+
+load_dotenv()
+
+# Words that usually point back at an earlier turn ("how much does it cost?")
+REFERENCE_WORDS = frozenset({
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "same", "above", "previous",
+    "former", "latter", "there", "else", "more", "another", "other", "others",
+})
+_FOLLOW_UP_OPENER = re.compile(r"^\s*(and|but|or|also|so|then|what about|how about)\b", re.IGNORECASE)
+
+
+class QueryRewriter:
+    """
+    Decides whether a question needs the standalone-question rewrite and overlaps it with
+    retrieval when it does.
+
+    With QUERY_REWRITE_MODE=auto (the default) the rewrite is skipped on a session's first turn
+    and for questions that look self-contained: at least QUERY_REWRITE_MIN_WORDS words, no
+    pronoun or other back-reference, and no follow-up opener such as "and" or "what about".
+    `always` restores the previous behaviour and `never` always retrieves on the raw question.
+
+    When a rewrite runs and QUERY_REWRITE_SPECULATIVE is enabled, retrieval on the raw question
+    starts at the same time. If the rewritten question shares at least
+    QUERY_REWRITE_REUSE_SIMILARITY of its words with the raw one, the speculative documents are
+    kept; otherwise they are discarded and retrieval runs again on the rewritten question.
+    """
+    def __init__(self):
+        self.mode = os.getenv("QUERY_REWRITE_MODE", "auto").lower()
+        self.speculative = os.getenv("QUERY_REWRITE_SPECULATIVE", "true").lower() == "true"
+        self.min_words = int(os.getenv("QUERY_REWRITE_MIN_WORDS", "4"))
+        self.reuse_similarity = float(os.getenv("QUERY_REWRITE_REUSE_SIMILARITY", "0.8"))
+        self._counters = {
+            "skipped_no_history": 0,
+            "skipped_self_contained": 0,
+            "skipped_disabled": 0,
+            "rewritten": 0,
+            "speculative_hits": 0,
+            "speculative_misses": 0,
+            "rewrite_timeouts": 0,
+        }
+
+    def needs_rewrite(self, question: str, chat_history: List[Tuple[str, str]]) -> bool:
+        if not chat_history:
+            self._counters["skipped_no_history"] += 1
+            return False
+        if self.mode == "never":
+            self._counters["skipped_disabled"] += 1
+            return False
+        if self.mode == "always":
+            return True
+        words = tokenize(question)
+        if len(words) >= self.min_words and not REFERENCE_WORDS.intersection(words) and not _FOLLOW_UP_OPENER.match(question):
+            self._counters["skipped_self_contained"] += 1
+            return False
+        return True
+
+    def _similar(self, question: str, standalone_question: str) -> bool:
+        original, rewritten = set(tokenize(question)), set(tokenize(standalone_question))
+        if not original or not rewritten:
+            return False
+        return len(original & rewritten) / len(original | rewritten) >= self.reuse_similarity
+
+    @staticmethod
+    async def _retrieve(retriever, query: str, timings: StageTimings, stage: str) -> List[Document]:
+        with timings.stage(stage):
+            return await retriever.ainvoke(query)
+
+    async def retrieve(self, question: str, chat_history, history, question_chain, retriever, timings: StageTimings, fallback_chain=None) -> Tuple[str, List[Document]]:
+        """
+        Resolves the search query for a question and retrieves its documents.
+
+        Args:
+            question (str): The user's question as asked.
+            chat_history (list): The session's (question, answer) turns.
+            history (list): The same turns as chat messages, for the rewrite prompt.
+            question_chain (Runnable): The standalone-question chain.
+            retriever (BaseRetriever): The bot's retriever.
+            timings (StageTimings): Receives the `rewrite`, `retrieve` and
+                `speculative_retrieve` stage durations.
+            fallback_chain (Runnable, optional): The standalone-question chain on the fallback
+                model, used when the rewrite misses its deadline.
+
+        Returns:
+            tuple: (query used for retrieval, retrieved documents)
+        """
+        if not self.needs_rewrite(question, chat_history):
+            return question, await self._retrieve(retriever, question, timings, "retrieve")
+
+        self._counters["rewritten"] += 1
+        speculative = None
+        if self.speculative:
+            speculative = asyncio.create_task(self._retrieve(retriever, question, timings, "speculative_retrieve"))
+        try:
+            with timings.stage("rewrite"):
+                standalone_question = await llm_executor.run("rewrite", question_chain, {"question": question, "history": history}, fallback=fallback_chain)
+        except LLMTimeoutError:
+            # Searching with the question as asked beats failing the request
+            logger.warning("Question rewrite timed out, retrieving with the original question.")
+            self._counters["rewrite_timeouts"] += 1
+            standalone_question = question
+        except BaseException:
+            if speculative is not None:
+                speculative.cancel()
+            raise
+
+        if speculative is not None:
+            if self._similar(question, standalone_question):
+                try:
+                    docs = await speculative
+                    self._counters["speculative_hits"] += 1
+                    return standalone_question, docs
+                except Exception as e:
+                    logger.warning(f"Speculative retrieval failed, retrying with the rewritten question: {e}")
+            else:
+                speculative.cancel()
+            self._counters["speculative_misses"] += 1
+
+        return standalone_question, await self._retrieve(retriever, standalone_question, timings, "retrieve")
+
+    def stats(self) -> dict:
+        return {**self._counters, "mode": self.mode, "speculative": self.speculative}
+
+
+query_rewriter = QueryRewriter()
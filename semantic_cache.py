@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from corpus_versions import VersionReader, load_corpus_version
+from logger import logger
+
+load_dotenv()
+
+
+class BotAnswerCache:
+    """
+    Bounded cache of one bot's first-turn answers, searched by cosine similarity.
+
+    Question embeddings live in a preallocated float32 matrix so a lookup is a single
+    matrix-vector product. Each answer keeps the corpus version it was generated from, and
+    only answers of the version given to `lookup` can match. When the matrix is full the
+    expired or oldest row is replaced.
+    """
+    def __init__(self, dim: int, capacity: int, ttl: float):
+        self.ttl = ttl
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.created_at = np.full(capacity, -np.inf)
+        self.answers: List[Optional[dict]] = [None] * capacity
+        self.versions = np.full(capacity, None, dtype=object)
+        self.size = 0
+
+    def lookup(self, vector: np.ndarray, threshold: float, corpus_version: Optional[str] = None) -> Optional[dict]:
+        if self.size == 0:
+            return None
+        scores = self.matrix[:self.size] @ vector
+        scores[self.created_at[:self.size] < time.monotonic() - self.ttl] = -np.inf
+        # Answers generated from an older corpus may cite removed or changed chunks; marking them
+        # expired also makes their rows the first to be replaced
+        stale = self.versions[:self.size] != corpus_version
+        scores[stale] = -np.inf
+        self.created_at[:self.size][stale] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return {**self.answers[best], "similarity": float(scores[best])}
+
+    def add(self, vector: np.ndarray, answer: str, doc_ids: List[str], corpus_version: Optional[str] = None):
+        if self.size < len(self.matrix):
+            row = self.size
+            self.size += 1
+        else:
+            row = int(np.argmin(self.created_at))
+        self.matrix[row] = vector
+        self.created_at[row] = time.monotonic()
+        self.answers[row] = {"answer": answer, "doc_ids": doc_ids}
+        self.versions[row] = corpus_version
+
+
+class SemanticCache:
+    """
+    Per-bot semantic answer cache for first-turn questions.
+
+    Disabled unless SEMANTIC_CACHE_ENABLED is set or the assistant configuration sets
+    `semantic_cache`. A question is answered from the cache when its cosine similarity to a
+    cached question reaches SEMANTIC_CACHE_THRESHOLD. Entries expire after SEMANTIC_CACHE_TTL
+    seconds, each bot keeps at most SEMANTIC_CACHE_SIZE entries, and at most
+    SEMANTIC_CACHE_MAX_BOTS bots are cached at once.
+
+    Ingestion usually runs in another process, so answers are tagged with the bot's corpus
+    version and only served while it is current. The version is read again at most every
+    SEMANTIC_CACHE_VERSION_TTL seconds per bot; `invalidate` drops the bot in this process at once.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.ttl = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        self.capacity = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+        self.max_bots = int(os.getenv("SEMANTIC_CACHE_MAX_BOTS", "1000"))
+        self.version_ttl = float(os.getenv("SEMANTIC_CACHE_VERSION_TTL", "30"))
+        self.version_reader: Optional[VersionReader] = load_corpus_version
+        self._bots: "OrderedDict[str, BotAnswerCache]" = OrderedDict()
+        # Bot -> (monotonic time the version was read, corpus version)
+        self._versions: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "stores": 0, "invalidations": 0, "version_reads": 0}
+
+    def is_enabled(self, assistant_data: dict) -> bool:
+        return bool(assistant_data.get("semantic_cache", self.enabled))
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _corpus_version(self, bot_token: str) -> Optional[str]:
+        with self._lock:
+            checked = self._versions.get(bot_token)
+        if checked is not None and time.monotonic() - checked[0] < self.version_ttl:
+            return checked[1]
+        if self.version_reader is None:
+            return None
+        try:
+            version = self.version_reader(bot_token)
+        except Exception as e:
+            # Keep the last known version and retry on the next lookup
+            logger.warning(f"Could not read the corpus version for Bot token: {bot_token} - {e}")
+            return checked[1] if checked is not None else None
+        with self._lock:
+            self._counters["version_reads"] += 1
+            self._versions[bot_token] = (time.monotonic(), version)
+            self._versions.move_to_end(bot_token)
+            while len(self._versions) > self.max_bots:
+                self._versions.popitem(last=False)
+        return version
+
+    def lookup(self, bot_token: str, embedding) -> Optional[dict]:
+        """
+        Returns {"answer", "doc_ids", "similarity"} for the closest cached question of the bot,
+        or None when nothing generated from the current corpus is similar enough.
+
+        May read the bot's corpus version from Mongo, so call it off the event loop.
+        """
+        vector = self._normalize(embedding)
+        # Read even when nothing is cached yet, so the answer stored after this miss is tagged
+        version = self._corpus_version(bot_token)
+        with self._lock:
+            self._counters["lookups"] += 1
+            cache = self._bots.get(bot_token)
+            if cache is None:
+                return None
+            self._bots.move_to_end(bot_token)
+            hit = cache.lookup(vector, self.threshold, version)
+            if hit is not None:
+                self._counters["hits"] += 1
+            return hit
+
+    def store(self, bot_token: str, embedding, answer: str, doc_ids: List[str]):
+        """
+        Caches an answer under the corpus version last read for the bot, normally by the lookup
+        that preceded its generation. Never reads Mongo.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            checked = self._versions.get(bot_token)
+            cache = self._bots.get(bot_token)
+            if cache is None:
+                cache = BotAnswerCache(len(vector), self.capacity, self.ttl)
+                self._bots[bot_token] = cache
+                while len(self._bots) > self.max_bots:
+                    self._bots.popitem(last=False)
+            self._bots.move_to_end(bot_token)
+            cache.add(vector, answer, doc_ids, checked[1] if checked is not None else None)
+            self._counters["stores"] += 1
+
+    def invalidate(self, bot_token: str):
+        """
+        Drops every cached answer of a bot in this process. Called by ingestion whenever the bot's
+        corpus changes; other processes stop serving the answers once they read the new version.
+        """
+        with self._lock:
+            self._versions.pop(bot_token, None)
+            if self._bots.pop(bot_token, None) is not None:
+                self._counters["invalidations"] += 1
+                logger.info(f"Invalidated semantic cache for Bot token: {bot_token}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["lookups"]
+            return {
+                **self._counters,
+                "bots": len(self._bots),
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+semantic_cache = SemanticCache()
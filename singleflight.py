@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from embedding_service import normalize_text
+from logger import logger
+from timings import stage
+
+load_dotenv()
+
+
+def answer_key(bot_token: str, question: str, chat_history) -> Tuple[str, str, bool]:
+    """
+    Identifies an answer by the bot, the normalized question and whether the session has history.
+    """
+    return bot_token, normalize_text(question).casefold(), not chat_history
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into one execution.
+
+    The first call for a key runs the function in its own task; calls with the same key that
+    arrive while it runs await that task instead of starting another, and a successful result
+    keeps serving new calls for SINGLEFLIGHT_WINDOW seconds after it completes (0 shares only
+    in-flight work). Failures are never shared beyond the calls already waiting. The execution is
+    shielded, so a caller that disconnects does not cancel it for the others.
+
+    Answers for sessions that already have history depend on that history, so `answer_key`s with
+    history are only coalesced when SINGLEFLIGHT_WITH_HISTORY is true.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+        self.window = float(os.getenv("SINGLEFLIGHT_WINDOW", "2"))
+        self.with_history = os.getenv("SINGLEFLIGHT_WITH_HISTORY", "false").lower() == "true"
+        self.max_recent = int(os.getenv("SINGLEFLIGHT_MAX_RECENT", "1024"))
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._recent: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._counters = {"executions": 0, "coalesced": 0, "window_hits": 0, "failures": 0, "bypassed": 0}
+
+    def _should_coalesce(self, key: Optional[Hashable]) -> bool:
+        if not self.enabled or key is None:
+            return False
+        # answer_key's last element is the empty-history flag
+        if isinstance(key, tuple) and key and key[-1] is False and not self.with_history:
+            return False
+        return True
+
+    def _sweep(self):
+        now = time.monotonic()
+        while self._recent:
+            key, (completed_at, _) = next(iter(self._recent.items()))
+            if now - completed_at <= self.window:
+                break
+            del self._recent[key]
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            self._counters["failures"] += 1
+            return
+        if self.window > 0:
+            self._recent[key] = (time.monotonic(), task.result())
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+
+    async def do(self, key: Optional[Hashable], function: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Runs `function`, or shares the result of an identical call that is running or just finished.
+
+        Args:
+            key (Hashable): Identifies identical calls, such as an `answer_key`; None runs `function` directly.
+            function (Callable): Coroutine function producing the result.
+
+        Returns:
+            Tuple[Any, bool]: The result, and whether it came from another caller's execution.
+                Shared results are the same object for every caller and must not be mutated.
+        """
+        if not self._should_coalesce(key):
+            self._counters["bypassed"] += 1
+            return await function(), False
+
+        self._sweep()
+        recent = self._recent.get(key)
+        if recent is not None:
+            self._counters["window_hits"] += 1
+            return recent[1], True
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._counters["coalesced"] += 1
+            with stage("coalesced_wait"):
+                return await asyncio.shield(task), True
+
+        self._counters["executions"] += 1
+        task = asyncio.ensure_future(function())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._on_done(key, done))
+        try:
+            return await asyncio.shield(task), False
+        except asyncio.CancelledError:
+            if not task.done():
+                logger.info("Coalesced request cancelled; its execution continues for the other callers.")
+            raise
+
+    def stats(self) -> dict:
+        served = self._counters["executions"] + self._counters["coalesced"] + self._counters["window_hits"]
+        shared = self._counters["coalesced"] + self._counters["window_hits"]
+        return {
+            **self._counters,
+            "in_flight": len(self._in_flight),
+            "recent": len(self._recent),
+            "coalesced_rate": round(shared / served, 4) if served else 0.0,
+        }
+
+
+answer_flight = SingleFlight()
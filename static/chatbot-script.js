@@ -2,6 +2,7 @@ class Chatbot {
   constructor(options = {}) {
     this.botId = options.botId || "default";
     this.apiEndpoint = options.apiEndpoint || "https://api.aispirelabs.com";
+    this.streaming = options.streaming !== false;
     this.backendEndpoint = "https://sara-admin.aispirelabs.com/api";
     this.sessionDuration = 3600000; // 1 hour in milliseconds
     this.defaultStyles = {
@@ -252,20 +253,26 @@ class Chatbot {
 
     try {
       this.showTypingIndicator();
+      const payload = {
+        question: message,
+        bot_token: this.botId,
+        session_id: this.sessionId,
+      };
+      if (this.streaming && (await this.streamAnswer(payload))) {
+        return;
+      }
       const response = await fetch(`${this.apiEndpoint}/chat`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          question: message,
-          bot_token: this.botId,
-          session_id: this.sessionId,
-        }),
+        body: JSON.stringify(payload),
       });
       const data = await response.json();
       this.hideTypingIndicator();
       this.addMessage(data.answer, true);
-      if (data.questions) {
+      if (data.questions && data.questions.length) {
         this.showSuggestions(data.questions);
+      } else if (data.follow_up_id) {
+        this.fetchFollowUps(data.follow_up_id);
       }
     } catch (error) {
       console.error("Error:", error);
@@ -277,6 +284,99 @@ class Chatbot {
     }
   }
 
+  // Renders the answer progressively from the /chat/stream Server-Sent Events.
+  // Returns false when streaming is unavailable so the caller can fall back to /chat.
+  async streamAnswer(payload) {
+    const response = await fetch(`${this.apiEndpoint}/chat/stream`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload),
+    });
+    const contentType = response.headers.get("content-type") || "";
+    if (!response.ok || !response.body || !contentType.includes("text/event-stream")) {
+      return false;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let answer = "";
+    let messageDiv = null;
+
+    const render = (text) => {
+      if (!messageDiv) {
+        this.hideTypingIndicator();
+        messageDiv = this.addMessage(text, true);
+      } else {
+        this.updateMessage(messageDiv, text);
+      }
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        let data = "";
+        for (const line of frame.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        }
+        if (!data) continue;
+        const parsed = JSON.parse(data);
+
+        if (event === "token") {
+          answer += parsed.token;
+          render(answer);
+        } else if (event === "done") {
+          render(parsed.answer || answer);
+          if (parsed.questions) {
+            this.showSuggestions(parsed.questions);
+          }
+        } else if (event === "follow_ups") {
+          this.showSuggestions(parsed.questions);
+        } else if (event === "error") {
+          render(parsed.message);
+        }
+      }
+    }
+
+    if (!messageDiv) {
+      this.hideTypingIndicator();
+      this.addMessage("Could you Please rephrase the question with more context?", true);
+    }
+    return true;
+  }
+
+  // Follow-up questions are generated after the answer; wait for them in the background.
+  async fetchFollowUps(followUpId) {
+    try {
+      const response = await fetch(
+        `${this.apiEndpoint}/chat/follow-ups/${followUpId}?wait=10`
+      );
+      const data = await response.json();
+      if (data.status === "ready") {
+        this.showSuggestions(data.questions);
+      }
+    } catch (error) {
+      console.error("Error fetching follow-up questions:", error);
+    }
+  }
+
+  updateMessage(messageDiv, text) {
+    const content = messageDiv.querySelector(".cb-message-content");
+    content.innerHTML = `
+          ${this.formatMarkdown(text)}
+          <span class="cb-timestamp">${this.getTimestamp()}</span>
+        `;
+  }
+
   addMessage(text, isBot) {
     const messages = document.querySelector(".cb-messages");
     const messageDiv = document.createElement("div");
@@ -309,6 +409,7 @@ class Chatbot {
       // For user messages, scroll to the bottom as usual
       messages.scrollTop = messages.scrollHeight;
     }
+    return messageDiv;
   }
 
   showSuggestions(questions) {
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules read their settings and create lazily connecting Mongo clients at import time
+os.environ.setdefault("MONGO_DB_URI", "mongodb://localhost:27017")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
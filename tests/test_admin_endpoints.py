@@ -0,0 +1,42 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from benchmarks.fakes import InMemoryCollection
+
+
+def request(method, path, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, headers=headers)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("method, path", [("GET", "/stats"), ("GET", "/metrics"), ("DELETE", "/assistant-cache/"), ("DELETE", "/assistant-cache/bot")])
+def test_admin_endpoints_are_closed_without_a_configured_token(monkeypatch, method, path):
+    monkeypatch.delenv("ADMIN_API_TOKEN", raising=False)
+
+    assert request(method, path).status_code == 403
+    assert request(method, path, {"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_endpoints_require_the_configured_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret")
+
+    assert request("GET", "/stats").status_code == 401
+    assert request("GET", "/stats", {"X-Admin-Token": "wrong"}).status_code == 401
+    assert request("GET", "/stats", {"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_invalidation_is_recorded_for_the_other_workers(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret")
+    invalidations = InMemoryCollection()
+    monkeypatch.setattr(main.assistant_cache, "invalidations", invalidations)
+
+    response = request("DELETE", "/assistant-cache/bot", {"X-Admin-Token": "secret"})
+
+    assert response.json() == {"invalidated": 0}
+    assert [doc["bot_token"] for doc in invalidations.documents] == ["bot"]
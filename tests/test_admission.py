@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setenv("ADMISSION_PER_BOT_LIMIT", "1")
+    monkeypatch.setenv("ADMISSION_GLOBAL_LIMIT", "2")
+    monkeypatch.setenv("ADMISSION_INITIAL_SERVICE_TIME", "0.05")
+
+
+def test_waiters_are_granted_released_slots_in_order(limits):
+    controller = AdmissionController()
+
+    async def run():
+        ticket = await controller.acquire("a")
+        first = asyncio.ensure_future(controller.acquire("a"))
+        second = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 2
+        ticket.release()
+        ticket.release()
+        (await first).release()
+        (await second).release()
+
+    asyncio.run(run())
+    assert controller.stats()["admitted"] == 3
+    assert controller.stats()["active"] == 0
+
+
+def test_other_bots_are_admitted_while_one_is_at_its_limit(limits):
+    controller = AdmissionController()
+
+    async def run():
+        await controller.acquire("a")
+        return await asyncio.wait_for(controller.acquire("b"), 0.01)
+
+    assert asyncio.run(run()).bot_token == "b"
+
+
+def test_full_queues_are_rejected_with_429_per_bot_and_503_globally(limits, monkeypatch):
+    monkeypatch.setenv("ADMISSION_PER_BOT_QUEUE_SIZE", "0")
+    controller = AdmissionController()
+
+    async def run():
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as per_bot:
+            await controller.acquire("a")
+        await controller.acquire("b")
+        with pytest.raises(AdmissionRejected) as global_limit:
+            await controller.acquire("c")
+        return per_bot.value, global_limit.value
+
+    per_bot, global_limit = asyncio.run(run())
+    assert (per_bot.status_code, per_bot.reason) == (429, "queue_full")
+    assert (global_limit.status_code, global_limit.reason) == (503, "queue_full")
+    assert per_bot.retry_after >= 1
+
+
+def test_requests_that_cannot_finish_in_time_are_shed_on_arrival(limits, monkeypatch):
+    monkeypatch.setenv("ADMISSION_INITIAL_SERVICE_TIME", "2")
+    controller = AdmissionController()
+
+    async def run():
+        await controller.acquire("a")
+        await controller.acquire("a", deadline=1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(run())
+    assert rejected.value.reason == "deadline"
+    assert controller.stats()["queue_depth"] == 0
+
+
+def test_queued_requests_expire_at_their_deadline(limits):
+    controller = AdmissionController()
+
+    async def run():
+        await controller.acquire("a")
+        await controller.acquire("a", deadline=0.15)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(run())
+    assert rejected.value.reason == "expired"
+    assert controller.stats()["queue_depth"] == 0
+
+
+def test_cancelled_waiters_leave_the_queue(limits):
+    controller = AdmissionController()
+
+    async def run():
+        ticket = await controller.acquire("a")
+        waiter = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["queue_depth"] == 0
+        ticket.release()
+
+    asyncio.run(run())
+    assert controller.stats()["active"] == 0
+
+
+def test_slot_releases_on_exit(limits):
+    controller = AdmissionController()
+
+    async def run():
+        async with controller.slot("a"):
+            assert controller.stats()["active"] == 1
+
+    asyncio.run(run())
+    assert controller.stats()["active"] == 0
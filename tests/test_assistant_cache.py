@@ -0,0 +1,189 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+
+from assistant_cache import AssistantCache
+from benchmarks.fakes import InMemoryCollection
+
+
+class Backend:
+    """
+    The admin backend's assistant details endpoint, answering from `assistants`.
+    """
+    def __init__(self, delay=0.0):
+        self.assistants = {"bot": {"status": "ACTIVE", "prompts": {"QUESTION_ANSWER_PROMPT": "v1"}}}
+        self.delay = delay
+        self.down = False
+        self.requests = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if self.down:
+            raise httpx.ConnectError("backend unavailable", request=request)
+        bot_token = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+        if bot_token not in self.assistants:
+            return httpx.Response(404, json={"detail": "Not found"})
+        return httpx.Response(200, json=self.assistants[bot_token])
+
+
+@pytest.fixture(autouse=True)
+def backend_endpoint(monkeypatch):
+    monkeypatch.setenv("BACKEND_ENDPOINT", "https://backend.test")
+
+
+def run_with_cache(backend, scenario, invalidations=None):
+    async def run():
+        cache = AssistantCache(invalidations)
+        cache._client = httpx.AsyncClient(transport=httpx.MockTransport(backend.handle))
+        try:
+            return await scenario(cache)
+        finally:
+            await asyncio.gather(*cache._refresh_tasks)
+            await cache.close()
+    return asyncio.run(run())
+
+
+def test_fresh_entries_are_served_from_the_cache():
+    backend = Backend()
+
+    async def scenario(cache):
+        first = await cache.get("bot")
+        second = await cache.get("bot")
+        return first, second, cache.stats()
+
+    first, second, stats = run_with_cache(backend, scenario)
+    assert first == second == {"status": 200, "data": backend.assistants["bot"]}
+    assert backend.requests == 1
+    assert (stats["misses"], stats["hits"]) == (1, 1)
+
+
+def test_stale_entries_are_served_while_refreshing_in_the_background(monkeypatch):
+    monkeypatch.setenv("ASSISTANT_CACHE_TTL", "0")
+    monkeypatch.setenv("ASSISTANT_CACHE_STALE_TTL", "60")
+    backend = Backend()
+
+    async def scenario(cache):
+        await cache.get("bot")
+        backend.assistants["bot"] = {"status": "ACTIVE", "prompts": {"QUESTION_ANSWER_PROMPT": "v2"}}
+        stale = await cache.get("bot")
+        await asyncio.gather(*cache._refresh_tasks)
+        return stale, cache.peek("bot"), cache.stats()
+
+    stale, refreshed, stats = run_with_cache(backend, scenario)
+    assert stale["data"]["prompts"]["QUESTION_ANSWER_PROMPT"] == "v1"
+    assert refreshed["data"]["prompts"]["QUESTION_ANSWER_PROMPT"] == "v2"
+    assert (stats["stale_hits"], stats["refreshes"]) == (1, 1)
+
+
+@pytest.mark.parametrize("assistant", [None, {"status": "INACTIVE"}])
+def test_unknown_and_inactive_assistants_are_negatively_cached(assistant, monkeypatch):
+    backend = Backend()
+    if assistant is not None:
+        backend.assistants["bot"] = assistant
+    else:
+        backend.assistants.clear()
+
+    async def scenario(cache):
+        return [await cache.get("bot") for _ in range(2)], cache.stats()
+
+    responses, stats = run_with_cache(backend, scenario)
+    assert responses[0] == responses[1]
+    assert backend.requests == 1
+    assert stats["negative_hits"] == 1
+
+    monkeypatch.setenv("ASSISTANT_CACHE_NEGATIVE_TTL", "0")
+    run_with_cache(backend, scenario)
+    assert backend.requests == 3
+
+
+def test_concurrent_misses_share_one_request():
+    backend = Backend(delay=0.05)
+
+    async def scenario(cache):
+        return await asyncio.gather(*(cache.get("bot") for _ in range(5)))
+
+    responses = run_with_cache(backend, scenario)
+    assert backend.requests == 1
+    assert all(response == responses[0] for response in responses)
+
+
+def test_backend_failures_serve_the_stale_entry_or_503(monkeypatch):
+    monkeypatch.setenv("ASSISTANT_CACHE_TTL", "0")
+    backend = Backend()
+
+    async def scenario(cache):
+        await cache.get("bot")
+        backend.down = True
+        stale = await cache.get("bot")
+        await asyncio.gather(*cache._refresh_tasks)
+        return stale, await cache.get("other-bot"), cache.stats()
+
+    stale, missing, stats = run_with_cache(backend, scenario)
+    assert stale["status"] == 200
+    assert missing["status"] == 503
+    assert stats["errors"] == 2
+
+
+def test_least_recently_used_bots_are_evicted(monkeypatch):
+    monkeypatch.setenv("ASSISTANT_CACHE_SIZE", "2")
+    backend = Backend()
+    backend.assistants.update({"a": {"status": "ACTIVE"}, "b": {"status": "ACTIVE"}, "c": {"status": "ACTIVE"}})
+
+    async def scenario(cache):
+        for bot_token in ["a", "b", "a", "c"]:
+            await cache.get(bot_token)
+        return cache.peek("a"), cache.peek("b"), cache.stats()
+
+    a, b, stats = run_with_cache(backend, scenario)
+    assert a is not None and b is None
+    assert stats["evictions"] == 1
+
+
+def test_invalidations_run_listeners_and_reach_other_workers():
+    backend = Backend()
+    invalidations = InMemoryCollection()
+    notified = []
+
+    async def scenario(cache):
+        other = AssistantCache(invalidations)
+        other._client = cache._client
+        other.on_invalidate(lambda bot_token, cached: notified.append((bot_token, cached["status"])))
+        await cache.get("bot")
+        await other.get("bot")
+        # What start() records before the first sync
+        cache._synced_at = other._synced_at = datetime.utcnow()
+
+        assert await cache.broadcast_invalidation("bot") == 1
+        assert cache.peek("bot") is None
+        assert other.peek("bot") is not None
+        await other.sync()
+        synced = other.peek("bot")
+
+        # A worker does not apply its own invalidations a second time
+        await cache.get("bot")
+        await cache.sync()
+        return synced, cache.peek("bot"), other.stats()
+
+    synced, own, stats = run_with_cache(backend, scenario, invalidations)
+    assert synced is None
+    assert own is not None
+    assert notified == [("bot", 200)]
+    assert stats["synced_invalidations"] == 1
+
+
+def test_sync_loop_applies_invalidations_in_the_background(monkeypatch):
+    monkeypatch.setenv("ASSISTANT_CACHE_SYNC_INTERVAL", "0.01")
+    backend = Backend()
+    invalidations = InMemoryCollection()
+
+    async def scenario(cache):
+        cache.start()
+        await cache.get("bot")
+        await AssistantCache(invalidations).broadcast_invalidation()
+        await asyncio.sleep(0.1)
+        return cache.peek("bot")
+
+    assert run_with_cache(backend, scenario, invalidations) is None
@@ -0,0 +1,106 @@
+from langchain_core.documents.base import Document
+
+from bm25_index import BM25Index, BM25IndexRegistry, tokenize
+
+
+def docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+
+def test_tokenize_lowercases_and_splits_on_punctuation():
+    assert tokenize("Refund-policy: 30 DAYS!") == ["refund", "policy", "30", "days"]
+
+
+def test_search_ranks_matching_documents_and_skips_the_rest():
+    index = BM25Index()
+    index.add_documents(docs("refund policy for orders", "shipping times", "refund refund refund"))
+
+    results = [doc.page_content for doc in index.search("refund", k=5)]
+
+    assert results == ["refund refund refund", "refund policy for orders"]
+
+
+def test_documents_added_after_a_search_are_found():
+    index = BM25Index()
+    index.add_documents(docs("refund policy"))
+    assert len(index.search("warranty")) == 0
+
+    index.add_documents(docs("warranty terms"))
+
+    assert [doc.page_content for doc in index.search("warranty")] == ["warranty terms"]
+    assert len(index) == 2
+
+
+def test_registry_builds_once_and_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setenv("BM25_INDEX_MEMORY_BUDGET_MB", "0")
+    registry = BM25IndexRegistry()
+    loads = []
+
+    def loader(bot_token):
+        loads.append(bot_token)
+        return docs(f"{bot_token} content")
+
+    first = registry.get("bot-a", loader)
+    assert registry.get("bot-a", loader) is first
+    registry.get("bot-b", loader)
+
+    assert loads == ["bot-a", "bot-b"]
+    assert registry.stats()["bots"] == 1
+    assert registry.stats()["evictions"] == 1
+    registry.get("bot-a", loader)
+    assert loads == ["bot-a", "bot-b", "bot-a"]
+
+
+def test_registry_rebuilds_when_the_corpus_version_changes_elsewhere(monkeypatch):
+    monkeypatch.setenv("BM25_INDEX_TTL", "0")
+    registry = BM25IndexRegistry()
+    corpus = {"version": "v1", "texts": ["refund policy"]}
+
+    def loader(bot_token):
+        return docs(*corpus["texts"])
+
+    def version_reader(bot_token):
+        return corpus["version"]
+
+    first = registry.get("bot", loader, version_reader)
+    # Another process ingests new chunks and bumps the version
+    corpus["texts"] = ["warranty terms"]
+    assert registry.get("bot", loader, version_reader) is first
+    assert registry.stats()["revalidations"] == 1
+
+    corpus["version"] = "v2"
+    rebuilt = registry.get("bot", loader, version_reader)
+
+    assert rebuilt is not first
+    assert rebuilt.corpus_version == "v2"
+    assert [doc.page_content for doc in rebuilt.search("warranty")] == ["warranty terms"]
+    assert rebuilt.search("refund") == []
+    assert registry.stats()["builds"] == 2
+
+
+def test_registry_skips_the_version_read_within_the_ttl(monkeypatch):
+    monkeypatch.setenv("BM25_INDEX_TTL", "60")
+    registry = BM25IndexRegistry()
+    reads = []
+
+    def version_reader(bot_token):
+        reads.append(bot_token)
+        return "v1"
+
+    first = registry.get("bot", lambda bot_token: docs("refund policy"), version_reader)
+    assert registry.get("bot", lambda bot_token: docs("refund policy"), version_reader) is first
+    assert reads == ["bot"]
+
+
+def test_registry_keeps_the_index_when_the_version_cannot_be_read(monkeypatch):
+    monkeypatch.setenv("BM25_INDEX_TTL", "0")
+    registry = BM25IndexRegistry()
+    versions = ["v1"]
+
+    def version_reader(bot_token):
+        if not versions:
+            raise ConnectionError("mongo unavailable")
+        return versions.pop()
+
+    first = registry.get("bot", lambda bot_token: docs("refund policy"), version_reader)
+    assert registry.get("bot", lambda bot_token: docs("other"), version_reader) is first
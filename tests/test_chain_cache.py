@@ -0,0 +1,97 @@
+from chain_cache import ChainCache, model_config_key, prompts_key
+
+
+class Model:
+    def __init__(self, **params):
+        self._identifying_params = params
+
+
+class Builder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, llm_model, prompts):
+        self.calls += 1
+        return ("chain", self.calls)
+
+
+def test_prompts_key_ignores_dict_order():
+    assert prompts_key({"a": "1", "b": "2"}) == prompts_key({"b": "2", "a": "1"})
+    assert prompts_key({"a": "1"}) != prompts_key({"a": "2"})
+    assert prompts_key(None) == prompts_key({})
+
+
+def test_model_key_follows_the_configuration():
+    assert model_config_key(Model(model="m", temperature=0)) == model_config_key(Model(temperature=0, model="m"))
+    assert model_config_key(Model(model="m", temperature=0)) != model_config_key(Model(model="m", temperature=1))
+
+
+def test_model_without_parameters_is_keyed_by_identity():
+    first, second = Model(), Model()
+
+    assert model_config_key(first) == model_config_key(first)
+    assert model_config_key(first) != model_config_key(second)
+
+
+def test_equal_prompts_and_model_reuse_the_chain():
+    cache, builder = ChainCache(), Builder()
+
+    first = cache.get("rag", Model(model="m"), {"SYSTEM": "Be brief."}, builder)
+    second = cache.get("rag", Model(model="m"), {"SYSTEM": "Be brief."}, builder)
+
+    assert first is second
+    assert builder.calls == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_kind_prompts_and_model_each_get_their_own_chain():
+    cache, builder = ChainCache(), Builder()
+    model = Model(model="m")
+
+    cache.get("rag", model, {"SYSTEM": "Be brief."}, builder)
+    cache.get("follow_up", model, {"SYSTEM": "Be brief."}, builder)
+    cache.get("rag", model, {"SYSTEM": "Be thorough."}, builder)
+    cache.get("rag", Model(model="other"), {"SYSTEM": "Be brief."}, builder)
+
+    assert builder.calls == 4
+    assert cache.stats()["chains"] == 4
+
+
+def test_least_recently_used_chain_is_evicted(monkeypatch):
+    monkeypatch.setenv("CHAIN_CACHE_SIZE", "2")
+    cache, builder = ChainCache(), Builder()
+    model = Model(model="m")
+
+    cache.get("a", model, {}, builder)
+    cache.get("b", model, {}, builder)
+    cache.get("a", model, {}, builder)
+    cache.get("c", model, {}, builder)
+    cache.get("a", model, {}, builder)
+    cache.get("b", model, {}, builder)
+
+    assert builder.calls == 4
+    assert cache.stats()["evictions"] == 2
+
+
+def test_invalidate_drops_only_the_chains_of_those_prompts():
+    cache, builder = ChainCache(), Builder()
+    model = Model(model="m")
+    old, other = {"SYSTEM": "old"}, {"SYSTEM": "other"}
+    cache.get("rag", model, old, builder)
+    cache.get("follow_up", model, old, builder)
+    cache.get("rag", model, other, builder)
+
+    assert cache.invalidate(old) == 2
+    cache.get("rag", model, other, builder)
+    assert builder.calls == 3
+    cache.get("rag", model, old, builder)
+    assert builder.calls == 4
+
+
+def test_invalidate_without_prompts_drops_every_chain():
+    cache, builder = ChainCache(), Builder()
+    cache.get("rag", Model(model="m"), {"SYSTEM": "a"}, builder)
+    cache.get("rag", Model(model="m"), {"SYSTEM": "b"}, builder)
+
+    assert cache.invalidate() == 2
+    assert cache.stats()["chains"] == 0
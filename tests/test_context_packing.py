@@ -0,0 +1,73 @@
+from langchain_core.documents.base import Document
+
+from context_packing import ContextPacker
+
+TEXT = " ".join(f"word{i}" for i in range(60))
+
+
+def doc(text, source="a.html", **metadata):
+    return Document(page_content=text, metadata={"source": source, **metadata})
+
+
+def test_duplicate_chunks_are_kept_once():
+    packer = ContextPacker()
+    context = packer.pack([doc("Opening hours are 9 to 5."), doc(" Opening  hours are 9 to 5.\n", source="b.html")], headers=False)
+
+    assert context == "Opening hours are 9 to 5."
+    assert packer.stats()["duplicates"] == 1
+
+
+def test_overlapping_chunks_of_a_source_are_merged():
+    packer = ContextPacker()
+    left, right = TEXT[:200], TEXT[150:]
+    context = packer.pack([doc(right), doc(left)], headers=False)
+
+    assert context == TEXT
+    assert packer.stats()["merged"] == 1
+
+
+def test_chunks_of_different_sources_are_not_merged():
+    packer = ContextPacker()
+    left, right = TEXT[:200], TEXT[150:]
+
+    assert packer.pack([doc(left), doc(right, source="b.html")], headers=False) == f"{left}\n\n{right}"
+
+
+def test_headers_are_written_once_per_source():
+    packer = ContextPacker()
+    context = packer.pack([
+        doc("First passage.", title="Pricing", summary="Plans"),
+        doc("Other source.", source="b.html", title="Support"),
+        doc("Second passage.", title="Pricing", summary="Plans"),
+    ])
+
+    assert context == (
+        "Title: Pricing\nSummary: Plans\nContent: First passage.\n\nSecond passage."
+        "\n\nTitle: Support\nContent: Other source."
+    )
+
+
+def test_passages_over_budget_are_skipped_for_smaller_ones():
+    packer = ContextPacker()
+    docs = [doc("a" * 40, source="1"), doc("b" * 400, source="2"), doc("c" * 40, source="3")]
+
+    assert packer.pack(docs, budget=30, headers=False) == f"{'a' * 40}\n\n{'c' * 40}"
+    assert packer.stats()["dropped"] == 1
+
+
+def test_only_a_lone_first_passage_is_truncated():
+    packer = ContextPacker()
+    context = packer.pack([doc("x" * 400), doc("y" * 400, source="b.html")], budget=20, headers=False)
+
+    assert context == "x" * 76
+    assert packer.stats()["truncated"] == 1
+
+
+def test_budget_for_prefers_the_assistant_setting(monkeypatch):
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "500")
+    packer = ContextPacker()
+
+    assert packer.budget_for({"context_token_budget": 80}) == 80
+    assert packer.budget_for(None) == 500
+    assert packer.budget_for({"context_token_budget": None}) == 500
+    assert packer.pack([]) == ""
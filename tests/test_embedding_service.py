@@ -0,0 +1,115 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from embedding_service import EmbeddingService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BATCH_SIZE", "4")
+    monkeypatch.setenv("EMBEDDING_MAX_WAIT_MS", "20")
+    monkeypatch.setenv("EMBEDDING_CACHE_SIZE", "2")
+    service = EmbeddingService()
+    service.calls = []
+
+    def encode(texts):
+        service.calls.append(list(texts))
+        return np.array([[float(len(text)), 1.0] for text in texts])
+
+    monkeypatch.setattr(service, "_encode", encode)
+    return service
+
+
+def test_concurrent_queries_share_one_batch(service):
+    async def scenario():
+        vectors = await asyncio.gather(*(service.aembed_query(text) for text in ["a", "bb", "ccc"]))
+        await service.stop()
+        return vectors
+
+    vectors = asyncio.run(scenario())
+
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    assert service.calls == [["a", "bb", "ccc"]]
+    assert service.stats()["batches"] == 1
+    assert service.stats()["avg_batch_size"] == 3
+
+
+def test_batches_are_capped_at_the_batch_size(service):
+    async def scenario():
+        await asyncio.gather(*(service.aembed_query("x" * size) for size in range(1, 7)))
+        await service.stop()
+
+    asyncio.run(scenario())
+
+    assert [len(call) for call in service.calls] == [4, 2]
+
+
+def test_same_question_is_coalesced_and_then_cached(service):
+    async def scenario():
+        await asyncio.gather(service.aembed_query("What is  RAG?"), service.aembed_query("what is rag?"))
+        await service.aembed_query("WHAT IS RAG?")
+        await service.stop()
+
+    asyncio.run(scenario())
+
+    assert service.calls == [["What is RAG?"]]
+    assert service.stats()["coalesced"] == 1
+    assert service.stats()["cache_hits"] == 1
+
+
+def test_cache_evicts_the_least_recently_used_entry(service):
+    async def scenario():
+        await service.aembed_query("one")
+        await service.aembed_query("two")
+        await service.aembed_query("one")
+        await service.aembed_query("three")
+        await service.aembed_query("one")
+        await service.aembed_query("two")
+        await service.stop()
+
+    asyncio.run(scenario())
+
+    assert service.calls == [["one"], ["two"], ["three"], ["two"]]
+    assert service.stats()["cache_size"] == 2
+
+
+def test_failed_batch_reaches_every_caller(service, monkeypatch):
+    def fail(texts):
+        raise ValueError("model unavailable")
+
+    monkeypatch.setattr(service, "_encode", fail)
+
+    async def scenario():
+        results = await asyncio.gather(service.aembed_query("a"), service.aembed_query("b"), return_exceptions=True)
+        await service.stop()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert service._pending == {}
+
+
+def test_service_restarts_after_stop(service):
+    async def run_once(text):
+        vector = await service.aembed_query(text)
+        await service.stop()
+        return vector
+
+    assert asyncio.run(run_once("a")) == [1.0, 1.0]
+    assert service._executor is None
+    assert asyncio.run(run_once("bb")) == [2.0, 1.0]
+
+
+def test_embed_query_refuses_to_block_the_event_loop(service):
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            service.embed_query("a")
+        vector = await asyncio.to_thread(service.embed_query, "bb")
+        await service.stop()
+        return vector
+
+    assert asyncio.run(scenario()) == [2.0, 1.0]
+    assert service.embed_query("ccc") == [3.0, 1.0]
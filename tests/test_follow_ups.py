@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import follow_ups
+from benchmarks.fakes import InMemoryCollection
+from follow_ups import FollowUpManager
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """
+    Replaces the model call with one that waits on `release` and then answers from `responses`.
+    """
+    state = {"calls": 0, "responses": [], "release": None}
+
+    async def generate(chat_history, question, docs, llm_model, prompts):
+        state["calls"] += 1
+        await state["release"].wait()
+        response = state["responses"].pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(follow_ups, "generate_follow_up_questions", generate)
+    return state
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(generations, responses, scenario):
+    async def main():
+        generations["release"] = asyncio.Event()
+        generations["responses"] = list(responses)
+        return await scenario()
+    return asyncio.run(main())
+
+
+def test_job_is_pending_until_the_questions_are_ready(generations):
+    results = InMemoryCollection()
+    manager = FollowUpManager(results)
+
+    async def scenario():
+        follow_up_id = manager.schedule("bot", "What is RAG?", [], [], None, {})
+        await settle()
+        pending = await manager.get(follow_up_id)
+        stored_pending = await results.find_one({"_id": follow_up_id})
+        generations["release"].set()
+        ready = await manager.get(follow_up_id, wait=1)
+        await settle()
+        return pending, stored_pending, ready, await results.find_one({"_id": follow_up_id})
+
+    pending, stored_pending, ready, stored = run(generations, [{"questions": ["Why?"]}], scenario)
+
+    assert pending == {"status": "pending", "questions": []}
+    assert stored_pending["status"] == "pending"
+    assert ready == {"status": "ready", "questions": ["Why?"]}
+    assert (stored["status"], stored["questions"]) == ("ready", ["Why?"])
+    assert manager.cached("bot", "what is  RAG?", []) == ["Why?"]
+
+
+@pytest.mark.parametrize("response", [RuntimeError("model unavailable"), None, {"questions": "not a list"}])
+def test_failed_generation_is_reported_and_not_cached(generations, response):
+    results = InMemoryCollection()
+    manager = FollowUpManager(results)
+
+    async def scenario():
+        follow_up_id = manager.schedule("bot", "What is RAG?", [], [], None, {})
+        generations["release"].set()
+        result = await manager.get(follow_up_id, wait=1)
+        await settle()
+        return result, await results.find_one({"_id": follow_up_id})
+
+    result, stored = run(generations, [response], scenario)
+
+    assert result == {"status": "failed", "questions": []}
+    assert stored["status"] == "failed"
+    assert manager.cached("bot", "What is RAG?", []) is None
+    assert manager.stats()["failed"] == 1
+
+
+def test_question_is_generated_again_after_a_failure(generations):
+    manager = FollowUpManager()
+
+    async def scenario():
+        generations["release"].set()
+        first = manager.schedule("bot", "What is RAG?", [], [], None, {})
+        failed = await manager.get(first, wait=1)
+        second = manager.schedule("bot", "What is RAG?", [], [], None, {})
+        return failed, await manager.get(second, wait=1)
+
+    failed, ready = run(generations, [RuntimeError("model unavailable"), {"questions": ["Why?"]}], scenario)
+
+    assert failed["status"] == "failed"
+    assert ready == {"status": "ready", "questions": ["Why?"]}
+    assert generations["calls"] == 2
+
+
+def test_concurrent_first_turns_share_one_generation(generations):
+    manager = FollowUpManager()
+
+    async def scenario():
+        first = manager.schedule("bot", "What is RAG?", [], [], None, {})
+        second = manager.schedule("bot", "what is rag?", [], [], None, {})
+        generations["release"].set()
+        return await manager.get(first, wait=1), await manager.get(second, wait=1)
+
+    first, second = run(generations, [{"questions": ["Why?"]}], scenario)
+
+    assert first == second == {"status": "ready", "questions": ["Why?"]}
+    assert generations["calls"] == 1
+    assert manager.stats()["shared"] == 1
+
+
+def test_stored_status_is_read_for_jobs_on_other_workers():
+    results = InMemoryCollection([{"_id": "elsewhere", "status": "failed", "questions": []}])
+    manager = FollowUpManager(results)
+
+    assert asyncio.run(manager.get("elsewhere")) == {"status": "failed", "questions": []}
+    assert asyncio.run(manager.get("missing")) == {"status": "unknown", "questions": []}
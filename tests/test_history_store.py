@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+import history_summary
+from benchmarks.fakes import InMemoryCollection
+from history_store import SessionHistoryStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv("HISTORY_WRITE_BEHIND", "false")
+    monkeypatch.setenv("HISTORY_MAX_TURNS", "10")
+    return SessionHistoryStore(InMemoryCollection())
+
+
+def append_turns(store, count, start=0, session_id="s1"):
+    async def run():
+        for turn in range(start, start + count):
+            await store.append(session_id, "bot", f"q{turn}", f"a{turn}")
+    asyncio.run(run())
+
+
+def test_turns_are_capped_at_max_turns(store):
+    append_turns(store, 12)
+    turns = asyncio.run(store.get_turns("s1"))
+
+    assert turns == [(f"q{turn}", f"a{turn}") for turn in range(2, 12)]
+    assert turns.summary == ""
+
+
+def test_fold_replaces_turns_with_the_summary(store):
+    append_turns(store, 5)
+
+    async def run():
+        await store.get_turns("s1")
+        session, _ = await store.load("s1")
+        applied = await store.fold("s1", "The user greeted the bot.", session['chat_history'][:3], session.get('summary_version'))
+        return applied, await store.get_turns("s1")
+
+    applied, turns = asyncio.run(run())
+    assert applied
+    assert turns == [("q3", "a3"), ("q4", "a4")]
+    assert turns.summary == "The user greeted the bot."
+    assert store.stats()["folds"] == 1
+
+
+def test_fold_from_a_stale_version_is_dropped(store):
+    append_turns(store, 5)
+
+    async def run():
+        session, _ = await store.load("s1")
+        assert await store.fold("s1", "first", session['chat_history'][:1], session.get('summary_version'))
+        applied = await store.fold("s1", "second", session['chat_history'][:3], session.get('summary_version'))
+        return applied, await store.get_turns("s1")
+
+    applied, turns = asyncio.run(run())
+    assert not applied
+    assert turns.summary == "first"
+    assert len(turns) == 4
+    assert store.stats()["fold_conflicts"] == 1
+
+
+def test_queued_turns_are_visible_before_they_are_written(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "10000")
+    store = SessionHistoryStore(InMemoryCollection())
+
+    async def run():
+        await store.append("s1", "bot", "q0", "a0")
+        session, pending = await store.load("s1")
+        turns = await store.get_turns("s1")
+        await store.stop()
+        return session, pending, turns
+
+    session, pending, turns = asyncio.run(run())
+    assert session['chat_history'] == []
+    assert [record['question'] for record in pending] == ["q0"]
+    assert turns == [("q0", "a0")]
+    assert store.collection.documents[0]['chat_history'][0]['question'] == "q0"
+
+
+@pytest.fixture
+def summarizer(store, monkeypatch):
+    monkeypatch.setattr(history_summary, "history_store", store)
+    monkeypatch.setenv("HISTORY_SUMMARY_KEEP_TURNS", "3")
+    monkeypatch.setenv("HISTORY_SUMMARY_THRESHOLD", "100000")
+    summarizer = history_summary.HistorySummarizer()
+    calls = []
+
+    async def summarize(summary, entries, llm_model, prompts):
+        calls.append(len(entries))
+        return f"{len(entries)} turns"
+
+    monkeypatch.setattr(summarizer, "summarize", summarize)
+    summarizer.calls = calls
+    return summarizer
+
+
+def test_short_histories_below_the_threshold_are_not_folded(store, summarizer):
+    append_turns(store, 9)
+
+    assert not summarizer.needs_folding(asyncio.run(store.get_turns("s1")))
+    asyncio.run(summarizer._compact("s1", None, {}))
+    assert summarizer.calls == []
+    assert len(asyncio.run(store.get_turns("s1"))) == 9
+
+
+def test_sessions_are_folded_before_the_cap_trims_turns(store, summarizer):
+    append_turns(store, 10)
+    asyncio.run(summarizer._compact("s1", None, {}))
+
+    turns = asyncio.run(store.get_turns("s1"))
+    assert turns.summary == "7 turns"
+    assert turns == [("q7", "a7"), ("q8", "a8"), ("q9", "a9")]
+
+
+def test_sessions_over_the_token_threshold_are_folded(store, summarizer):
+    summarizer.threshold = 2
+    append_turns(store, 4)
+    asyncio.run(summarizer._compact("s1", None, {}))
+
+    turns = asyncio.run(store.get_turns("s1"))
+    assert summarizer.calls == [1]
+    assert turns == [("q1", "a1"), ("q2", "a2"), ("q3", "a3")]
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Dict, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.retrievers import BaseRetriever
+
+import hybrid_retriever
+from hybrid_retriever import HybridRetriever, chunk_id, hybrid_search, reciprocal_rank_fusion
+
+
+def doc(name: str, **metadata) -> Document:
+    return Document(page_content=name, metadata=metadata)
+
+
+class ScriptedRetriever(BaseRetriever):
+    """
+    Returns the documents scripted for each query after `delay` seconds, or raises `error`.
+    """
+    results: Dict[str, List[Document]] = {}
+    delay: float = 0.0
+    error: str = ""
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.results.get(query, [])
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.results.get(query, [])
+
+
+def names(docs: List[Document]) -> List[str]:
+    return [d.page_content for d in docs]
+
+
+def test_chunk_id_prefers_the_mongo_id_then_the_content_hash():
+    assert chunk_id(doc("text", _id=7, content_hash="h")) == "7"
+    assert chunk_id(doc("text", content_hash="h")) == "h"
+    assert chunk_id(doc("text")) == "text"
+
+
+def test_fusion_sums_scores_of_documents_found_by_several_searches():
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b"), doc("c")]], [1.0, 1.0], c=60)
+
+    assert names(fused) == ["b", "a", "c"]
+
+
+def test_fusion_weights_each_list():
+    fused = reciprocal_rank_fusion([[doc("a")], [doc("b")]], [0.3, 0.7], c=60)
+
+    assert names(fused) == ["b", "a"]
+
+
+def test_fusion_keeps_first_seen_order_on_ties_and_handles_no_results():
+    assert names(reciprocal_rank_fusion([[doc("a")], [doc("b")]], [1.0, 1.0])) == ["a", "b"]
+    assert reciprocal_rank_fusion([[], []], [1.0, 1.0]) == []
+
+
+def test_fusion_deduplicates_by_chunk_id():
+    fused = reciprocal_rank_fusion([[doc("first", _id=1)], [doc("again", _id=1), doc("other", _id=2)]], [1.0, 1.0])
+
+    assert names(fused) == ["first", "other"]
+
+
+def test_variant_results_are_fused_with_keyword_and_original_searches(monkeypatch):
+    async def variants(query, llm):
+        return ["pro plan price"]
+
+    monkeypatch.setattr(hybrid_search, "variants", variants)
+    vector = ScriptedRetriever(results={"cost": [doc("pricing"), doc("faq")], "pro plan price": [doc("pricing"), doc("pro")]})
+    keyword = ScriptedRetriever(results={"cost": [doc("faq")]})
+
+    docs = asyncio.run(HybridRetriever(vector_retriever=vector, keyword_retriever=keyword).ainvoke("cost"))
+
+    assert names(docs) == ["pricing", "faq", "pro"]
+
+
+def test_slow_search_only_drops_its_own_results(monkeypatch):
+    monkeypatch.setenv("HYBRID_SEARCH_TIMEOUT", "0.05")
+    timeouts = hybrid_search.stats()["search_timeouts"]
+    vector = ScriptedRetriever(results={"cost": [doc("pricing")]}, delay=1)
+    keyword = ScriptedRetriever(results={"cost": [doc("faq")]})
+    retriever = HybridRetriever(vector_retriever=vector, keyword_retriever=keyword)
+
+    docs = asyncio.run(retriever.ainvoke("cost"))
+
+    assert retriever.search_timeout == 0.05
+    assert names(docs) == ["faq"]
+    assert hybrid_search.stats()["search_timeouts"] == timeouts + 1
+
+
+def test_failed_search_only_drops_its_own_results():
+    errors = hybrid_search.stats()["search_errors"]
+    vector = ScriptedRetriever(results={"cost": [doc("pricing")]})
+    keyword = ScriptedRetriever(error="index unavailable")
+
+    docs = asyncio.run(HybridRetriever(vector_retriever=vector, keyword_retriever=keyword).ainvoke("cost"))
+
+    assert names(docs) == ["pricing"]
+    assert hybrid_search.stats()["search_errors"] == errors + 1
+
+
+def test_failed_variant_generation_searches_the_original_question(monkeypatch):
+    async def run(call, runnable, inputs, fallback=None):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(hybrid_retriever.llm_executor, "run", run)
+    monkeypatch.setattr(hybrid_retriever.chain_cache, "get", lambda *args: None)
+    errors = hybrid_search.stats()["variant_errors"]
+
+    assert asyncio.run(hybrid_search.variants("cost", object())) == []
+    assert hybrid_search.stats()["variant_errors"] == errors + 1
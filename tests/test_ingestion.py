@@ -0,0 +1,178 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+import ingestion
+from benchmarks.fakes import FakeEmbeddingModel, InMemoryCollection
+from ingestion import IngestionPipeline
+
+
+def paragraph(name):
+    # Long enough that the splitter keeps every paragraph in a chunk of its own
+    return f"{name}. " + "lorem ipsum dolor sit amet " * 25
+
+
+def page(*names):
+    return "<html><title>Page</title><body>" + "".join(f"<p>{paragraph(name)}</p>" for name in names) + "</body></html>"
+
+
+class Site:
+    """
+    Serves pages with ETags and answers conditional requests with 304.
+    """
+    def __init__(self, **pages):
+        self.pages = {}
+        self.requests = []
+        for path, names in pages.items():
+            self.set(path, *names)
+
+    def set(self, path, *names):
+        self.pages[f"https://example.com/{path}"] = (page(*names), f'"{hash(names)}"')
+
+    async def handle(self, request):
+        url = str(request.url)
+        self.requests.append((url, request.headers.get("if-none-match")))
+        await asyncio.sleep(0.01)
+        html, etag = self.pages[url]
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304)
+        return httpx.Response(200, text=html, headers={"etag": etag})
+
+
+class FakeModelManager:
+    def get_embedding_model(self):
+        return FakeEmbeddingModel(dim=16)
+
+
+@pytest.fixture
+def site(monkeypatch):
+    site = Site(about=["Founded in 1990", "Shared footer"], pricing=["Plans start at 10 dollars", "Shared footer"])
+    client = httpx.AsyncClient
+    monkeypatch.setattr(ingestion.httpx, "AsyncClient", lambda **kwargs: client(transport=httpx.MockTransport(site.handle), **kwargs))
+    return site
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setenv("INGEST_LEASE_POLL", "0.01")
+    monkeypatch.setattr(ingestion, "EmbeddingModelManager", FakeModelManager)
+    pipeline = IngestionPipeline()
+    pipeline.collection = InMemoryCollection()
+    pipeline.sources_collection = InMemoryCollection()
+    pipeline.versions_collection = InMemoryCollection()
+    pipeline.leases_collection = InMemoryCollection()
+    # Threads instead of the spawned process pool keep the test fast
+    pipeline._process_pool = ThreadPoolExecutor(max_workers=2)
+    return pipeline
+
+
+URLS = ["https://example.com/about", "https://example.com/pricing"]
+
+
+def ingest(pipeline, urls=URLS, bot_token="bot"):
+    return asyncio.run(pipeline.run(urls, bot_token))
+
+
+def chunks(pipeline, source=None):
+    return sorted(
+        (doc["source"], doc["content"].splitlines()[-1].split(".")[0])
+        for doc in pipeline.collection.documents if source is None or doc.get("source") == source
+    )
+
+
+def test_first_run_stores_each_pages_chunks(pipeline, site):
+    job = ingest(pipeline)
+
+    assert job.status == "completed"
+    assert chunks(pipeline) == [
+        (URLS[0], "Founded in 1990"), (URLS[0], "Shared footer"),
+        (URLS[1], "Plans start at 10 dollars"), (URLS[1], "Shared footer"),
+    ]
+    assert job.counters["written"] == 4
+    assert pipeline.versions_collection.documents[0]["version"] == job.job_id
+    assert pipeline.leases_collection.documents == []
+
+
+def test_unchanged_pages_are_not_refetched(pipeline, site):
+    ingest(pipeline)
+    site.requests.clear()
+
+    job = ingest(pipeline)
+
+    assert all(etag is not None for _, etag in site.requests)
+    assert job.counters["urls_unchanged"] == 2
+    assert job.counters["written"] == job.counters["removed"] == 0
+    assert len(pipeline.collection.documents) == 4
+
+
+def test_changed_pages_only_embed_new_chunks_and_drop_old_ones(pipeline, site):
+    ingest(pipeline)
+    site.set("about", "Founded in 1991", "Shared footer")
+
+    job = ingest(pipeline)
+
+    assert job.counters["chunks_skipped"] == 1
+    assert job.counters["embedded"] == job.counters["written"] == 1
+    assert job.counters["removed"] == 1
+    assert chunks(pipeline, URLS[0]) == [(URLS[0], "Founded in 1991"), (URLS[0], "Shared footer")]
+    # The passage shared with the other page is stored per page and survives
+    assert chunks(pipeline, URLS[1]) == [(URLS[1], "Plans start at 10 dollars"), (URLS[1], "Shared footer")]
+
+
+def test_only_recorded_pages_are_removed_when_dropped(pipeline, site):
+    ingest(pipeline)
+    for source in ["s3://bucket/manual.pdf", "https://www.youtube.com/watch?v=abc", None]:
+        asyncio.run(pipeline.collection.insert_one({"bot_token": "bot", "source": source, "content": "Kept. other content"}))
+    asyncio.run(pipeline.collection.insert_one({"bot_token": "other-bot", "source": URLS[1], "content": "Other bot. content"}))
+
+    job = ingest(pipeline, URLS[:1])
+
+    assert job.counters["removed"] == 2
+    assert chunks(pipeline, URLS[1]) == [(URLS[1], "Other bot")]
+    assert {doc.get("source") for doc in pipeline.collection.documents if doc["content"].startswith("Kept")} == {
+        "s3://bucket/manual.pdf", "https://www.youtube.com/watch?v=abc", None,
+    }
+    assert [doc["url"] for doc in pipeline.sources_collection.documents] == [URLS[0]]
+
+
+def test_runs_of_the_same_bot_do_not_interleave(pipeline, site):
+    started = []
+    load_state = pipeline._load_state
+
+    async def record_start(job):
+        started.append((job.job_id, time.time()))
+        await load_state(job)
+
+    pipeline._load_state = record_start
+
+    async def run():
+        return await asyncio.gather(pipeline.run(URLS, "bot"), pipeline.run(URLS[:1], "bot"))
+
+    first, second = asyncio.run(run())
+    (first_id, _), (second_id, second_start) = started
+    earlier = first if first.job_id == first_id else second
+    assert earlier.finished_at <= second_start
+    assert first.status == second.status == "completed"
+
+
+def test_a_held_lease_makes_the_run_fail_after_waiting(pipeline, site, monkeypatch):
+    pipeline.lease_wait = 0.05
+    lease = {"bot_token": "bot", "job_id": "other", "expires_at": datetime.utcnow() + timedelta(minutes=5)}
+
+    async def hold():
+        await pipeline._ensure_indexes()
+        await pipeline.leases_collection.insert_one(lease)
+
+    asyncio.run(hold())
+    with pytest.raises(RuntimeError):
+        ingest(pipeline)
+    assert pipeline.collection.documents == []
+    assert list(pipeline.jobs.values())[-1].status == "failed"
+
+    # A lease its holder stopped renewing is taken over
+    pipeline.leases_collection.documents[0]["expires_at"] = datetime.utcnow() - timedelta(seconds=1)
+    assert ingest(pipeline).status == "completed"
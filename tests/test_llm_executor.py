@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from llm_executor import DEFAULT_DEADLINES, LLMExecutor, LLMTimeoutError
+
+
+class ScriptedRunnable:
+    """
+    Answers the n-th invocation after `delays[n]` seconds, or raises when the delay is an exception.
+    """
+    def __init__(self, *delays, answer="answer"):
+        self.delays = list(delays)
+        self.answer = answer
+        self.calls = 0
+        self.cancelled = 0
+
+    async def ainvoke(self, inputs):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        if isinstance(delay, Exception):
+            raise delay
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"{self.answer} {self.calls}"
+
+
+def race(executor, runnable, deadline=1.0, hedge_delay=None):
+    return asyncio.run(executor._race("generate", runnable, {}, deadline, hedge_delay))
+
+
+def test_fast_primary_wins_without_hedging():
+    runnable = ScriptedRunnable(0.01)
+
+    assert race(LLMExecutor(), runnable, hedge_delay=0.2) == ("answer 1", "primary")
+    assert runnable.calls == 1
+
+
+def test_hedge_wins_when_the_primary_is_slow_and_the_primary_is_cancelled():
+    runnable = ScriptedRunnable(0.5, 0.01)
+
+    assert race(LLMExecutor(), runnable, hedge_delay=0.05) == ("answer 2", "hedge")
+    assert runnable.calls == 2
+    assert runnable.cancelled == 1
+
+
+def test_early_failure_is_hedged_at_once():
+    runnable = ScriptedRunnable(RuntimeError("rate limited"), 0.01)
+
+    assert race(LLMExecutor(), runnable, hedge_delay=10) == ("answer 2", "hedge")
+
+
+def test_errors_propagate_when_every_request_fails():
+    runnable = ScriptedRunnable(RuntimeError("first"), RuntimeError("second"))
+
+    with pytest.raises(RuntimeError, match="second"):
+        race(LLMExecutor(), runnable, hedge_delay=0.05)
+
+
+def test_missed_deadline_raises_and_cancels_the_requests():
+    runnable = ScriptedRunnable(1.0)
+
+    with pytest.raises(LLMTimeoutError):
+        race(LLMExecutor(), runnable, deadline=0.1, hedge_delay=0.05)
+    assert runnable.calls == 2
+    assert runnable.cancelled == 2
+
+
+def test_run_falls_back_after_a_timeout(monkeypatch):
+    monkeypatch.setenv("LLM_DEADLINE_GENERATE", "0.05")
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "false")
+    executor = LLMExecutor()
+    fallback = ScriptedRunnable(0.01, answer="fallback")
+
+    assert asyncio.run(executor.run("generate", ScriptedRunnable(1.0), {}, fallback=fallback)) == "fallback 1"
+    counters = executor.stats()["generate"]
+    assert (counters["calls"], counters["timeout"], counters["fallback"]) == (1, 1, 1)
+    # Fallback latencies must not feed the primary's hedge delay
+    assert len(executor._latencies["generate"]) == 0
+
+
+def test_only_rewrites_are_hedged_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_HEDGE_CALLS", raising=False)
+    executor = LLMExecutor()
+
+    assert executor.hedge_delay("rewrite") is not None
+    assert executor.hedge_delay("generate") is None
+
+
+def test_hedge_delay_follows_recent_latencies(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_CALLS", "rewrite,generate")
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "3")
+    monkeypatch.setenv("LLM_HEDGE_INITIAL_DELAY", "3")
+    monkeypatch.setenv("LLM_HEDGE_MIN_DELAY", "0.5")
+    executor = LLMExecutor()
+
+    assert executor.hedge_delay("generate") == 3
+    assert executor.hedge_delay("follow_up") is None
+    executor._latencies["generate"].extend([1.0, 2.0, 4.0])
+    assert 2.0 < executor.hedge_delay("generate") <= 4.0
+    executor._latencies["rewrite"].extend([0.1, 0.1, 0.1])
+    assert executor.hedge_delay("rewrite") == 0.5
+
+
+def test_deadlines_default_per_call(monkeypatch):
+    monkeypatch.setenv("LLM_DEADLINE", "30")
+    monkeypatch.setenv("LLM_DEADLINE_FOLLOW_UP", "2")
+    executor = LLMExecutor()
+
+    assert executor.deadline_for("generate") == 30
+    assert executor.deadline_for("rewrite") == DEFAULT_DEADLINES["rewrite"]
+    assert executor.deadline_for("follow_up") == 2
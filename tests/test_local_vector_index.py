@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents.base import Document
+from langchain_core.embeddings import Embeddings
+
+import local_vector_index
+from benchmarks.fakes import FakeEmbeddingModel
+from local_vector_index import LocalVectorIndexRegistry, LocalVectorRetriever
+
+TEXTS = [
+    "refund policy for online orders",
+    "shipping takes three to five days",
+    "warranty covers manufacturing defects",
+    "store opening hours on weekends",
+    "contact support by email",
+]
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.model = FakeEmbeddingModel(dim=64)
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.model.embed_query(text)
+
+
+class Corpus:
+    """
+    A bot's chunks as the loader streams them, with the corpus version ingestion would store.
+    """
+    def __init__(self, texts=TEXTS):
+        self.embeddings = FakeEmbeddings()
+        self.version = "v1"
+        self.loads = 0
+        self.set(texts)
+
+    def set(self, texts):
+        self.texts = list(texts)
+
+    def loader(self, bot_token):
+        self.loads += 1
+        for text, embedding in zip(self.texts, self.embeddings.embed_documents(self.texts)):
+            yield Document(page_content=text, metadata={"bot_token": bot_token}), embedding
+
+    def version_reader(self, bot_token):
+        return self.version
+
+
+@pytest.fixture
+def registry_factory(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCAL_VECTOR_DIR", str(tmp_path))
+
+    def factory(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return LocalVectorIndexRegistry()
+    return factory
+
+
+def search(index, corpus, query, k=2, score_threshold=None):
+    return [(document.page_content, score) for document, score in index.search(corpus.embeddings.embed_query(query), k, score_threshold)]
+
+
+def manifest(registry, bot_token="bot"):
+    with open(registry._prefix(bot_token) + ".json") as manifest_file:
+        return json.load(manifest_file)
+
+
+def test_build_saves_and_reloads_through_mmap(registry_factory):
+    corpus = Corpus()
+    index = registry_factory().get("bot", corpus.loader, corpus.version_reader)
+
+    assert len(index) == len(TEXTS)
+    assert search(index, corpus, "refund policy")[0][0] == "refund policy for online orders"
+
+    # A second worker loads the saved version instead of rebuilding
+    reloaded_registry = registry_factory()
+    reloaded = reloaded_registry.get("bot", corpus.loader, corpus.version_reader)
+    assert corpus.loads == 1
+    assert isinstance(reloaded.vectors.codes, np.memmap)
+    assert reloaded_registry.stats()["loads"] == 1
+    assert reloaded_registry.stats()["builds"] == 0
+    assert [document.page_content for document in reloaded.documents] == TEXTS
+
+
+def test_manifest_keeps_the_previous_version_and_removes_older_ones(registry_factory, tmp_path):
+    registry = registry_factory(LOCAL_VECTOR_TTL="0")
+    corpus = Corpus()
+    versions = []
+    for version in ["v1", "v2", "v3"]:
+        corpus.version = version
+        registry.get("bot", corpus.loader, corpus.version_reader)
+        versions.append(manifest(registry)["version"])
+
+    current = manifest(registry)
+    assert current["corpus_version"] == "v3"
+    assert current["previous"] == versions[1]
+    assert os.path.exists(os.path.join(tmp_path, versions[1] + ".npy"))
+    assert not os.path.exists(os.path.join(tmp_path, versions[0] + ".npy"))
+    assert not os.path.exists(os.path.join(tmp_path, versions[0] + ".jsonl"))
+
+
+def test_indexes_are_revalidated_against_the_corpus_version_after_the_ttl(registry_factory):
+    registry = registry_factory(LOCAL_VECTOR_TTL="0")
+    corpus = Corpus()
+    first = registry.get("bot", corpus.loader, corpus.version_reader)
+
+    assert registry.get("bot", corpus.loader, corpus.version_reader) is first
+    assert registry.stats()["revalidations"] == 1
+
+    # Ingestion in another process changes the corpus
+    corpus.set(TEXTS + ["gift cards never expire"])
+    corpus.version = "v2"
+    rebuilt = registry.get("bot", corpus.loader, corpus.version_reader)
+    assert rebuilt is not first
+    assert len(rebuilt) == len(TEXTS) + 1
+    assert corpus.loads == 2
+
+
+def test_indexes_are_not_revalidated_within_the_ttl(registry_factory):
+    registry = registry_factory(LOCAL_VECTOR_TTL="60")
+    corpus = Corpus()
+    first = registry.get("bot", corpus.loader, corpus.version_reader)
+    corpus.version = "v2"
+
+    assert registry.get("bot", corpus.loader, corpus.version_reader) is first
+    assert registry.stats()["hits"] == 1
+
+
+def test_search_applies_the_score_threshold(registry_factory):
+    corpus = Corpus()
+    index = registry_factory().get("bot", corpus.loader, corpus.version_reader)
+
+    results = search(index, corpus, "refund policy", k=5)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    assert all(0 <= score <= 1 for _, score in results)
+
+    threshold = (results[0][1] + results[1][1]) / 2
+    assert search(index, corpus, "refund policy", k=5, score_threshold=threshold) == results[:1]
+
+
+@pytest.mark.parametrize("dtype, rescore", [("float32", "0"), ("int8", "0"), ("int8", "4")])
+def test_brute_force_search_matches_exact_cosine_ranking(registry_factory, dtype, rescore):
+    corpus = Corpus()
+    index = registry_factory(LOCAL_VECTOR_DTYPE=dtype, LOCAL_VECTOR_RESCORE_FACTOR=rescore).get("bot", corpus.loader, corpus.version_reader)
+    matrix = np.asarray(corpus.embeddings.embed_documents(TEXTS))
+    query = np.asarray(corpus.embeddings.embed_query("warranty defects"))
+
+    expected = [TEXTS[row] for row in np.argsort(-(matrix @ query))[:3]]
+    assert index.ann is None
+    assert [text for text, _ in search(index, corpus, "warranty defects", k=3)] == expected
+
+
+def test_exact_search_is_used_above_the_ann_threshold_without_hnswlib(registry_factory, monkeypatch):
+    monkeypatch.setattr(local_vector_index, "hnswlib", None)
+    corpus = Corpus()
+    registry = registry_factory(LOCAL_VECTOR_ANN_THRESHOLD="1")
+    index = registry.get("bot", corpus.loader, corpus.version_reader)
+
+    assert index.ann is None
+    assert registry.stats()["ann_available"] is False
+    assert search(index, corpus, "shipping days")[0][0] == "shipping takes three to five days"
+
+
+def test_empty_corpus_returns_no_results(registry_factory):
+    corpus = Corpus(texts=[])
+    index = registry_factory().get("bot", corpus.loader, corpus.version_reader)
+
+    assert len(index) == 0
+    assert search(index, corpus, "anything") == []
+
+
+def test_retriever_searches_the_bots_index(registry_factory, monkeypatch):
+    monkeypatch.setattr(local_vector_index, "local_vector_indexes", registry_factory())
+    corpus = Corpus()
+    retriever = LocalVectorRetriever(bot_token="bot", embeddings=corpus.embeddings, loader=corpus.loader, version_reader=corpus.version_reader, k=1)
+
+    assert [doc.page_content for doc in retriever.invoke("contact support")] == ["contact support by email"]
+    assert [doc.page_content for doc in asyncio.run(retriever.ainvoke("opening hours"))] == ["store opening hours on weekends"]
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# prometheus_client picks its value storage at import time, so each worker runs in its own process
+WORKER = """
+import sys
+import metrics
+metrics.LLM_CALLS.labels("generate", "ok").inc(int(sys.argv[1]))
+metrics.register_stats("worker", lambda: {"requests": int(sys.argv[1])})
+sys.stdout.write(metrics.render_metrics()[0].decode())
+"""
+
+
+def run_worker(calls, env):
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER, str(calls)], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return result.stdout
+
+
+def test_metrics_are_aggregated_across_worker_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), "MONGO_DB_URI": "mongodb://localhost:27017"}
+
+    run_worker(2, env)
+    output = run_worker(3, env)
+
+    assert 'sara_llm_calls_total{call="generate",outcome="ok"} 5.0' in output
+    assert 'sara_component_stat{component="worker",stat="requests"} 3.0' in output
+
+
+def test_metrics_are_per_process_without_a_multiprocess_dir():
+    env = {key: value for key, value in os.environ.items() if key != "PROMETHEUS_MULTIPROC_DIR"}
+    env["MONGO_DB_URI"] = "mongodb://localhost:27017"
+
+    output = run_worker(2, env)
+
+    assert 'sara_llm_calls_total{call="generate",outcome="ok"} 2.0' in output
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from quantization import QuantizedMatrix
+
+
+def random_matrix(rows=2500, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-5), ("float16", 1e-2), ("int8", 5e-2)])
+def test_scores_match_float_dot_products(dtype, tolerance):
+    matrix = random_matrix()
+    query = np.random.default_rng(1).normal(size=32).astype(np.float32)
+    quantized = QuantizedMatrix.quantize(matrix, dtype)
+
+    assert quantized.dtype == dtype
+    assert len(quantized) == len(matrix)
+    expected = matrix @ query
+    # The error grows with the query's norm, so compare relative to the score scale
+    assert np.max(np.abs(quantized.scores(query) - expected)) < tolerance * np.linalg.norm(query) * np.sqrt(32)
+
+
+def test_int8_scores_equal_dot_products_of_dequantized_rows():
+    quantized = QuantizedMatrix.quantize(random_matrix(), "int8")
+    query = np.random.default_rng(2).normal(size=32).astype(np.float32)
+
+    np.testing.assert_allclose(quantized.scores(query), quantized.dequantize() @ query, rtol=1e-4, atol=1e-3)
+
+
+def test_int8_uses_a_quarter_of_float32_storage():
+    matrix = random_matrix()
+    quantized = QuantizedMatrix.quantize(matrix, "int8")
+
+    assert quantized.codes.dtype == np.int8
+    assert quantized.nbytes == matrix.nbytes // 4 + 2 * 32 * 4
+
+
+def test_constant_dimensions_round_trip():
+    matrix = np.ones((4, 3), dtype=np.float32)
+    matrix[:, 0] = np.arange(4)
+    quantized = QuantizedMatrix.quantize(matrix, "int8")
+
+    np.testing.assert_allclose(quantized.dequantize(), matrix, atol=1e-2)
+
+
+def test_params_round_trip():
+    quantized = QuantizedMatrix.quantize(random_matrix(rows=10), "int8")
+    restored = QuantizedMatrix.from_params(quantized.codes, quantized.params())
+
+    np.testing.assert_array_equal(restored.dequantize(), quantized.dequantize())
+    assert QuantizedMatrix.quantize(random_matrix(rows=10), "float16").params() is None
+
+
+def test_unsupported_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        QuantizedMatrix.quantize(random_matrix(rows=2), "int4")
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from langchain_core.documents.base import Document
+
+import query_rewrite
+from llm_executor import LLMTimeoutError
+from query_rewrite import QueryRewriter
+from timings import StageTimings
+
+HISTORY = [("Which plans do you offer?", "Basic and Pro.")]
+
+
+class RecordingRetriever:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.queries = []
+        self.cancelled = 0
+
+    async def ainvoke(self, query):
+        self.queries.append(query)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return [Document(page_content=f"about {query}")]
+
+
+@pytest.fixture
+def rewrites(monkeypatch):
+    """
+    Answers the rewrite call with the queued results, raising the ones that are exceptions.
+    """
+    results = []
+
+    async def run(call, runnable, inputs, fallback=None):
+        await asyncio.sleep(0.01)
+        result = results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    monkeypatch.setattr(query_rewrite.llm_executor, "run", run)
+    return results
+
+
+def retrieve(rewriter, question, retriever, chat_history=HISTORY):
+    timings = StageTimings()
+    query, docs = asyncio.run(rewriter.retrieve(question, chat_history, [], None, retriever, timings))
+    return query, docs, timings
+
+
+@pytest.mark.parametrize("question, chat_history, expected", [
+    ("How much does it cost?", [], False),
+    ("How much does the Pro plan cost per month?", HISTORY, False),
+    ("How much does it cost?", HISTORY, True),
+    ("And the Basic plan, how much per month?", HISTORY, True),
+    ("What about Basic?", HISTORY, True),
+    ("Pricing details?", HISTORY, True),
+])
+def test_rewrite_is_skipped_for_first_turns_and_self_contained_questions(question, chat_history, expected):
+    assert QueryRewriter().needs_rewrite(question, chat_history) is expected
+
+
+@pytest.mark.parametrize("mode, expected", [("never", False), ("always", True)])
+def test_mode_overrides_the_heuristic(monkeypatch, mode, expected):
+    monkeypatch.setenv("QUERY_REWRITE_MODE", mode)
+
+    assert QueryRewriter().needs_rewrite("How much does the Pro plan cost per month?", HISTORY) is expected
+
+
+def test_skipped_rewrite_retrieves_the_question_as_asked(rewrites):
+    retriever = RecordingRetriever()
+
+    query, docs, timings = retrieve(QueryRewriter(), "How much does the Pro plan cost per month?", retriever)
+
+    assert query == "How much does the Pro plan cost per month?"
+    assert retriever.queries == [query]
+    assert "rewrite" not in timings.stages
+
+
+def test_speculative_results_are_reused_when_the_rewrite_barely_changes(monkeypatch, rewrites):
+    monkeypatch.setenv("QUERY_REWRITE_REUSE_SIMILARITY", "0.5")
+    rewriter = QueryRewriter()
+    retriever = RecordingRetriever()
+    rewrites.append("How much does the Pro plan cost?")
+
+    query, docs, timings = retrieve(rewriter, "How much does it cost?", retriever)
+
+    # Jaccard of {how, much, does, it, cost} and {how, much, does, the, pro, plan, cost} is 4/8
+    assert query == "How much does the Pro plan cost?"
+    assert retriever.queries == ["How much does it cost?"]
+    assert docs[0].page_content == "about How much does it cost?"
+    assert rewriter.stats()["speculative_hits"] == 1
+    assert "speculative_retrieve" in timings.stages
+
+
+def test_speculative_results_are_discarded_when_the_rewrite_differs(rewrites):
+    rewriter = QueryRewriter()
+    retriever = RecordingRetriever(delay=0.05)
+    rewrites.append("How much does the Pro plan cost?")
+
+    query, docs, _ = retrieve(rewriter, "How much does it cost?", retriever)
+
+    assert retriever.queries == ["How much does it cost?", "How much does the Pro plan cost?"]
+    assert retriever.cancelled == 1
+    assert docs[0].page_content == "about How much does the Pro plan cost?"
+    assert rewriter.stats()["speculative_misses"] == 1
+
+
+def test_rewrite_timeout_falls_back_to_the_question(rewrites):
+    rewriter = QueryRewriter()
+    retriever = RecordingRetriever()
+    rewrites.append(LLMTimeoutError())
+
+    query, docs, _ = retrieve(rewriter, "How much does it cost?", retriever)
+
+    assert query == "How much does it cost?"
+    assert retriever.queries == [query]
+    assert rewriter.stats()["rewrite_timeouts"] == 1
+    assert rewriter.stats()["speculative_hits"] == 1
+
+
+def test_failed_rewrite_cancels_the_speculative_search(rewrites):
+    retriever = RecordingRetriever(delay=1)
+    rewrites.append(RuntimeError("model unavailable"))
+
+    with pytest.raises(RuntimeError):
+        retrieve(QueryRewriter(), "How much does it cost?", retriever)
+
+    assert retriever.cancelled == 1
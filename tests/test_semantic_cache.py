@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def corpus():
+    return {"version": "v1"}
+
+
+@pytest.fixture
+def cache(monkeypatch, corpus):
+    monkeypatch.setenv("SEMANTIC_CACHE_THRESHOLD", "0.9")
+    monkeypatch.setenv("SEMANTIC_CACHE_VERSION_TTL", "0")
+    cache = SemanticCache()
+    cache.version_reader = lambda bot_token: corpus["version"]
+    return cache
+
+
+def vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def cache_answer(cache, embedding, answer="Open 9 to 5.", bot_token="bot"):
+    # An answer is stored after the lookup that missed, like the chat path does
+    assert cache.lookup(bot_token, embedding) is None
+    cache.store(bot_token, embedding, answer, ["doc-1"])
+
+
+def test_similar_questions_hit(cache):
+    cache_answer(cache, vector(1, 0, 0))
+
+    hit = cache.lookup("bot", vector(0.99, 0.05, 0))
+
+    assert hit["answer"] == "Open 9 to 5."
+    assert hit["doc_ids"] == ["doc-1"]
+    assert hit["similarity"] > 0.9
+    assert cache.stats()["hits"] == 1
+
+
+def test_dissimilar_questions_and_other_bots_miss(cache):
+    cache_answer(cache, vector(1, 0, 0))
+
+    assert cache.lookup("bot", vector(0, 1, 0)) is None
+    assert cache.lookup("other-bot", vector(1, 0, 0)) is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch, corpus):
+    monkeypatch.setenv("SEMANTIC_CACHE_TTL", "0")
+    cache = SemanticCache()
+    cache.version_reader = lambda bot_token: corpus["version"]
+    cache_answer(cache, vector(1, 0, 0))
+
+    assert cache.lookup("bot", vector(1, 0, 0)) is None
+
+
+def test_invalidate_drops_the_bot(cache):
+    cache_answer(cache, vector(1, 0, 0))
+    cache.invalidate("bot")
+
+    assert cache.lookup("bot", vector(1, 0, 0)) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_answers_from_an_older_corpus_are_not_served(cache, corpus):
+    cache_answer(cache, vector(1, 0, 0))
+    # Ingestion in another process bumps the version
+    corpus["version"] = "v2"
+
+    assert cache.lookup("bot", vector(1, 0, 0)) is None
+    cache.store("bot", vector(1, 0, 0), "Open 8 to 6.", ["doc-2"])
+    assert cache.lookup("bot", vector(1, 0, 0))["answer"] == "Open 8 to 6."
+
+
+def test_the_version_is_read_at_most_once_per_ttl(monkeypatch):
+    monkeypatch.setenv("SEMANTIC_CACHE_VERSION_TTL", "60")
+    cache = SemanticCache()
+    reads = []
+    cache.version_reader = lambda bot_token: reads.append(bot_token) or "v1"
+    cache_answer(cache, vector(1, 0, 0))
+
+    assert cache.lookup("bot", vector(1, 0, 0)) is not None
+    assert reads == ["bot"]
+
+
+def test_a_failed_version_read_keeps_the_last_known_version(cache, corpus):
+    cache_answer(cache, vector(1, 0, 0))
+
+    def unavailable(bot_token):
+        raise ConnectionError("mongo unavailable")
+
+    cache.version_reader = unavailable
+    assert cache.lookup("bot", vector(1, 0, 0))["answer"] == "Open 9 to 5."
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, answer_key
+
+
+class Counter:
+    def __init__(self, delay=0.05, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"answer": self.calls}
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight()
+    function = Counter()
+
+    async def run():
+        return await asyncio.gather(*(flight.do(("bot", "q", True), function) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert function.calls == 1
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert all(result is results[0][0] for result, _ in results)
+    assert flight.stats()["coalesced"] == 4
+
+
+def test_results_are_reused_within_the_window(monkeypatch):
+    monkeypatch.setenv("SINGLEFLIGHT_WINDOW", "0.1")
+    flight = SingleFlight()
+    function = Counter(delay=0)
+
+    async def run():
+        first = await flight.do("key", function)
+        second = await flight.do("key", function)
+        await asyncio.sleep(0.15)
+        third = await flight.do("key", function)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert second == (first[0], True)
+    assert third == ({"answer": 2}, False)
+    assert flight.stats()["window_hits"] == 1
+
+
+def test_failures_reach_waiters_but_are_not_cached():
+    flight = SingleFlight()
+    function = Counter(error=RuntimeError("llm down"))
+
+    async def run():
+        results = await asyncio.gather(flight.do("key", function), flight.do("key", function), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do("key", function)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert function.calls == 2
+    assert flight.stats()["failures"] == 2
+
+
+def test_sessions_with_history_are_not_coalesced_by_default(monkeypatch):
+    flight = SingleFlight()
+    function = Counter()
+    key = answer_key("bot", "What are your hours?", [("hi", "hello")])
+
+    async def run():
+        return await asyncio.gather(flight.do(key, function), flight.do(key, function))
+
+    assert [shared for _, shared in asyncio.run(run())] == [False, False]
+    assert function.calls == 2
+
+    monkeypatch.setenv("SINGLEFLIGHT_WITH_HISTORY", "true")
+    flight = SingleFlight()
+    function = Counter()
+    assert [shared for _, shared in asyncio.run(run())] == [False, True]
+    assert function.calls == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_execution():
+    flight = SingleFlight()
+    function = Counter(delay=0.1)
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", function))
+        second = asyncio.ensure_future(flight.do("key", function))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ({"answer": 1}, True)
+    assert function.calls == 1
+
+
+def test_answer_key_normalizes_the_question():
+    assert answer_key("bot", "  What are your HOURS?", []) == answer_key("bot", "what are your hours?", None)
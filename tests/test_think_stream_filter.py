@@ -0,0 +1,49 @@
+import pytest
+
+from bot_response import ThinkStreamFilter, remove_think_step
+
+
+def stream(chunks):
+    think_filter = ThinkStreamFilter()
+    return "".join(think_filter.feed(chunk) for chunk in chunks) + think_filter.flush()
+
+
+def split_every(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("text", [
+    "plain answer",
+    "<think>reasoning</think>\nThe answer.",
+    "Intro <think>a</think>middle<think>b</think>\nend",
+    "a < b and <thin is not a tag",
+    "Answer:\n<think>x</think>\nB",
+    "Answer:\n\n<think>x</think>\n\nB",
+    "a\n<think>x</think>\n<think>y</think>\nb\n",
+])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_streamed_output_matches_the_batch_filter(text, size):
+    assert stream(split_every(text, size)) == remove_think_step(text)
+
+
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_unclosed_think_block_is_never_sent(size):
+    assert stream(split_every("Answer<think>never closed", size)) == "Answer"
+
+
+def test_tag_split_across_chunks_is_held_back():
+    think_filter = ThinkStreamFilter()
+
+    assert think_filter.feed("Hello <th") == "Hello "
+    assert think_filter.feed("ink>secret</thi") == ""
+    assert think_filter.feed("nk>\nworld") == "world"
+    assert think_filter.flush() == ""
+
+
+def test_newline_before_a_tag_is_held_back():
+    think_filter = ThinkStreamFilter()
+
+    assert think_filter.feed("Answer:\n") == "Answer:"
+    assert think_filter.feed("<think>x</think>\nB") == "B"
+    assert think_filter.feed("\n") == ""
+    assert think_filter.flush() == "\n"
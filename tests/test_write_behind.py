@@ -0,0 +1,103 @@
+import asyncio
+
+from pymongo import UpdateOne
+
+from benchmarks.fakes import InMemoryCollection
+from write_behind import WriteBehindQueue
+
+
+def to_operation(record):
+    return UpdateOne({"key": record["key"]}, {"$push": {"values": record["value"]}}, upsert=True)
+
+
+class FailingCollection:
+    def __init__(self):
+        self.attempts = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        self.attempts += 1
+        raise RuntimeError("primary unavailable")
+
+
+def test_records_are_batched_and_flushed_on_stop(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_BATCH_SIZE", "2")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "10000")
+    collection = InMemoryCollection()
+    queue = WriteBehindQueue(collection, to_operation, key_field="key")
+
+    async def run():
+        for value in range(5):
+            await queue.enqueue({"key": "a", "value": value})
+        await asyncio.wait_for(queue.stop(), 5)
+
+    asyncio.run(run())
+    assert collection.documents[0]["values"] == [0, 1, 2, 3, 4]
+    assert queue.stats()["flushed"] == 5
+    assert queue.pending("a") == []
+
+
+def test_queued_records_are_visible_until_persisted(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "10000")
+    collection = InMemoryCollection()
+    queue = WriteBehindQueue(collection, to_operation, key_field="key")
+
+    async def run():
+        await queue.enqueue({"key": "a", "value": 1})
+        await queue.enqueue({"key": "b", "value": 2})
+        pending = queue.pending("a")
+        await asyncio.wait_for(queue.stop(), 5)
+        return pending
+
+    assert asyncio.run(run()) == [{"key": "a", "value": 1}]
+    assert queue.pending("a") == []
+
+
+def test_failed_batches_are_retried_then_dead_lettered(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_RETRIES", "1")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "1")
+    collection = FailingCollection()
+    dead_letters = InMemoryCollection()
+    queue = WriteBehindQueue(collection, to_operation, dead_letters, key_field="key")
+
+    async def run():
+        await queue.enqueue({"key": "a", "value": 1})
+        await asyncio.wait_for(queue.stop(), 5)
+
+    asyncio.run(run())
+    assert collection.attempts == 2
+    assert [document["record"] for document in dead_letters.documents] == [{"key": "a", "value": 1}]
+    assert queue.stats()["dead_lettered"] == 1
+    assert queue.pending("a") == []
+
+
+def test_stop_returns_with_records_still_queued(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_BATCH_SIZE", "2")
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "20")
+    collection = InMemoryCollection()
+    collection.latency = 0.02
+    queue = WriteBehindQueue(collection, to_operation, key_field="key")
+
+    async def run():
+        for value in range(7):
+            await queue.enqueue({"key": "a", "value": value})
+        # The worker is still writing its first batch with the rest queued behind it
+        assert queue._queue.qsize() > 0
+        await asyncio.wait_for(queue.stop(), 5)
+
+    asyncio.run(run())
+    assert collection.documents[0]["values"] == list(range(7))
+    assert queue.pending("a") == []
+
+
+def test_stop_returns_while_the_worker_waits_for_a_batch(monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND_FLUSH_MS", "50")
+    collection = InMemoryCollection()
+    queue = WriteBehindQueue(collection, to_operation, key_field="key")
+
+    async def run():
+        await queue.enqueue({"key": "a", "value": 1})
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(queue.stop(), 5)
+
+    asyncio.run(run())
+    assert collection.documents[0]["values"] == [1]
@@ -0,0 +1,56 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+
+class StageTimings:
+    """
+    Wall-clock durations of the named stages of one request, in milliseconds.
+
+    Stages may overlap when they run concurrently; each one records its own elapsed time.
+    """
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, elapsed_ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(elapsed_ms, 2) for name, elapsed_ms in self.stages.items()}
+
+    def __str__(self):
+        return ", ".join(f"{name}={elapsed_ms:.1f}ms" for name, elapsed_ms in self.stages.items())
+
+
+# The timings of the request being handled; set by the metrics middleware
+current_timings: ContextVar[Optional[StageTimings]] = ContextVar("current_timings", default=None)
+
+
+def request_timings() -> StageTimings:
+    """
+    Returns the current request's timings, or a detached instance outside a request.
+    """
+    timings = current_timings.get()
+    return timings if timings is not None else StageTimings()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a stage of the current request; a no-op outside an instrumented request.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
@@ -6,20 +6,27 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents.base import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_transformers import LongContextReorder
 from pymongo import MongoClient
 import jwt
 import os
+import asyncio
 from datetime import datetime, timedelta
 from logger import logger
-from constants import pwd_context,SECRET_KEY,ALGORITHM, embedding_model, vector_search, vector_store#chat_history_collection,vector_collection
+from constants import SECRET_KEY,ALGORITHM, embedding_model, vector_search, vector_store, collection
+from history_store import history_store
+from history_summary import history_summarizer
 from dotenv import load_dotenv
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+from bm25_index import BM25IndexRetriever, bm25_indexes
+from ingestion import ingestion_pipeline
+from local_vector_index import LocalVectorRetriever
+from hybrid_retriever import HybridRetriever
+from context_packing import context_packer
 from fastapi import HTTPException
 import requests
 load_dotenv()
+
+# Shared session so synchronous callers reuse pooled connections to the admin backend
+backend_session = requests.Session()
 #User Authentication
 # Utility functions
 # MongoDB Client
@@ -120,9 +127,10 @@ def data_from_youtube_and_web(urls: List[str]) -> List[Document]:
         raise
 
 
-def store_user_data(urls: List[str], bot_token: str, file_urls: List[str]) -> bool:
+async def astore_user_data(urls: List[str], bot_token: str, file_urls: List[str]) -> bool:
     """
-    Processes a list of S3 URLs and user data, adding metadata including admin ID.
+    Ingests a bot's web pages through the staged ingestion pipeline. The pipeline only cleans
+    up pages it recorded itself, so chunks from `file_urls` are never removed by a re-sync.
 
     Args:
         urls (List[str]): List of URLs (YouTube and web) to process.
@@ -133,121 +141,91 @@ def store_user_data(urls: List[str], bot_token: str, file_urls: List[str]) -> bo
         bool: True if data was successfully stored, False otherwise.
     """
     logger.info(f"Storing user data with admin ID: {bot_token}")
-    
+
     try:
-        final_user_data = []
-        
         # logger.info("Processing S3 URLs.")
         # s3_data = process_s3_urls(file_urls)
-        # final_user_data.extend(s3_data)
-        # logger.info("Processed S3 URLs successfully.")
-
-        logger.info("Processing YouTube and web URLs.")
-        youtube_web_data = data_from_youtube_and_web(urls)
-        final_user_data.extend(youtube_web_data)
-        
-        # Chunk the data for processing
-        chunked_data = get_text_chunks(final_user_data)
-        
-        # Add admin ID to documents
-        id_added_data = add_bot_token_to_docs(chunked_data, bot_token)
-        
-        # Store the documents in the vector store
-            
-        # vector_store_manager = VectorStoreManager()
-        # vector_store= vec
-
-        vector_store.add_documents(id_added_data) 
-        logger.info("User data successfully stored in the vector store.")
-        
+        job = await ingestion_pipeline.run(urls, bot_token)
+        logger.info(f"User data successfully stored in the vector store. Job: {job.job_id}")
         return True
-    
+
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
-        logger.error(f"Error storing user data with ID {bot_token}: {e}")
+        logger.error(f"Error storing user data with ID {bot_token}: {e}", exc_info=True)
         return False
 
 
+def store_user_data(urls: List[str], bot_token: str, file_urls: List[str]) -> bool:
+    """
+    Synchronous wrapper around `astore_user_data` for callers outside an event loop.
+    """
+    return asyncio.run(astore_user_data(urls, bot_token, file_urls))
+
+
 
-def add_message_to_history(question, answer, bot_token, session_id):
+async def add_message_to_history(question, answer, bot_token, session_id, llm_model=None, prompts=None):
     try:
-        chat_history_collection.update_one(
-            {'session_id': session_id},  # Search query for a document with the given session_id
-            {
-                '$set': {"bot_token": bot_token},  # Update or set the bot_token field
-                '$push': {
-                    'chat_history': {  # Push a new chat entry to the 'chat_history' array
-                        '$each': [{'timestamp': datetime.utcnow(), 'question': question, 'answer': answer}],  # The new message
-                        # '$slice': -20  # Keep only the most recent 20 chat history entries
-                    }
-                },
-                '$setOnInsert': {'created_at': datetime.utcnow()}  # Set 'created_at' only on insert (not update)
-            },
-            upsert=True  # This option means that if no document is found with the given session_id, a new one will be created
-        )
+        await history_store.append(session_id, bot_token, question, answer)
     except Exception as e:
         logger.error(f"Error storing message for session_id: {session_id}, bot token: {bot_token} - {str(e)}")
+        return
+    if llm_model is not None:
+        # Folds older turns of long sessions into the running summary off the request path
+        history_summarizer.schedule(session_id, llm_model, prompts)
 
-def get_chat_history(session_id):
+async def get_chat_history(session_id):
     try:
-        session = chat_history_collection.find_one({'session_id': session_id}, {'_id': 0, 'chat_history': 1})
-        if session and 'chat_history' in session:
-            return [(entry['question'], entry['answer']) for entry in session['chat_history']]
-        return []
-    
+        return await history_store.get_turns(session_id)
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
-        logger.error(f"Error fetching chat history for session_id: {session_id} - {str(e)}")
+        logger.error(f"Error fetching chat history for session_id: {session_id} - {str(e)}", exc_info=True)
+        return []
 
 def get_related_docs(bot_token):
     try:
 
-        docs = vector_collection.find({'bot_token':bot_token},{'text':1})
+        docs = collection.find({'bot_token':bot_token},{'embedding':0})
         logger.info(f"Fetched documents for Bot token: {bot_token}")
-        return [Document(page_content=doc['text']) for doc in docs]
+        return [Document(page_content=doc.pop('content'), metadata={**doc, '_id': str(doc['_id'])}) for doc in docs]
     except Exception as e:
         logger.info(f"Failed to Fetch Documents from Bot token: {bot_token} , Error : {str(e)}")
 
+def use_local_vector_backend():
+    # VECTOR_BACKEND=local serves similarity search from in-process indexes instead of Atlas
+    return os.getenv("VECTOR_BACKEND", "atlas").lower() == "local"
+
 def get_ensemble_retriever(bot_token, llm):
     try:
-        documents = get_related_docs(bot_token)
-        
-        retriever = vector_search().as_retriever(
-            search_type = "similarity_score_threshold",
-            search_kwargs = {
-                "k": 4,
-                "score_threshold": 0.25,
-                "pre_filter": { "bot_token": { "$eq": bot_token } }
-            })
-        retriever_from_llm=MultiQueryRetriever.from_llm(retriever=retriever,llm=llm)
+        if use_local_vector_backend():
+            retriever = LocalVectorRetriever(bot_token=bot_token, embeddings=vector_search().embeddings, k=4, score_threshold=0.25)
+        else:
+            retriever = vector_search().as_retriever(
+                search_type = "similarity_score_threshold",
+                search_kwargs = {
+                    "k": 4,
+                    "score_threshold": 0.25,
+                    "pre_filter": { "bot_token": { "$eq": bot_token } }
+                })
         # print("Documents : ", documents)
-        bm25_retriever = BM25Retriever.from_documents(documents)
-        bm25_retriever.k = 3
+        bm25_retriever = BM25IndexRetriever(bot_token=bot_token, loader=get_related_docs, k=3)
         logger.info("Ensemble retriever created.")
-        return [EnsembleRetriever(retrievers=[bm25_retriever, retriever_from_llm],weights=[0.3, 0.7]),retriever]
+        return [HybridRetriever(vector_retriever=retriever, keyword_retriever=bm25_retriever, llm=llm, keyword_weight=0.3, vector_weight=0.7), retriever]
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
-        logger.error(f"Ensemble retriever creation Failed. Bot Token : {bot_token} - Error : {str(e)}")
+        logger.error(f"Ensemble retriever creation Failed. Bot Token : {bot_token} - Error : {str(e)}", exc_info=True)
 
 def get_assistant_details(bot_token:str):
     try:
         url = os.getenv("BACKEND_ENDPOINT")+f"/assistants/get-assistant-details/{bot_token}/"
-        response = requests.get(url)
-        print(response, url)
+        response = backend_session.get(url, timeout=float(os.getenv("ASSISTANT_REQUEST_TIMEOUT", "5")))
         return {"status":response.status_code, "data":response.json()}
     except Exception as e:
         logger.error(f"Failed to Fetch Assistant Details Bot Token: {bot_token} - Error : {str(e)}")
-        return {"message":"Failed to fetch assisstant detials", "error":str(e)}
+        return {"status": 503, "data": {"message": "Failed to fetch assistant details", "error": str(e)}}
 
-def format_context(docs):
-    context_parts = []
-    for doc in docs:
-        context_parts.append(f"Title: {doc.metadata['title']}\nSummary: {doc.metadata['summary']}\nContent: {doc.page_content}")
-    return "\n\n".join(context_parts)
+def format_context(docs, budget=None):
+    # Deduplicated, merged per source and cut to the token budget, see context_packing.py
+    return context_packer.pack(docs, budget)
 
 def get_retriever(bot_token):
+    if use_local_vector_backend():
+        return LocalVectorRetriever(bot_token=bot_token, embeddings=vector_store().embeddings, k=5)
     retriever = vector_store().as_retriever(search_type="similarity", search_kwargs={"k": 5, "pre_filter": { "bot_token": { "$eq": bot_token } }})
     return retriever
\ No newline at end of file
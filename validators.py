@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 class ChatRequest(BaseModel):
@@ -8,3 +10,4 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     questions:list
+    follow_up_id: Optional[str] = None
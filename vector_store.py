@@ -1,71 +1,162 @@
-import logging
-from pymongo import MongoClient
-from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+import gc
 import os
+import threading
+import time
+import pymongo
+from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
+from constants import client, DB_NAME, COLLECTION_NAME, ATLAS_VECTOR_SEARCH_INDEX_NAME, embedding_model_class
 from logger import logger
 
 class SingletonMeta(type):
     """
-    A Singleton metaclass that creates only one instance of a class.
+    A thread-safe Singleton metaclass that creates only one instance of a class per process.
     """
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 class EmbeddingModelManager(metaclass=SingletonMeta):
     """
-    Manages the initialization and retrieval of the HuggingFace BGE Embedding model.
+    Manages the process-wide text2vec embedding model so it is loaded exactly once.
     """
     def __init__(self):
-        self.model_name = "BAAI/bge-base-en-v1.5"
-        self.model_kwargs = {"device": "cpu"}
-        self.encode_kwargs = {"normalize_embeddings": True}
         self.embedding_model = None
+        self._lock = threading.Lock()
 
-    def get_embedding_model(self) -> HuggingFaceBgeEmbeddings:
+    def get_embedding_model(self) -> "ListConvertedText2vecEmbeddings":
         """
-        Returns the HuggingFace BGE Embedding model instance, initializing it if necessary.
-        
+        Returns the embedding model instance, loading it on first use.
+
         Returns:
-            HuggingFaceBgeEmbeddings: The embedding model instance.
+            ListConvertedText2vecEmbeddings: The shared embedding model instance.
         """
         if self.embedding_model is None:
-            self.embedding_model = HuggingFaceBgeEmbeddings(
-                model_name=self.model_name,
-                model_kwargs=self.model_kwargs,
-                encode_kwargs=self.encode_kwargs
-            )
-            logger.info("Initialized embedding model.")
+            with self._lock:
+                if self.embedding_model is None:
+                    start_time = time.time()
+                    # text2vec is only imported here, the first time the model is needed
+                    self.embedding_model = embedding_model_class()()
+                    logger.info(f"Initialized embedding model in {time.time() - start_time:.2f} seconds.")
         return self.embedding_model
 
+    def is_loaded(self) -> bool:
+        return self.embedding_model is not None
+
 class VectorStoreManager(metaclass=SingletonMeta):
     """
-    Manages the initialization and retrieval of the MongoDB Atlas Vector Store.
+    Manages the MongoDB Atlas Vector Store instances, all sharing the process-wide MongoClient.
     """
     def __init__(self):
-        self.atlas_connection_string = os.getenv("MONGO_DB_URI")
-        self.client = MongoClient(self.atlas_connection_string)
-        self.db_name = "VectorDatabase"
-        self.collection_name = "VectorCollections"
-        self.vector_store = None
+        self.client = client
+        self.ping_timeout = float(os.getenv("MONGO_PING_TIMEOUT", "2"))
+        self.vector_stores = {}
+        self._lock = threading.Lock()
 
-    def get_vector_store(self) -> MongoDBAtlasVectorSearch:
+    def get_vector_store(self, db_name: str = DB_NAME, collection_name: str = COLLECTION_NAME) -> MongoDBAtlasVectorSearch:
         """
-        Returns the MongoDB Atlas Vector Store instance, initializing it if necessary.
-        
+        Returns the MongoDB Atlas Vector Store for a namespace, initializing it if necessary.
+
+        Args:
+            db_name (str): The database holding the chunks.
+            collection_name (str): The collection holding the chunks.
+
         Returns:
             MongoDBAtlasVectorSearch: The vector store instance.
         """
-        if self.vector_store is None:
-            atlas_collection = self.client[self.db_name][self.collection_name]
-            embedding_model = EmbeddingModelManager().get_embedding_model()
-            self.vector_store = MongoDBAtlasVectorSearch(
-                embedding=embedding_model,
-                collection=atlas_collection
-            )
-            logger.info("Initialized vector store.")
-        return self.vector_store
+        namespace = f"{db_name}.{collection_name}"
+        vector_store = self.vector_stores.get(namespace)
+        if vector_store is None:
+            with self._lock:
+                vector_store = self.vector_stores.get(namespace)
+                if vector_store is None:
+                    # Queries are embedded through the batching service, see embedding_service.py
+                    from embedding_service import ServiceEmbeddings
+                    vector_store = MongoDBAtlasVectorSearch(
+                        collection=self.client[db_name][collection_name],
+                        embedding=ServiceEmbeddings(),
+                        index_name=ATLAS_VECTOR_SEARCH_INDEX_NAME,
+                        text_key="content"
+                    )
+                    self.vector_stores[namespace] = vector_store
+                    logger.info(f"Initialized vector store for {namespace}.")
+        return vector_store
+
+    def ping(self) -> bool:
+        try:
+            # Bounded so readiness probes get an answer quickly while Mongo is unreachable
+            with pymongo.timeout(self.ping_timeout):
+                self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB ping failed: {e}")
+            return False
+
+class ResourceRegistry(metaclass=SingletonMeta):
+    """
+    Warms the shared model and Mongo resources at startup and reports whether the process is ready to serve.
+    """
+    def __init__(self):
+        self.ready = False
+        self.preloaded = False
+        self.warmup_seconds = None
+        self.error = None
+
+    def preload(self):
+        """
+        Loads the embedding model in a pre-fork parent so forked workers share its weights
+        copy-on-write instead of each loading a private copy (see gunicorn.conf.py).
+
+        No inference runs here, so the model's thread pools are only created after the fork,
+        by each worker's `warm_up`.
+        """
+        start_time = time.time()
+        try:
+            EmbeddingModelManager().get_embedding_model()
+            self.preloaded = True
+        except Exception as e:
+            logger.error(f"Embedding model preload failed: {e}", exc_info=True)
+        # Move everything allocated so far out of the collector's generations so the workers'
+        # collections don't write to, and un-share, the inherited pages
+        gc.freeze()
+        logger.info(f"Preloaded shared resources in {time.time() - start_time:.2f} seconds.")
+
+    def warm_up(self):
+        """
+        Loads the embedding model, runs one embedding so lazy weights are initialized, and
+        creates the vector store. Safe to call more than once.
+        """
+        start_time = time.time()
+        try:
+            EmbeddingModelManager().get_embedding_model().embed_query("warm up")
+            VectorStoreManager().get_vector_store()
+            self.ready = True
+            self.error = None
+            self.warmup_seconds = round(time.time() - start_time, 3)
+            logger.info(f"Resources warmed up in {self.warmup_seconds} seconds.")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Resource warm up failed: {e}", exc_info=True)
+
+    def health(self) -> dict:
+        """
+        Returns the readiness of each shared resource. The process is ready once warm up has
+        completed and MongoDB answers a ping.
+        """
+        mongo_ok = VectorStoreManager().ping()
+        return {
+            "ready": self.ready and mongo_ok,
+            "embedding_model_loaded": EmbeddingModelManager().is_loaded(),
+            "embedding_model_preloaded": self.preloaded,
+            "mongo": mongo_ok,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+            "pid": os.getpid(),
+        }
+
+resources = ResourceRegistry()
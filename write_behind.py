@@ -0,0 +1,169 @@
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from logger import logger
+
+load_dotenv()
+
+# Queued by `stop`; the worker flushes what it holds and exits when it reaches it
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Buffers write records in memory and persists them in the background with `bulk_write`.
+
+    A batch is flushed once WRITE_BEHIND_BATCH_SIZE records are queued or WRITE_BEHIND_FLUSH_MS
+    milliseconds after the first record arrived. The queue holds at most WRITE_BEHIND_QUEUE_SIZE
+    records; producers wait up to WRITE_BEHIND_ENQUEUE_TIMEOUT seconds for room and otherwise
+    write their record directly, which slows them down instead of dropping data. A failed batch
+    is retried WRITE_BEHIND_RETRIES times with exponential backoff and then moved to the
+    dead-letter collection. Pending records are flushed on shutdown.
+    """
+    def __init__(self, collection, to_operation: Callable[[dict], object], dead_letter_collection=None, key_field: str = None):
+        self.collection = collection
+        self.to_operation = to_operation
+        self.dead_letter_collection = dead_letter_collection
+        self.key_field = key_field
+        self.batch_size = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+        self.flush_interval = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200")) / 1000
+        self.queue_size = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+        self.enqueue_timeout = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "1"))
+        self.retries = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, List[dict]] = defaultdict(list)
+        self._counters = {
+            "enqueued": 0,
+            "direct_writes": 0,
+            "flushed": 0,
+            "batches": 0,
+            "retries": 0,
+            "dead_lettered": 0,
+        }
+
+    def start(self):
+        if self._worker_task is not None and not self._worker_task.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        """
+        Stops the background worker after flushing everything still queued.
+
+        The worker is stopped with a sentinel rather than cancelled: on Python 3.11 a
+        cancellation that lands as `wait_for` completes can be swallowed, leaving the worker
+        blocked on an empty queue and shutdown hanging.
+        """
+        if self._worker_task is None:
+            return
+        if not self._worker_task.done():
+            await self._queue.put(_STOP)
+            await self._worker_task
+        self._worker_task = None
+        remaining = []
+        while not self._queue.empty():
+            record = self._queue.get_nowait()
+            if record is not _STOP:
+                remaining.append(record)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+        logger.info(f"Write-behind queue flushed {len(remaining)} records on shutdown.")
+
+    async def enqueue(self, record: dict):
+        """
+        Queues a record for background persistence and returns as soon as it is accepted.
+        """
+        if self._worker_task is None or self._worker_task.done():
+            self.start()
+        if self.key_field:
+            self._pending[record[self.key_field]].append(record)
+        try:
+            await asyncio.wait_for(self._queue.put(record), self.enqueue_timeout)
+            self._counters["enqueued"] += 1
+        except asyncio.TimeoutError:
+            logger.warning("Write-behind queue is full, writing record directly.")
+            self._counters["direct_writes"] += 1
+            await self._flush([record])
+
+    def pending(self, key: str) -> List[dict]:
+        """
+        Returns records for a key that are queued but not yet persisted, oldest first.
+        """
+        return list(self._pending.get(key, ()))
+
+    def _forget(self, batch: List[dict]):
+        if not self.key_field:
+            return
+        for record in batch:
+            key = record[self.key_field]
+            records = self._pending.get(key)
+            if records and record in records:
+                records.remove(record)
+                if not records:
+                    del self._pending[key]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self._queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]):
+        delay = 0.1
+        for attempt in range(self.retries + 1):
+            try:
+                await self.collection.bulk_write([self.to_operation(record) for record in batch], ordered=True)
+                self._counters["flushed"] += len(batch)
+                self._counters["batches"] += 1
+                self._forget(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Write-behind batch of {len(batch)} records failed after {attempt + 1} attempts: {e}")
+                    break
+                self._counters["retries"] += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+        await self._dead_letter(batch)
+
+    async def _dead_letter(self, batch: List[dict]):
+        self._counters["dead_lettered"] += len(batch)
+        self._forget(batch)
+        try:
+            if self.dead_letter_collection is None:
+                raise RuntimeError("no dead-letter collection configured")
+            await self.dead_letter_collection.insert_many([
+                {"record": record, "failed_at": datetime.utcnow()} for record in batch
+            ])
+        except Exception as e:
+            logger.error(f"Failed to dead-letter {len(batch)} records: {e}. Records: {batch}")
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+        }